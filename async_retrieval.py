@@ -0,0 +1,189 @@
+"""
+Асинхронный поиск по базе знаний с пакетным эмбеддингом запросов.
+
+Синхронный get_relevant_documents занимает поток пула embed на все время
+эмбеддинга и поиска, а одновременные вопросы разных пользователей
+прогоняются через модель эмбеддингов по одному. Здесь поиск разделен на
+два шага:
+    - эмбеддинг: EmbeddingBatcher собирает запросы, пришедшие в течение
+      EMBED_BATCH_WINDOW_MS (или до EMBED_BATCH_MAX штук), и считает их
+      одним вызовом модели в пуле embed. Одинаковые запросы пачки
+      считаются один раз;
+    - поиск по готовому вектору (MMR/similarity хранилища или шарды) —
+      отдельное короткое задание в пуле embed.
+Генерация по найденным документам идет через очередь LLM и с поиском не
+пересекается. Результаты кэшируются в RetrievalCache тенанта.
+
+Пакетный путь требует эмбеддер с embed_documents, дающим те же векторы,
+что embed_query (модели sentence-transformers из каталога embeddings;
+префикс запроса E5 добавляется здесь). Ретриверы, которые не умеют искать
+по вектору, выполняются синхронно в пуле embed.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+from executors import run_in
+from retrieval_cache import RetrievalCache, cached_documents, store_documents
+
+logger = logging.getLogger(__name__)
+
+_batch_size = metrics.histogram(
+    "embed_batch_size", "Queries embedded per model call", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+_stage_seconds = metrics.histogram("retrieval_stage_seconds", "Duration of async retrieval stages")
+
+# Поиск по вектору поддерживается для этих типов поиска VectorStoreRetriever
+_VECTOR_SEARCH_TYPES = ("similarity", "mmr")
+
+
+def retriever_embeddings(retriever: Any) -> Optional[Any]:
+    """Эмбеддер ретривера: у коллекции он в vectorstore, у шардированного — у самого ретривера."""
+    return getattr(getattr(retriever, "vectorstore", None), "embeddings", None) \
+        or getattr(retriever, "embeddings", None)
+
+
+def embed_queries(embeddings: Any, texts: List[str]) -> List[List[float]]:
+    """
+    Эмбеддинги нескольких запросов одним вызовом модели.
+
+    PrefixedEmbeddings добавляет к embed_documents префикс документа,
+    поэтому для него модель вызывается напрямую с префиксом запроса.
+    """
+    prefix = getattr(embeddings, "query_prefix", "")
+    base = getattr(embeddings, "base", embeddings)
+    return base.embed_documents([prefix + text for text in texts])
+
+
+def supports_vector_search(retriever: Any) -> bool:
+    if retriever_embeddings(retriever) is None:
+        return False
+    if hasattr(retriever, "search_by_vector"):
+        return True
+    return getattr(retriever, "search_type", None) in _VECTOR_SEARCH_TYPES and hasattr(retriever, "vectorstore")
+
+
+def search_by_vector(retriever: Any, query: str, vector: List[float]) -> List[Any]:
+    """Поиск ретривером по готовому эмбеддингу запроса (с его параметрами k/fetch_k)."""
+    if hasattr(retriever, "search_by_vector"):
+        return retriever.search_by_vector(query, vector)
+    store = retriever.vectorstore
+    if retriever.search_type == "mmr":
+        return store.max_marginal_relevance_search_by_vector(vector, **retriever.search_kwargs)
+    return store.similarity_search_by_vector(vector, **retriever.search_kwargs)
+
+
+class EmbeddingBatcher:
+    """
+    Объединяет одновременные запросы на эмбеддинг в пачки.
+
+    Args:
+        embeddings: Эмбеддер LangChain
+        window: Сколько ждать попутные запросы после первого, сек
+        max_batch: Максимум запросов в пачке (пачка уходит сразу при наборе)
+        pool: Пул executors для вызова модели
+    """
+
+    def __init__(self, embeddings: Any, window: float = 0.002, max_batch: int = 16, pool: str = "embed"):
+        self.embeddings = embeddings
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.pool = pool
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    @classmethod
+    def from_env(cls, embeddings: Any) -> "EmbeddingBatcher":
+        return cls(
+            embeddings,
+            window=float(os.getenv("EMBED_BATCH_WINDOW_MS", "2")) / 1000,
+            max_batch=int(os.getenv("EMBED_BATCH_MAX", "16")),
+        )
+
+    async def embed(self, text: str) -> List[float]:
+        """Эмбеддинг запроса (вычисляется в пачке с одновременными запросами)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        _batch_size.observe(len(texts))
+        started = time.perf_counter()
+        try:
+            vectors = await run_in(self.pool, embed_queries, self.embeddings, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            _stage_seconds.observe(time.perf_counter() - started, stage="embed")
+        by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            # Ожидающий мог быть отменен (таймаут запроса) — результат ему не нужен
+            if not future.done():
+                future.set_result(by_text[text])
+
+
+# Один батчер на эмбеддер: модель разделяют все тенанты и снимки базы знаний
+_batchers: Dict[int, Tuple[Any, EmbeddingBatcher]] = {}
+
+
+def get_batcher(embeddings: Any) -> EmbeddingBatcher:
+    """Возвращает (создавая при первом обращении) батчер эмбеддера."""
+    entry = _batchers.get(id(embeddings))
+    if entry is None or entry[0] is not embeddings:
+        entry = _batchers[id(embeddings)] = (embeddings, EmbeddingBatcher.from_env(embeddings))
+    return entry[1]
+
+
+async def aretrieve_documents(retriever: Any, query: str, cache: Optional[RetrievalCache] = None,
+                              version: Optional[str] = None, pool: str = "embed") -> List[Any]:
+    """
+    Асинхронный поиск документов с кэшем и пакетным эмбеддингом.
+
+    Args:
+        retriever: Ретривер LangChain (VectorStoreRetriever или ShardedRetriever)
+        query: Поисковый запрос
+        cache: Кэш результатов (None — без кэширования)
+        version: Версия базы знаний ретривера
+        pool: Пул executors для поиска
+
+    Returns:
+        List[Document]: Найденные документы
+    """
+    docs = cached_documents(cache, version, query)
+    if docs is not None:
+        return docs
+
+    started = time.perf_counter()
+    if supports_vector_search(retriever):
+        vector = await get_batcher(retriever_embeddings(retriever)).embed(query)
+        searched = time.perf_counter()
+        docs = await run_in(pool, search_by_vector, retriever, query, vector)
+        _stage_seconds.observe(time.perf_counter() - searched, stage="search")
+    else:
+        docs = await run_in(pool, retriever.get_relevant_documents, query)
+    store_documents(cache, version, query, docs, time.perf_counter() - started)
+    return docs
@@ -1,8 +1,12 @@
 import os
+import time
 import logging
 import traceback
+import signal
 import asyncio
+import functools
 from datetime import datetime
+from typing import Callable, Optional
 from dotenv import load_dotenv
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
@@ -10,31 +14,71 @@ from telegram.ext import (
     MessageHandler,
     filters,
     ContextTypes,
-    CommandHandler
+    CommandHandler,
+    ApplicationHandlerStop
 )
 from flask_app import create_app, db as flask_db
 from flask_app.models import SessionLog
-from embeddings import init_vector_store, VectorStoreInitializationError
-from chains import init_qa_chain
-import threading
-
-# Настройка логирования
-os.makedirs("logs", exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('logs/bot.log', encoding='utf-8')
-    ]
-)
+from flask_app.server import StateExporter, get_state_dir, start_server_process, start_server_thread
+from embeddings import init_vector_store, build_vector_store, VectorStoreInitializationError
+from chains import init_qa_chain, answer_from_documents, count_tokens, read_system_prompt, SYSTEM_PROMPT_PATH
+from memory import ConversationStore, format_history, rewrite_query
+from kb_reload import KnowledgeBaseManager, read_kb_version
+from retrieval_cache import RetrievalCache
+from async_retrieval import aretrieve_documents
+from threading_config import ThreadingConfig
+from delivery import DeliveryQueue, split_message
+from postprocess import clean_answer
+from faq import FaqTable
+from warmup import format_warmup_report, warmup_from_env
+from tenants import Tenant, TenantConfig, load_tenants
+from update_queue import DurableUpdateQueue, UpdateQueueConsumer, UpdateQueueFullError
+from executors import ExecutorOverloadedError, run_in
+from coalesce import SingleFlight, normalize_question
+from llm_jobs import LLMScheduler, JobDeadlineExceeded, classify_priority
+from persistence import BatchWriter, SessionRecord, create_store
+from loop_monitor import LoopLagMonitor
+from profiling import ProfileRequestWatcher, ProfilerBusyError, get_profiler
+from logging_setup import bind_request, setup_logging
+import metrics
+
+# Настройка логирования: запись в файл и консоль в отдельном потоке (logging_setup)
+setup_logging(os.path.join("logs", "bot.log"))
 logger = logging.getLogger(__name__)
+# Записи обработки каждого сообщения — отдельный логгер, его можно сэмплировать
+# (LOG_SAMPLING=bot.requests=0.1); аргументы — %-стилем, чтобы отброшенные записи не форматировались
+request_logger = logging.getLogger(f"{__name__}.requests")
 
 # Глобальные переменные для хранения состояния бота
-retriever = None
-qa_chain = None
-is_initialized = False
-initialization_error = None
+loop_monitor = None
+session_store = None
+session_writer = None
+bot_loop = None
+update_queue = None
+# Приложения Telegram, прошедшие post_init (общие ресурсы закрываются после последнего)
+running_applications = set()
+
+MAX_ANSWER_CHARS = int(os.getenv("MAX_ANSWER_CHARS", "12000"))
+
+# Персистентная очередь текстовых сообщений (update_queue.py). С ней обновления,
+# полученные до перезапуска, не сбрасываются: Telegram доставит их повторно
+UPDATE_QUEUE_ENABLED = os.getenv("UPDATE_QUEUE", "1") == "1"
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "0" if UPDATE_QUEUE_ENABLED else "1") == "1"
+MESSAGE_FILTER = filters.TEXT & ~filters.COMMAND
+
+# Метрики обработки сообщений
+_requests_total = metrics.counter("bot_requests_total", "Processed user messages by outcome")
+_faq_hits = metrics.counter("faq_answers_served_total", "Answers served from the precomputed FAQ table")
+_request_latency = metrics.histogram("bot_request_latency_seconds", "End-to-end latency of answering a message")
+
+
+def bot_status() -> dict:
+    """Статус процесса бота для /health сервера."""
+    return {
+        "initialized": all(tenant.is_initialized for tenant in tenants),
+        "tenants": {tenant.name: tenant.is_initialized for tenant in tenants},
+        "loop_heartbeat_age": loop_monitor.heartbeat_age() if loop_monitor else None,
+    }
 
 
 def setup_environment():
@@ -47,7 +91,10 @@ def setup_environment():
             logger.warning("No .env file found or it's empty")
             
         # Проверка обязательных переменных окружения
-        required_vars = ["TELEGRAM_TOKEN", "HUGGINGFACEHUB_API_TOKEN"]
+        required_vars = ["HUGGINGFACEHUB_API_TOKEN"]
+        # В режиме нескольких ботов токены задаются в TENANTS_CONFIG
+        if not os.getenv("TENANTS_CONFIG"):
+            required_vars.insert(0, "TELEGRAM_TOKEN")
         missing_vars = [var for var in required_vars if not os.getenv(var)]
         
         if missing_vars:
@@ -57,17 +104,27 @@ def setup_environment():
             
         # Инициализация Flask приложения
         try:
+            # create_app применяет миграции схемы (persistence.migrations)
             flask_app = create_app()
-            with flask_app.app_context():
-                flask_db.create_all()
-                logger.info("Database tables verified/created")
+            logger.info("Database schema is up to date")
 
-            # Запускаем health-сервер во втором потоке, если не отключен
+            # Запускаем health/admin сервер (waitress), если не отключен.
+            # По умолчанию — отдельным процессом, чтобы не делить GIL с инференсом
             if os.getenv("ENABLE_HEALTH_SERVER", "1") == "1":
-                def run_health():
-                    flask_app.run(host="0.0.0.0", port=int(os.getenv("HEALTH_PORT", "5000")), debug=False, use_reloader=False, threaded=True)
-                threading.Thread(target=run_health, name="health-server", daemon=True).start()
-                logger.info("Health server started on /health")
+                port = int(os.getenv("HEALTH_PORT", "5000"))
+                if os.getenv("HEALTH_SERVER_MODE", "process") == "thread":
+                    start_server_thread(port=port)
+                else:
+                    state_dir = get_state_dir()
+                    StateExporter(
+                        state_dir,
+                        status_fn=bot_status,
+                        interval=float(os.getenv("STATE_EXPORT_INTERVAL", "5"))
+                    ).start()
+                    start_server_process(port=port, state_dir=state_dir)
+                # Запросы профилирования от /admin/profile (в обоих режимах — через STATE_DIR)
+                ProfileRequestWatcher(get_state_dir(), get_profiler()).start()
+                logger.info(f"Health server started on :{port}/health")
                 
         except Exception as e:
             error_msg = f"Failed to initialize Flask app: {str(e)}"
@@ -91,29 +148,142 @@ except Exception as e:
 
 # Загрузка конфигурации
 TOKEN = os.getenv("TELEGRAM_TOKEN")
-if not TOKEN:
+if not TOKEN and not os.getenv("TENANTS_CONFIG"):
     raise ValueError("TELEGRAM_TOKEN not set in .env")
 
-async def initialize_resources():
+
+def load_recent_turns(user_id: int, limit: int, since: datetime):
+    """
+    Загружает последние пары вопрос/ответ пользователя из SessionLog,
+    записанные позже since (UTC).
+
+    Вызывается из пула db: при подключенном асинхронном хранилище запрос
+    выполняется в event loop бота, иначе — через Flask ORM.
+    """
+    if session_store is not None and bot_loop is not None:
+        future = asyncio.run_coroutine_threadsafe(session_store.fetch_recent(user_id, limit, since), bot_loop)
+        return future.result(timeout=10)
+    with flask_app.app_context():
+        # Колонка query модели заслоняет SessionLog.query — запрос через сессию
+        rows = (
+            flask_db.session.query(SessionLog)
+            .filter_by(user_id=user_id)
+            .filter(SessionLog.timestamp > since)
+            .order_by(SessionLog.timestamp.desc())
+            .limit(limit)
+            .all()
+        )
+    return [(row.query, row.response) for row in reversed(rows)]
+
+
+def admin_ids() -> set:
+    """ID администраторов процесса из ADMIN_TELEGRAM_ID (через запятую) — администраторы всех ботов."""
+    raw = os.getenv("ADMIN_TELEGRAM_ID", "")
+    return {int(part) for part in raw.split(",") if part.strip().isdigit()}
+
+
+def request_priority(tenant: Tenant, user_id: int, query: str) -> str:
+    return classify_priority(
+        user_id, query,
+        admin_ids=tenant.config.admin_ids | admin_ids(),
+        paid_ids=tenant.config.priority_user_ids,
+        short_query_chars=int(os.getenv("PRIORITY_SHORT_QUERY_CHARS", "80"))
+    )
+
+
+def get_persist_dir() -> str:
+    return (
+        os.getenv("PERSIST_DIRECTORY")
+        or os.getenv("CHROMA_DB_PATH")
+        or "./chroma_db"
+    )
+
+
+def create_tenant(config: TenantConfig, persist_history: bool = True) -> Tenant:
+    """
+    Собирает состояние бота-тенанта: база знаний с горячей перезагрузкой,
+    кэш поиска, таблица FAQ и история диалогов.
+
+    Args:
+        config: Настройки тенанта
+        persist_history: Восстанавливать историю диалогов из SessionLog
+    """
+    kb_manager = KnowledgeBaseManager(
+        build_retriever=lambda: build_vector_store(config.persist_dir, fresh=True, shards=config.kb_shards),
+        build_chain=lambda retriever, system_prompt: init_qa_chain(retriever, system_prompt)[0],
+        read_prompt=lambda: read_system_prompt(config.system_prompt_path),
+        watch_paths=[config.system_prompt_path, config.persist_dir],
+        read_version=lambda: read_kb_version(config.persist_dir)
+    )
+    faq_table = None
+    if config.faq_table_path:
+        faq_table = FaqTable(config.faq_table_path, fuzzy_cutoff=float(os.getenv("FAQ_MATCH_THRESHOLD", "1.0")))
+    conversations = None
+    if os.getenv("CONVERSATION_MEMORY", "1") == "1":
+        persist = persist_history and os.getenv("CONVERSATION_PERSIST", "1") == "1"
+        conversations = ConversationStore.from_env(
+            count_tokens=count_tokens,
+            loader=load_recent_turns if persist else None
+        )
+    return Tenant(config, kb_manager, RetrievalCache.from_env(config.name), faq_table, conversations)
+
+
+def load_tenant_configs() -> list:
+    """Тенанты из TENANTS_CONFIG или единственный тенант из окружения."""
+    defaults = TenantConfig.from_env(SYSTEM_PROMPT_PATH, get_persist_dir())
+    path = os.getenv("TENANTS_CONFIG")
+    if not path:
+        return [defaults]
+    configs = load_tenants(path, defaults)
+    logger.info(f"Multi-tenant mode: {', '.join(config.name for config in configs)}")
+    return configs
+
+
+# Боты процесса. SessionLog общий и не различает ботов, поэтому при нескольких
+# тенантах история диалогов не восстанавливается из БД (только в памяти)
+tenant_configs = load_tenant_configs()
+tenants = [create_tenant(config, persist_history=len(tenant_configs) == 1) for config in tenant_configs]
+
+# Привязка потоков пулов llm и embed к ядрам (до создания пулов)
+ThreadingConfig.from_env().register_affinity()
+
+# Приоритетная очередь заданий LLM с дедлайнами
+llm_scheduler = LLMScheduler.from_env()
+for _config in tenant_configs:
+    llm_scheduler.set_weight(_config.name, _config.weight)
+LLM_JOB_TIMEOUT = float(os.getenv("LLM_JOB_TIMEOUT", "120")) or None
+
+# Объединение одинаковых одновременных запросов
+inflight = SingleFlight() if os.getenv("COALESCE_REQUESTS", "1") == "1" else None
+
+
+def get_tenant(context: ContextTypes.DEFAULT_TYPE) -> Tenant:
+    """Тенант приложения, получившего обновление."""
+    return context.application.bot_data["tenant"]
+
+
+async def initialize_resources(tenant: Tenant):
     """
     Асинхронная инициализация ресурсов бота.
     
+    Args:
+        tenant: Тенант, ресурсы которого инициализируются
+        
     Returns:
         bool: True если инициализация прошла успешно, иначе False
     """
-    global retriever, qa_chain, is_initialized, initialization_error
-    
     try:
-        logger.info("Starting resource initialization...")
+        logger.info(f"Starting resource initialization for tenant {tenant.name}...")
         
         # Сброс состояния
-        is_initialized = False
-        initialization_error = None
+        tenant.is_initialized = False
+        tenant.initialization_error = None
         
         # Инициализация векторного хранилища
         try:
             logger.info("Initializing vector store...")
-            retriever = await asyncio.to_thread(init_vector_store)
+            shards = tuple(tenant.config.kb_shards) if tenant.config.kb_shards else None
+            retriever = await asyncio.to_thread(init_vector_store, tenant.config.persist_dir, shards)
             if not retriever:
                 raise ValueError("Vector store initialization returned None")
             logger.info("Vector store initialized successfully")
@@ -121,45 +291,48 @@ async def initialize_resources():
         except VectorStoreInitializationError as e:
             error_msg = f"Failed to initialize vector store: {str(e)}"
             logger.error(error_msg)
-            initialization_error = error_msg
+            tenant.initialization_error = error_msg
             return False
             
         except Exception as e:
             error_msg = f"Unexpected error initializing vector store: {str(e)}"
             logger.error(error_msg)
             logger.error(traceback.format_exc())
-            initialization_error = error_msg
+            tenant.initialization_error = error_msg
             return False
         
         # Инициализация QA цепи
         try:
             logger.info("Initializing QA chain...")
-            qa_chain, system_prompt = await asyncio.to_thread(init_qa_chain, retriever)
-            if not qa_chain:
+            snapshot = await asyncio.to_thread(tenant.kb_manager.load, retriever)
+            if not snapshot.qa_chain:
                 raise ValueError("QA chain initialization returned None")
-            logger.info(f"QA chain initialized successfully with system prompt: {system_prompt[:100]}...")
-            
-            # Сохраняем system_prompt в глобальной области видимости
-            global _system_prompt
-            _system_prompt = system_prompt
+            tenant.kb_manager.swap(snapshot)
+            logger.info(f"QA chain initialized successfully with system prompt: {snapshot.system_prompt[:100]}...")
             
         except Exception as e:
             error_msg = f"Failed to initialize QA chain: {str(e)}"
             logger.error(error_msg)
             logger.error(traceback.format_exc())
-            initialization_error = error_msg
+            tenant.initialization_error = error_msg
             return False
         
+        # Прогрев эмбеддера, индекса и LLM до приема сообщений
+        tenant.warmup_timings = await warmup_from_env(snapshot, llm_scheduler, answer_from_documents, tenant.name)
+
+        # Отслеживание изменений базы знаний и промпта
+        tenant.kb_manager.start_watcher(float(os.getenv("KB_WATCH_INTERVAL", "30")))
+
         # Успешное завершение инициализации
-        is_initialized = True
-        logger.info("Resource initialization completed successfully")
+        tenant.is_initialized = True
+        logger.info(f"Resource initialization completed successfully for tenant {tenant.name}")
         return True
         
     except Exception as e:
         error_msg = f"Critical error during resource initialization: {str(e)}"
         logger.critical(error_msg)
         logger.critical(traceback.format_exc())
-        initialization_error = error_msg
+        tenant.initialization_error = error_msg
         return False
 
 
@@ -172,6 +345,234 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка команды /reset: сброс истории диалога"""
+    tenant = get_tenant(context)
+    if tenant.conversations is not None:
+        tenant.conversations.clear(update.effective_user.id)
+    await update.message.reply_text("История диалога очищена. Задайте новый вопрос.")
+
+
+def postprocess_answer(answer: str) -> str:
+    """Постобработка ответа модели (CPU-работа, выполняется в пуле cpu)."""
+    # Ограничение общей длины: длинные ответы делятся на сообщения при доставке
+    if len(answer) > MAX_ANSWER_CHARS:
+        logger.warning("Response too long, truncating...")
+    return clean_answer(answer, MAX_ANSWER_CHARS)
+
+
+def save_session_log(user_id: int, username: str, query: str, answer: str,
+                     latency_ms: int = None, cache_hit: bool = False) -> None:
+    """Сохраняет запрос и ответ в SessionLog (блокирующий вызов, пул db)."""
+    with flask_app.app_context():
+        log = SessionLog(
+            user_id=user_id,
+            username=username,
+            query=query,
+            response=answer[:2000],  # Обрезаем для SQLite
+            timestamp=datetime.utcnow(),
+            latency_ms=latency_ms,
+            cache_hit=cache_hit
+        )
+        flask_db.session.add(log)
+        flask_db.session.commit()
+
+
+async def reload_kb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка команды /reload: фоновая перезагрузка базы знаний (только для админа)"""
+    tenant = get_tenant(context)
+    if not tenant.is_admin(update.effective_user.id, admin_ids()):
+        return
+    await update.message.reply_text("🔄 Перезагружаю базу знаний...")
+
+    async def do_reload():
+        ok = await asyncio.to_thread(tenant.kb_manager.reload)
+        if ok:
+            text = (
+                f"✅ База знаний обновлена (версия {tenant.kb_manager.current.version}, "
+                f"индекс {tenant.kb_manager.current.kb_version})"
+            )
+        else:
+            text = f"❌ Перезагрузка не выполнена: {tenant.kb_manager.last_error or 'уже выполняется'}"
+        await update.message.reply_text(text)
+
+    context.application.create_task(do_reload())
+
+
+PROFILE_HELP = (
+    "Профилирование процесса:\n"
+    "/profile cpu [секунды] — профиль CPU всех потоков\n"
+    "/profile cpu stop — завершить профиль досрочно\n"
+    "/profile heap start|snapshot|stop — снимки памяти (tracemalloc) и их разница\n"
+    "/profile stacks — стеки потоков и задач asyncio"
+)
+
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка команды /profile: профилирование процесса (только для ADMIN_TELEGRAM_ID)"""
+    # Профиль охватывает весь процесс со всеми ботами — администраторы тенантов не допускаются
+    if update.effective_user.id not in admin_ids():
+        return
+    args = context.args or []
+    command = args[0].lower() if args else ""
+    action = args[1].lower() if len(args) > 1 else ""
+    profiler = get_profiler()
+
+    async def do_profile():
+        try:
+            if command == "cpu" and action == "stop":
+                stopped = profiler.stop_cpu()
+                await update.message.reply_text("⏹ Профиль CPU завершается" if stopped else "Профиль CPU не снимается")
+                return
+            if command == "cpu":
+                sampler = profiler.start_cpu(float(action or "10"))
+                await update.message.reply_text("⏱ Снимаю профиль CPU...")
+                while sampler.running:
+                    await asyncio.sleep(0.5)
+                result = await asyncio.to_thread(profiler.finish_cpu, sampler)
+            elif command == "heap":
+                result = await asyncio.to_thread(profiler.heap, action or "snapshot")
+            elif command == "stacks":
+                result = await asyncio.to_thread(profiler.stacks)
+            else:
+                await update.message.reply_text(PROFILE_HELP)
+                return
+        except (ProfilerBusyError, ValueError) as e:
+            await update.message.reply_text(f"❌ {e}")
+            return
+
+        if "path" not in result:
+            await update.message.reply_text(f"Heap: {result['status']}")
+            return
+        await update.message.reply_text(result["summary"][:3500])
+        with open(result["path"], "rb") as f:
+            await update.message.reply_document(f, filename=os.path.basename(result["path"]))
+
+    context.application.create_task(do_profile())
+
+
+async def generate_answer(tenant: Tenant, snapshot, query: str, search_query: str, history: str,
+                          priority: str = "normal") -> str:
+    """
+    Генерирует и постобрабатывает ответ на вопрос.
+
+    Args:
+        tenant: Тенант (кэш поиска и доля в очереди LLM)
+        snapshot: Снимок базы знаний (QA цепь)
+        query: Вопрос пользователя
+        search_query: Запрос для поиска по базе знаний
+        history: Форматированная история диалога
+        priority: Класс приоритета задания LLM
+
+    Returns:
+        str: Готовый к отправке ответ
+
+    Raises:
+        JobDeadlineExceeded: Ответ не получен за LLM_JOB_TIMEOUT
+    """
+    request_logger.info("Calling QA chain (priority %s)", priority)
+    # Поиск выполняется в отдельном пуле embed и не занимает слот LLM;
+    # эмбеддинги одновременных запросов считаются одной пачкой
+    docs = await aretrieve_documents(
+        snapshot.qa_chain.retriever, search_query, tenant.retrieval_cache, snapshot.kb_version
+    )
+    result = await llm_scheduler.submit(
+        answer_from_documents, snapshot.qa_chain, docs, query, history,
+        priority=priority, timeout=LLM_JOB_TIMEOUT, tenant=tenant.name
+    )
+    request_logger.info("QA chain call completed")
+
+    if not result:
+        raise ValueError("QA chain returned no result")
+
+    # Get the result using the output key we defined in init_qa_chain
+    answer = result.get("result", "").strip()
+
+    if not answer:
+        # If result is empty, try to get any available output
+        answer = str(result) if result else "Не удалось получить ответ от модели"
+
+    return await run_in("cpu", postprocess_answer, answer)
+
+
+async def enqueue_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Сохраняет текстовое сообщение в персистентную очередь вместо немедленной
+    обработки (группа -1). Обработчики вызывает UpdateQueueConsumer.
+    """
+    tenant = get_tenant(context)
+    if tenant.update_consumer is None or update.update_id in tenant.replaying:
+        return
+    try:
+        stored = await run_in("db", update_queue.enqueue, tenant.name, update.update_id, update.to_dict())
+    except (UpdateQueueFullError, ExecutorOverloadedError):
+        # Перегрузка очереди или пула db: отказываем, а не обходим ограничение
+        await update.message.reply_text(
+            "⏳ Сейчас слишком много запросов. Пожалуйста, повторите вопрос через несколько минут."
+        )
+        raise ApplicationHandlerStop
+    except Exception as e:
+        # Очередь недоступна — обрабатываем сразу, как без нее
+        logger.error(f"Failed to persist update {update.update_id}, processing it directly: {e}")
+        return
+    if stored:
+        tenant.update_consumer.notify()
+    raise ApplicationHandlerStop
+
+
+def make_update_processor(application: Application):
+    """Обработчик записей очереди: восстанавливает Update и передает его обработчикам приложения."""
+    tenant = application.bot_data["tenant"]
+
+    async def process(update_id: int, payload: dict) -> None:
+        update = Update.de_json(payload, application.bot)
+        outcomes = tenant.replaying[update_id] = []
+        try:
+            await application.process_update(update)
+            # Запись выполнена, только когда ответ отправлен: до этого он живет
+            # лишь в памяти очереди доставки и теряется при падении процесса
+            for outcome in outcomes:
+                await outcome
+        finally:
+            tenant.replaying.pop(update_id, None)
+
+    return process
+
+
+def track_outcome(tenant: Tenant, update: Update) -> Optional[Callable[[Optional[BaseException]], None]]:
+    """
+    Регистрирует исход обработки обновления из персистентной очереди.
+
+    Returns:
+        Callable: Функция завершения (None — успех, иначе ошибка) или None,
+        если обновление пришло не из очереди
+    """
+    outcomes = tenant.replaying.get(update.update_id)
+    if outcomes is None:
+        return None
+    future = asyncio.get_running_loop().create_future()
+    outcomes.append(future)
+
+    def finish(error: Optional[BaseException] = None) -> None:
+        if future.done():
+            return
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+    return finish
+
+
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ошибка обработчика: в лог и, для обновления из очереди, в исход его записи."""
+    logger.error(f"Unhandled error while processing update: {context.error}", exc_info=context.error)
+    if isinstance(update, Update):
+        finish = track_outcome(get_tenant(context), update)
+        if finish is not None:
+            finish(context.error)
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Асинхронный обработчик входящих сообщений.
@@ -180,17 +581,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         update: Объект обновления от Telegram API
         context: Контекст выполнения обработчика
     """
-    global is_initialized, initialization_error
+    tenant = get_tenant(context)
     
     # Проверка инициализации бота
-    if not is_initialized:
+    if not tenant.is_initialized:
         error_msg = "Бот еще не инициализирован. "
-        if initialization_error:
-            error_msg += f"Ошибка инициализации: {initialization_error}"
+        if tenant.initialization_error:
+            error_msg += f"Ошибка инициализации: {tenant.initialization_error}"
         else:
             error_msg += "Попробуйте через 30 секунд."
             
-        logger.warning(f"Bot not initialized. Error: {initialization_error or 'No error details'}")
+        logger.warning(f"Bot not initialized. Error: {tenant.initialization_error or 'No error details'}")
         await update.message.reply_text(error_msg)
         return
         
@@ -199,7 +600,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     username = update.effective_user.username or "unknown"
     query = (update.message.text or '').strip()
     
-    logger.info(f"New message from user {user_id} (@{username}): {query[:100]}")
+    bind_request(tenant.name, user_id)
+    # Текст вопроса — только на уровне DEBUG: это персональные данные и лишняя нагрузка на лог
+    request_logger.info("New message from user %s (@%s), %d chars", user_id, username, len(query))
+    request_logger.debug("Query text: %s", query)
 
     # Валидация запроса
     if not query:
@@ -214,53 +618,69 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("Ваш запрос слишком длинный. Пожалуйста, ограничьтесь 1000 символами.")
         return
 
+    started = time.perf_counter()
+    cache_hit = False
     try:
-        # Проверяем инициализацию QA цепи
-        if not qa_chain:
+        # Фиксируем версию базы знаний на время запроса: перезагрузка
+        # не затрагивает уже начатые запросы
+        snapshot = tenant.kb_manager.current
+        if snapshot is None or not snapshot.qa_chain:
             raise RuntimeError("QA цепь не инициализирована")
 
         # Отправляем уведомление о начале обработки
         processing_msg = await update.message.reply_text("⏳ Обрабатываю ваш запрос...")
         
         # Асинхронное выполнение запроса к LLM
-        logger.info(f"Processing query from user {user_id}")
+        request_logger.info("Processing query")
         try:
             # Get relevant context from the retriever
             try:
-                # Вызов QA цепи: она сама выполнит ретрив с заданным retriever
-                logger.info("Calling QA chain with question only...")
-                result = await asyncio.to_thread(lambda: qa_chain({"question": query}))
-                logger.info("QA chain call completed")
+                # История диалога: уточняющий вопрос переписывается для поиска,
+                # а предыдущие реплики подставляются в промпт
+                history = ""
+                search_query = query
+                if tenant.conversations is not None:
+                    summary, turns = await run_in("db", tenant.conversations.get_history, user_id)
+                    history = format_history(summary, turns)
+                    search_query = rewrite_query(query, turns)
+
+                # Готовый ответ из таблицы частых вопросов (только для самостоятельных вопросов)
+                faq_answer = None
+                if tenant.faq_table is not None and search_query == query:
+                    faq_answer = await run_in("cpu", tenant.faq_table.lookup, query, snapshot.kb_version)
+
+                # Одинаковые одновременные вопросы к той же версии базы знаний
+                # обслуживаются одной генерацией
+                priority = request_priority(tenant, user_id, query)
+                generate = functools.partial(generate_answer, tenant, snapshot, query, search_query, history, priority)
+                if faq_answer is not None:
+                    cache_hit = True
+                    _faq_hits.inc()
+                    answer = await run_in("cpu", postprocess_answer, faq_answer)
+                    request_logger.info("Answer served from FAQ table")
+                elif inflight is not None:
+                    key = (tenant.name, snapshot.version, normalize_question(query),
+                           normalize_question(search_query), history)
+                    answer, shared = await inflight.run(key, generate)
+                    if shared:
+                        request_logger.info("Answer shared with an identical in-flight request")
+                else:
+                    answer = await generate()
                 
+            except JobDeadlineExceeded:
+                raise
             except Exception as e:
                 logger.error(f"Error in QA chain processing: {str(e)}")
                 logger.error(traceback.format_exc())
                 raise RuntimeError(f"Ошибка при обработке запроса: {str(e)}")
             
-            if not result:
-                raise ValueError("QA chain returned no result")
-                
-            # Get the result using the output key we defined in init_qa_chain
-            answer = result.get("result", "").strip()
-            
-            if not answer:
-                # If result is empty, try to get any available output
-                answer = str(result) if result else "Не удалось получить ответ от модели"
-                
-            # Обрезка слишком длинных ответов
-            if len(answer) > 4000:
-                logger.warning("Response too long, truncating...")
-                answer = answer[:4000] + "\n\n[Ответ обрезан из-за ограничений Telegram]"
-                
-            # Удаляем технические теги из ответа, если они есть
-            answer = answer.replace("<|im_start|>", "").replace("<|im_end|>", "").strip()
-            
-            # Удаляем дублирующиеся пробелы и переносы строк
-            import re
-            answer = re.sub(r'\s+', ' ', answer).strip()
-            
-            logger.info(f"Generated answer length: {len(answer)} characters")
+            request_logger.info("Generated answer length: %d characters", len(answer))
+
+            if tenant.conversations is not None:
+                tenant.conversations.add_turn(user_id, query, answer)
                 
+        except JobDeadlineExceeded:
+            raise
         except Exception as e:
             error_msg = f"Ошибка при обработке запроса: {str(e)}"
             logger.error(f"Error in QA chain: {error_msg}")
@@ -269,26 +689,41 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             
         # Сохранение лога в базу данных
         try:
-            with flask_app.app_context():
-                log = SessionLog(
+            latency_ms = int((time.perf_counter() - started) * 1000)
+            if session_writer is not None:
+                session_writer.log(SessionRecord(
                     user_id=user_id,
                     username=username,
                     query=query,
-                    response=answer[:2000],  # Обрезаем для SQLite
-                    timestamp=datetime.utcnow()
-                )
-                flask_db.session.add(log)
-                flask_db.session.commit()
-                logger.info(f"Query from user {user_id} logged to database")
+                    response=answer[:2000],
+                    timestamp=datetime.utcnow(),
+                    latency_ms=latency_ms,
+                    cache_hit=cache_hit
+                ))
+            else:
+                await run_in("db", save_session_log, user_id, username, query, answer, latency_ms, cache_hit)
+            request_logger.info("Query logged to database")
                 
         except Exception as e:
             logger.error(f"Failed to log query to database: {str(e)}")
             # Продолжаем выполнение, даже если не удалось сохранить лог
             
-        # Отправка ответа пользователю
+        # Отправка ответа пользователю: через очередь доставки (разбиение на
+        # сообщения, лимиты Telegram и повторы выполняются вне обработчика)
         try:
-            await processing_msg.edit_text(answer)
-            logger.info(f"Response sent to user {user_id}")
+            if tenant.delivery is not None:
+                await tenant.delivery.submit(
+                    update.effective_chat.id, answer, processing_msg, on_done=track_outcome(tenant, update)
+                )
+                request_logger.info("Response queued for delivery")
+            else:
+                chunks = split_message(answer)
+                await processing_msg.edit_text(chunks[0])
+                for chunk in chunks[1:]:
+                    await update.message.reply_text(chunk)
+                request_logger.info("Response sent")
+            _requests_total.inc(status="ok")
+            _request_latency.observe(time.perf_counter() - started)
             
         except Exception as e:
             logger.error(f"Failed to send response to user {user_id}: {str(e)}")
@@ -297,6 +732,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 "Попробуйте задать вопрос снова."
             )
             
+    except JobDeadlineExceeded:
+        logger.warning(f"Answer for user {user_id} not generated in time, job dropped")
+        _requests_total.inc(status="timeout")
+        try:
+            await update.message.reply_text(
+                "Извините, сейчас слишком много запросов и ответ не успел сформироваться. "
+                "Пожалуйста, повторите вопрос чуть позже."
+            )
+        except Exception as e:
+            logger.error(f"Failed to send timeout message to user {user_id}: {str(e)}")
+
     except Exception as e:
         error_msg = (
             "Извините, при обработке вашего запроса произошла ошибка. "
@@ -304,6 +750,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         logger.error(f"Error processing message from user {user_id}: {str(e)}")
         logger.error(traceback.format_exc())
+        _requests_total.inc(status="error")
         
         try:
             await update.message.reply_text(error_msg)
@@ -311,56 +758,136 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             logger.critical(f"CRITICAL: Failed to send error message to user {user_id}: {str(e)}")
 
 
+async def start_session_writer() -> None:
+    """Подключает асинхронное хранилище логов и запускает BatchWriter."""
+    global session_store, session_writer, bot_loop
+    with flask_app.app_context():
+        # Путь SQLite берем из движка: Flask-SQLAlchemy разрешает относительные пути сам
+        database_uri = flask_db.engine.url.render_as_string(hide_password=False)
+    try:
+        store = create_store(database_uri)
+        await store.connect()
+    except Exception as e:
+        logger.error(f"Async session store unavailable, falling back to ORM writes: {e}")
+        return
+    writer = BatchWriter(
+        store,
+        batch_size=int(os.getenv("SESSION_LOG_BATCH_SIZE", "200")),
+        flush_interval=float(os.getenv("SESSION_LOG_FLUSH_INTERVAL", "0.5")),
+        max_queue=int(os.getenv("SESSION_LOG_MAX_QUEUE", "10000"))
+    )
+    writer.start()
+    session_store, session_writer = store, writer
+    bot_loop = asyncio.get_running_loop()
+    logger.info("Async session log writer started")
+
+
+async def notify_admins(application: Application, tenant: Tenant, text: str) -> None:
+    """Уведомление администраторам тенанта (ошибки отправки только логируются)."""
+    for admin_id in sorted(tenant.config.admin_ids):
+        try:
+            await application.bot.send_message(chat_id=admin_id, text=text)
+        except Exception as e:
+            logger.warning(f"Failed to send notification to admin {admin_id}: {str(e)}")
+
+
+async def post_stop(application: Application) -> None:
+    """
+    Дожидается обновлений из очереди и отправки ответов, пока бот еще может
+    отправлять сообщения (незавершенные обновления продолжатся после запуска).
+    """
+    tenant = application.bot_data["tenant"]
+    await tenant.stop_processing(float(os.getenv("UPDATE_QUEUE_SHUTDOWN_TIMEOUT", "10")))
+
+
+async def post_shutdown(application: Application) -> None:
+    """После последнего бота дописывает буфер логов и закрывает БД (доставка остановлена в post_stop)."""
+    global session_store, session_writer, update_queue
+    running_applications.discard(id(application))
+    if running_applications:
+        return
+    await llm_scheduler.close()
+    if session_writer is not None:
+        await session_writer.close()
+        session_writer = None
+    if session_store is not None:
+        await session_store.close()
+        session_store = None
+    if update_queue is not None:
+        update_queue.close()
+        update_queue = None
+
+
 async def post_init(application: Application) -> None:
     """
     Post-initialization hook for the Telegram bot application.
     
     This function is called after the application is created but before it starts polling.
     It initializes all required resources and handles any initialization errors.
+    Resources shared by all tenants (session log writer, loop monitor) are started once.
     
     Args:
         application: The Telegram bot application instance
     """
-    global is_initialized, initialization_error
+    tenant = application.bot_data["tenant"]
     
     try:
-        logger.info("Starting bot initialization...")
+        logger.info(f"Starting bot initialization (tenant {tenant.name})...")
         
         # Initialize resources
-        success = await initialize_resources()
+        success = await initialize_resources(tenant)
         
         if not success:
-            error_msg = (
-                "⚠️ Не удалось инициализировать бота. "
-                f"Причина: {initialization_error or 'неизвестная ошибка'}"
-            )
             logger.critical("Bot initialization failed")
             
             # Try to notify admin if possible
-            admin_id = os.getenv("ADMIN_TELEGRAM_ID")
-            if admin_id and admin_id.isdigit():
-                try:
-                    await application.bot.send_message(
-                        chat_id=int(admin_id),
-                        text=f"❌ Ошибка инициализации бота: {initialization_error or 'Неизвестная ошибка'}"
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to send error notification to admin: {str(e)}")
+            await notify_admins(
+                application, tenant,
+                f"❌ Ошибка инициализации бота: {tenant.initialization_error or 'Неизвестная ошибка'}"
+            )
             
-            raise RuntimeError(f"Bot initialization failed: {initialization_error}")
+            raise RuntimeError(f"Bot initialization failed: {tenant.initialization_error}")
             
         logger.info("Bot initialization completed successfully")
+        running_applications.add(id(application))
+        get_profiler().loop = asyncio.get_running_loop()
+
+        # Очередь доставки ответов (лимиты Telegram — на каждого бота)
+        if os.getenv("DELIVERY_QUEUE", "1") == "1":
+            tenant.delivery = DeliveryQueue.from_env(
+                application.bot,
+                global_rate=tenant.config.delivery_global_rate,
+                chat_rate=tenant.config.delivery_chat_rate,
+                tenant=tenant.name
+            )
+            tenant.delivery.start()
+
+        # Персистентная очередь сообщений: незавершенные до перезапуска обрабатываются первыми
+        if UPDATE_QUEUE_ENABLED:
+            global update_queue
+            if update_queue is None:
+                update_queue = DurableUpdateQueue.from_env()
+            tenant.update_consumer = UpdateQueueConsumer(
+                update_queue, tenant.name, make_update_processor(application),
+                workers=int(os.getenv("UPDATE_QUEUE_WORKERS", "8"))
+            )
+            await tenant.update_consumer.start()
+
+        # Асинхронная запись логов сессий пачками
+        if os.getenv("SESSION_LOG_ASYNC", "1") == "1" and session_writer is None:
+            await start_session_writer()
+
+        # Мониторинг задержки event loop
+        global loop_monitor
+        if os.getenv("LOOP_MONITOR", "1") == "1" and loop_monitor is None:
+            loop_monitor = LoopLagMonitor.from_env()
+            loop_monitor.start()
         
         # Send startup notification to admin
-        admin_id = os.getenv("ADMIN_TELEGRAM_ID")
-        if admin_id and admin_id.isdigit():
-            try:
-                await application.bot.send_message(
-                    chat_id=int(admin_id),
-                    text="✅ Бот успешно запущен и готов к работе!"
-                )
-            except Exception as e:
-                logger.warning(f"Failed to send startup notification to admin: {str(e)}")
+        await notify_admins(application, tenant, "\n".join(filter(None, [
+            "✅ Бот успешно запущен и готов к работе!",
+            format_warmup_report(tenant.warmup_timings)
+        ])))
                 
     except Exception as e:
         logger.critical(f"Critical error in post_init: {str(e)}")
@@ -368,20 +895,88 @@ async def post_init(application: Application) -> None:
         raise
 
 
-def main():
-    # Создание и настройка приложения
-    application = Application.builder().token(TOKEN).post_init(post_init).build()
+def build_application(token: str = None, base_url: str = None, tenant: Tenant = None) -> Application:
+    """
+    Создает приложение Telegram с зарегистрированными обработчиками.
+
+    Args:
+        token: Токен бота (по умолчанию — токен тенанта)
+        base_url: Адрес Bot API (локальный сервер или заглушка для нагрузочных тестов)
+        tenant: Тенант приложения (по умолчанию — первый)
+    """
+    tenant = tenant or tenants[0]
+    token = token or tenant.config.token or TOKEN
+    builder = (
+        Application.builder().token(token)
+        .post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+    )
+    base_url = base_url or os.getenv("TELEGRAM_API_BASE_URL")
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    application.bot_data["tenant"] = tenant
 
     # Регистрация обработчиков
+    application.add_handler(MessageHandler(MESSAGE_FILTER, enqueue_update), group=-1)
     application.add_handler(CommandHandler("start", start))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(CommandHandler("reset", reset))
+    application.add_handler(CommandHandler("reload", reload_kb))
+    application.add_handler(CommandHandler("profile", profile))
+    application.add_handler(MessageHandler(MESSAGE_FILTER, handle_message))
+    application.add_error_handler(on_error)
+    return application
+
+
+async def run_tenants(applications: list) -> None:
+    """
+    Запускает несколько приложений Telegram в одном event loop
+    (run_polling рассчитан на одно приложение) и останавливает их по SIGINT/SIGTERM.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остановка через KeyboardInterrupt
+
+    started = []
+    try:
+        for application in applications:
+            await application.initialize()
+            await application.post_init(application)
+            await application.updater.start_polling(poll_interval=0.5, drop_pending_updates=DROP_PENDING_UPDATES)
+            await application.start()
+            started.append(application)
+        logger.info(f"{len(started)} bots are running")
+        await stop.wait()
+    finally:
+        for application in reversed(started):
+            await application.updater.stop()
+            await application.stop()
+            await application.post_stop(application)
+            await application.shutdown()
+            await application.post_shutdown(application)
+
+
+def main():
+    if len(tenants) > 1:
+        applications = [build_application(tenant=tenant) for tenant in tenants]
+        try:
+            asyncio.run(run_tenants(applications))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    # Создание и настройка приложения
+    application = build_application()
 
     # Запуск бота
     application.run_polling(
         poll_interval=0.5,
-        drop_pending_updates=True
+        drop_pending_updates=DROP_PENDING_UPDATES
     )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Калибровка бэкенда инференса под конкретный хост.
+
+Для каждой доступной конфигурации (бэкенд, точность, число потоков)
+выполняется короткий фиксированный бенчмарк: prefill и decode нескольких
+типичных промптов. Каждая конфигурация запускается в отдельном процессе
+(python calibration.py bench ...), чтобы модели не занимали память
+одновременно, а настройки потоков не влияли друг на друга.
+
+Победитель сохраняется в CALIBRATION_PATH по отпечатку хоста и
+используется при INFERENCE_BACKEND=auto (см. chains.init_llm_pipeline).
+
+Запуск вручную:
+    python calibration.py run [--force]
+    python calibration.py show
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import platform
+import subprocess
+import importlib.util
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CALIBRATION_PATH = "models/calibration.json"
+
+# Типичная длина ответа в токенах для оценки полной задержки
+TYPICAL_ANSWER_TOKENS = 200
+DECODE_TOKENS = 32
+
+_CONTEXT = (
+    "Доставка по Москве в пределах МКАД стоит 500 рублей, за МКАД — 500 рублей плюс 30 рублей за километр. "
+    "Заказы от 30000 рублей доставляются бесплатно. Оплата возможна картой, наличными курьеру или по счету "
+    "для юридических лиц. Гарантия на мебель — 18 месяцев, на механизмы кресел — 3 года. "
+) * 3
+
+BENCH_QUESTIONS = [
+    "Сколько стоит доставка за МКАД на 20 километров?",
+    "Можно ли оплатить заказ по счету для организации?",
+    "Какая гарантия на офисное кресло?",
+]
+
+
+def _cpu_info() -> Dict[str, str]:
+    info = {"model": platform.processor() or platform.machine(), "flags": ""}
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "model name":
+                    info["model"] = value.strip()
+                elif key == "flags":
+                    info["flags"] = value.strip()
+                    break
+    except OSError:
+        pass
+    return info
+
+
+def _total_memory_gb() -> int:
+    try:
+        return round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2 ** 30)
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def host_fingerprint(model_id: str) -> str:
+    """
+    Отпечаток хоста: модель CPU, число ядер, объем памяти, модель LLM и версии библиотек.
+
+    Returns:
+        str: Короткий хэш
+    """
+    parts = [
+        _cpu_info()["model"],
+        str(os.cpu_count()),
+        str(_total_memory_gb()),
+        model_id,
+    ]
+    for package in ("torch", "openvino", "transformers"):
+        try:
+            from importlib.metadata import version
+            parts.append(f"{package}={version(package)}")
+        except Exception:
+            parts.append(f"{package}=none")
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def candidate_configs() -> List[Dict]:
+    """Конфигурации, доступные на этом хосте."""
+    cpu_count = os.cpu_count() or 1
+    threads = sorted({cpu_count, max(1, cpu_count // 2)}, reverse=True)
+    flags = _cpu_info()["flags"].split()
+
+    precisions = ["float32"]
+    if "avx512_bf16" in flags or "amx_bf16" in flags:
+        precisions.append("bfloat16")
+
+    configs = [
+        {"backend": "cpu", "precision": precision, "threads": n}
+        for precision in precisions
+        for n in threads
+    ]
+    if importlib.util.find_spec("optimum") and importlib.util.find_spec("openvino"):
+        configs += [{"backend": "openvino", "precision": "default", "threads": n} for n in threads]
+    try:
+        import torch
+        if hasattr(torch, "xpu") and torch.xpu.is_available():
+            configs.append({"backend": "xpu", "precision": "bfloat16", "threads": threads[0]})
+    except Exception:
+        pass
+    return configs
+
+
+def config_env(config: Dict) -> Dict[str, str]:
+    """Переменные окружения, которыми chains.init_llm_pipeline применяет конфигурацию."""
+    env = {
+        "INFERENCE_BACKEND": config["backend"],
+        "LLM_NUM_THREADS": str(config["threads"]),
+    }
+    if config["backend"] in ("cpu", "xpu"):
+        env["DEVICE"] = config["backend"]
+        env["TORCH_DTYPE"] = config["precision"]
+    return env
+
+
+def bench_current_config() -> Dict[str, float]:
+    """
+    Бенчмарк пайплайна, созданного по текущим переменным окружения.
+
+    Returns:
+        Dict[str, float]: prefill_s, decode_token_s и оценка полной задержки estimated_s
+    """
+    from chains import init_llm_pipeline
+
+    llm = init_llm_pipeline()
+    pipe = llm.pipeline
+    prompts = [
+        f"<|im_start|>system\nТы — ассистент отдела продаж.\n<|im_end|>\n<|im_start|>user\n"
+        f"Context:\n{_CONTEXT}\n\nQuestion: {question}\n<|im_end|>\n<|im_start|>assistant\n"
+        for question in BENCH_QUESTIONS
+    ]
+    # Прогрев: первая генерация включает компиляцию/ленивую инициализацию
+    pipe(prompts[0], max_new_tokens=4, do_sample=False)
+
+    prefill, decode = [], []
+    for prompt in prompts:
+        started = time.perf_counter()
+        pipe(prompt, max_new_tokens=1, do_sample=False)
+        first = time.perf_counter() - started
+
+        started = time.perf_counter()
+        pipe(prompt, max_new_tokens=DECODE_TOKENS, min_new_tokens=DECODE_TOKENS, do_sample=False)
+        total = time.perf_counter() - started
+        prefill.append(first)
+        decode.append(max(total - first, 0.0) / (DECODE_TOKENS - 1))
+
+    prefill_s = sorted(prefill)[len(prefill) // 2]
+    decode_token_s = sorted(decode)[len(decode) // 2]
+    return {
+        "prefill_s": prefill_s,
+        "decode_token_s": decode_token_s,
+        "estimated_s": prefill_s + decode_token_s * TYPICAL_ANSWER_TOKENS,
+    }
+
+
+def _run_candidate(config: Dict, timeout: float) -> Optional[Dict[str, float]]:
+    env = dict(os.environ, **config_env(config))
+    try:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "bench"],
+            env=env, capture_output=True, text=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        logger.warning(f"Calibration of {config} timed out")
+        return None
+    if proc.returncode != 0:
+        logger.warning(f"Calibration of {config} failed: {proc.stderr.strip()[-500:]}")
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _read_all(path: str) -> Dict[str, Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_choice(model_id: str, path: Optional[str] = None) -> Optional[Dict]:
+    """Сохраненная конфигурация для этого хоста (None, если калибровки не было)."""
+    path = path or os.getenv("CALIBRATION_PATH", DEFAULT_CALIBRATION_PATH)
+    entry = _read_all(path).get(host_fingerprint(model_id))
+    return entry["choice"] if entry else None
+
+
+def calibrate(model_id: str, path: Optional[str] = None, timeout: float = 1800) -> Optional[Dict]:
+    """
+    Запускает бенчмарк всех доступных конфигураций и сохраняет лучшую.
+
+    Returns:
+        Optional[Dict]: Выбранная конфигурация (None, если ни одна не отработала)
+    """
+    path = path or os.getenv("CALIBRATION_PATH", DEFAULT_CALIBRATION_PATH)
+    results = []
+    for config in candidate_configs():
+        logger.info(f"Calibrating {config}...")
+        measured = _run_candidate(config, timeout)
+        if measured is not None:
+            logger.info(f"{config}: prefill {measured['prefill_s']:.2f}s, "
+                        f"decode {measured['decode_token_s'] * 1000:.0f}ms/token")
+            results.append(dict(config, **measured))
+    if not results:
+        logger.error("Calibration failed for all backends")
+        return None
+
+    best = min(results, key=lambda r: r["estimated_s"])
+    choice = {key: best[key] for key in ("backend", "precision", "threads")}
+    data = _read_all(path)
+    data[host_fingerprint(model_id)] = {
+        "choice": choice,
+        "results": results,
+        "host": {"cpu": _cpu_info()["model"], "cpus": os.cpu_count(), "memory_gb": _total_memory_gb()},
+        "model": model_id,
+        "measured_at": time.time(),
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    logger.info(f"Calibration finished, selected {choice} ({best['estimated_s']:.1f}s per typical answer)")
+    return choice
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Калибровка бэкенда инференса")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Измерить все конфигурации и сохранить лучшую")
+    run.add_argument("--force", action="store_true", help="Перекалибровать, даже если результат уже есть")
+    sub.add_parser("show", help="Показать сохраненную конфигурацию для этого хоста")
+    sub.add_parser("bench", help="(внутреннее) бенчмарк конфигурации из окружения")
+    args = parser.parse_args(argv)
+
+    model_id = os.getenv("MODEL_NAME", "Qwen/Qwen2-1.5B-Instruct")
+    if args.command == "bench":
+        logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+        print(json.dumps(bench_current_config()))
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "show":
+        print(json.dumps(load_choice(model_id), ensure_ascii=False))
+        return 0
+    if not args.force and load_choice(model_id) is not None:
+        logger.info(f"Host already calibrated: {load_choice(model_id)} (use --force to rerun)")
+        return 0
+    return 0 if calibrate(model_id) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
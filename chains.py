@@ -1,9 +1,13 @@
 import os
+import time
+import random
 import torch
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     BitsAndBytesConfig,
+    StoppingCriteria,
+    StoppingCriteriaList,
     pipeline
 )
 # Импорты для Intel Extension for Transformers
@@ -33,10 +37,18 @@ except Exception as e:
     OPENVINO_AVAILABLE = False
 
 from langchain.llms import HuggingFacePipeline
+from langchain.llms.base import LLM
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 import logging
 
+from memory import approx_token_count
+from llm_jobs import should_stop_current_job, step_current_job
+from postprocess import end_of_turn_token_ids
+from weights_mmap import convert_to_safetensors, default_mmap_dir, load_mmap_model
+from calibration import calibrate, load_choice as load_calibration
+from threading_config import ThreadingConfig
+
 # Глобальные переменные для кэширования
 _llm_pipe = None
 _qa_chain = None
@@ -53,18 +65,59 @@ _llm_pipe = None
 _system_prompt = None
 
 
-def load_system_prompt(path: str = "knowledge_base/system_prompt.txt") -> str:
+SYSTEM_PROMPT_PATH = "knowledge_base/system_prompt.txt"
+# verbose цепи печатает в stdout полный промпт со всем контекстом на каждый вызов — только для отладки
+CHAIN_VERBOSE = os.getenv("CHAIN_VERBOSE", "0") == "1"
+
+
+def read_system_prompt(path: str = SYSTEM_PROMPT_PATH) -> str:
+    """Читает системный промпт с диска без кэширования (ошибки пробрасываются)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def load_system_prompt(path: str = SYSTEM_PROMPT_PATH, reload: bool = False) -> str:
     global _system_prompt
-    if _system_prompt is None:
+    if _system_prompt is None or reload:
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                _system_prompt = f.read().strip()
+            _system_prompt = read_system_prompt(path)
         except Exception as e:
             logging.error(f"Error loading system prompt: {e}")
             _system_prompt = "Ты — ассистент отдела продаж. Отвечай на вопросы клиентов."
     return _system_prompt
 
 
+class JobStoppingCriteria(StoppingCriteria):
+    """Останавливает декодирование, если текущее задание LLM отменено, просрочено или достигло max_new_tokens."""
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return step_current_job()
+
+
+def stopping_criteria() -> StoppingCriteriaList:
+    return StoppingCriteriaList([JobStoppingCriteria()])
+
+
+class StubLLM(LLM):
+    """Заглушка LLM с настраиваемой задержкой для нагрузочного тестирования."""
+
+    latency_ms: float = 500.0
+    jitter_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _call(self, prompt: str, stop=None, run_manager=None, **kwargs) -> str:
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        deadline = time.monotonic() + max(delay, 0.0) / 1000.0
+        # "Декодирование" короткими шагами, чтобы отмена задания прерывала его
+        while time.monotonic() < deadline and not should_stop_current_job():
+            time.sleep(min(0.05, max(deadline - time.monotonic(), 0.0)))
+        question = prompt.rsplit("Question:", 1)[-1].split("<|im_end|>", 1)[0].strip()
+        return f"Тестовый ответ на вопрос: {question}"
+
+
 def init_llm_pipeline():
     """Инициализация LLM пайплайна с возможностью выбора бэкенда (OpenVINO / Torch)."""
     global _llm_pipe
@@ -73,7 +126,32 @@ def init_llm_pipeline():
 
     model_id = os.getenv("MODEL_NAME", "Qwen/Qwen2-1.5B-Instruct")
     cache_dir = os.getenv("HF_HOME")
-    backend = os.getenv("INFERENCE_BACKEND", "auto").lower()  # openvino | xpu | cpu | auto
+    backend = os.getenv("INFERENCE_BACKEND", "auto").lower()  # openvino | xpu | cpu | auto | stub
+
+    # Заглушка без загрузки модели (нагрузочные тесты)
+    if backend == "stub":
+        _llm_pipe = StubLLM(
+            latency_ms=float(os.getenv("STUB_LLM_LATENCY_MS", "500")),
+            jitter_ms=float(os.getenv("STUB_LLM_JITTER_MS", "0"))
+        )
+        logging.info(f"Stub LLM initialized (latency {_llm_pipe.latency_ms} ms)")
+        return _llm_pipe
+
+    # Конфигурация, выбранная калибровкой для этого хоста (calibration.py)
+    threads = ThreadingConfig.from_env()
+    cpu_dtype_name = os.getenv("TORCH_DTYPE", "float32")
+    if backend == "auto":
+        choice = load_calibration(model_id)
+        if choice is None and os.getenv("CALIBRATE_ON_START", "0") == "1":
+            logging.info("No calibration for this host, running backend benchmark...")
+            choice = calibrate(model_id)
+        if choice is not None:
+            logging.info(f"Using calibrated backend configuration: {choice}")
+            backend = choice["backend"]
+            threads.llm_threads = threads.llm_threads or choice["threads"]
+            if choice["backend"] == "cpu":
+                cpu_dtype_name = os.getenv("TORCH_DTYPE", choice["precision"])
+    threads.apply_torch()
 
     # Загружаем токенизатор
     tokenizer = AutoTokenizer.from_pretrained(
@@ -94,6 +172,7 @@ def init_llm_pipeline():
                 export=True,
                 compile=True,
                 device=ov_device,
+                ov_config=threads.openvino_config() or None,
                 cache_dir=cache_dir,
                 trust_remote_code=True
             )
@@ -106,13 +185,18 @@ def init_llm_pipeline():
                 top_p=0.9,
                 repetition_penalty=1.1,
                 return_full_text=True,
+                stopping_criteria=stopping_criteria(),
+                # Остановка на токенах конца реплики: иначе модель дописывает следующие
+                # реплики чата; сами специальные токены pipeline убирает при декодировании
+                eos_token_id=end_of_turn_token_ids(tokenizer),
             )
             _llm_pipe = HuggingFacePipeline(pipeline=text_generation_pipeline)
             logging.info("OpenVINO pipeline initialized")
             return _llm_pipe
 
     # Ветка Torch (CPU/XPU)
-    device = os.getenv("DEVICE", "xpu" if XPU_AVAILABLE and ITREX_AVAILABLE else "cpu")
+    default_device = backend if backend in ("cpu", "xpu") else ("xpu" if XPU_AVAILABLE and ITREX_AVAILABLE else "cpu")
+    device = os.getenv("DEVICE", default_device)
     try:
         if ITREX_AVAILABLE and device == "xpu":
             # Настройки квантования для Intel Arc (ITREX)
@@ -144,6 +228,14 @@ def init_llm_pipeline():
                 trust_remote_code=True
             )
             print("Model loaded on XPU with ITREX optimizations")
+        elif device == "cpu" and os.getenv("MODEL_LOAD_MODE", "default").lower() == "mmap":
+            # Веса отображаются из safetensors и делятся между процессами через page cache
+            mmap_dtype = os.getenv("MODEL_MMAP_DTYPE", cpu_dtype_name)
+            model_dir = convert_to_safetensors(
+                model_id, default_mmap_dir(model_id, mmap_dtype), mmap_dtype, cache_dir
+            )
+            model = load_mmap_model(model_dir)
+            print("Model memory-mapped on CPU")
         else:
             if device == "xpu":
                 print("ITREX not available, falling back to standard XPU loading")
@@ -151,7 +243,7 @@ def init_llm_pipeline():
                 torch_dtype = torch.bfloat16
             else:
                 device_map = None
-                torch_dtype = torch.float32
+                torch_dtype = getattr(torch, cpu_dtype_name)
             print(f"Loading model {model_id} on {device.upper()}...")
             model = AutoModelForCausalLM.from_pretrained(
                 model_id,
@@ -176,6 +268,8 @@ def init_llm_pipeline():
             top_p=0.9,
             repetition_penalty=1.1,
             return_full_text=True,
+            stopping_criteria=stopping_criteria(),
+            eos_token_id=end_of_turn_token_ids(tokenizer),
             device_map="auto" if device == "xpu" and ITREX_AVAILABLE else None,
         )
         _llm_pipe = HuggingFacePipeline(pipeline=text_generation_pipeline)
@@ -186,9 +280,10 @@ def init_llm_pipeline():
         raise
 
 
-def init_qa_chain(retriever):
+def init_qa_chain(retriever, system_prompt: str = None):
     llm_pipe = init_llm_pipeline()
-    system_prompt = load_system_prompt()
+    if system_prompt is None:
+        system_prompt = load_system_prompt()
 
     prompt_template = """<|im_start|>system
 {system_prompt}
@@ -220,16 +315,47 @@ Question: {question}
                 template="{page_content}"
             ),
             "document_variable_name": "context",
-            "verbose": True
+            "verbose": CHAIN_VERBOSE
         },
         return_source_documents=False,
         input_key="question",
         output_key="result",
-        verbose=True
+        verbose=CHAIN_VERBOSE
     )
 
     logging.info("QA chain initialized successfully")
     logging.info(f"Input key: {qa_chain.input_key}")
     logging.info(f"Output key: {qa_chain.output_key}")
 
-    return qa_chain, system_prompt
\ No newline at end of file
+    return qa_chain, system_prompt
+
+
+def count_tokens(text: str) -> int:
+    """Подсчет токенов токенизатором загруженной модели (или грубая оценка)."""
+    if _llm_pipe is not None:
+        try:
+            return len(_llm_pipe.pipeline.tokenizer.encode(text, add_special_tokens=False))
+        except Exception:
+            pass
+    return approx_token_count(text)
+
+
+def build_question(question: str, history: str = "") -> str:
+    """Добавляет историю диалога к вопросу, подставляемому в промпт."""
+    if not history:
+        return question
+    return f"История диалога:\n{history}\n\nТекущий вопрос: {question}"
+
+
+def answer_from_documents(qa_chain, docs, question: str, history: str = "") -> dict:
+    """
+    Генерация ответа по уже найденным документам (без обращения к ретриверу).
+
+    Returns:
+        dict: Результат в формате RetrievalQA ({"result": ...})
+    """
+    answer = qa_chain.combine_documents_chain.run(
+        input_documents=docs,
+        question=build_question(question, history)
+    )
+    return {qa_chain.output_key: answer}
\ No newline at end of file
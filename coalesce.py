@@ -0,0 +1,77 @@
+"""
+Объединение одинаковых одновременных запросов (single-flight).
+
+Если тот же вопрос к той же версии базы знаний уже генерируется, новый
+запрос не запускает вторую генерацию, а дожидается результата первой.
+"""
+
+import re
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_saved_total = metrics.counter("coalesced_requests_total", "Generations saved by joining an identical in-flight request")
+_inflight = metrics.gauge("coalesce_inflight_keys", "Distinct generations currently in flight")
+
+_PUNCT_RE = re.compile(r'[\s?!.,;:…"«»]+')
+
+
+def normalize_question(text: str) -> str:
+    """
+    Нормализует вопрос для сравнения: регистр, пробелы и пунктуация не важны.
+
+    Args:
+        text: Текст вопроса
+
+    Returns:
+        str: Нормализованная строка
+    """
+    return _PUNCT_RE.sub(' ', text.casefold()).strip()
+
+
+class SingleFlight:
+    """
+    Таблица выполняющихся вычислений по ключу.
+
+    Вычисление запускается отдельной задачей: отмена одного из ожидающих
+    (например, пользователь ушел) не прерывает генерацию для остальных.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        _inflight.set_function(lambda: len(self._inflight))
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Выполняет fn или присоединяется к уже идущему вычислению с тем же ключом.
+
+        Args:
+            key: Ключ запроса
+            fn: Фабрика корутины вычисления
+
+        Returns:
+            Tuple[Any, bool]: Результат и признак того, что он получен от чужого вычисления
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            _saved_total.inc()
+            logger.info("Joined in-flight generation for identical request")
+            return await asyncio.shield(future), True
+
+        future = asyncio.ensure_future(fn())
+        self._inflight[key] = future
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return await asyncio.shield(future), False
+
+    def _finish(self, key: Hashable, future: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        # Помечаем исключение полученным, даже если все ожидающие отменены
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Компактное векторное хранилище для больших баз знаний.
+
+Chroma держит float32-векторы и документы в SQLite; при сотнях тысяч
+фрагментов память и диск растут линейно. Компактный режим хранит:
+    - коды векторов: int8 (скалярная квантизация, ~4x: байт на координату
+      и float16-масштаб на вектор) или PQ (product quantization, 8-32x
+      в зависимости от числа подпространств);
+    - опционально float16-копию векторов для точного пересчета лучших
+      кандидатов (rescoring) — читается с диска только для кандидатов;
+    - документы и метаданные в сжатом (zlib) blob-файле, отображаемом в память.
+
+Все файлы открываются через mmap: несколько процессов делят одну копию в
+page cache. Индекс строится из активной коллекции Chroma:
+
+    python compact_store.py build --mode int8 [--rescore]
+    python compact_store.py build --mode pq --pq-subspaces 48 --rescore
+    python compact_store.py info
+
+При сборке recall@k квантизованного поиска измеряется относительно точного
+поиска и сохраняется в manifest.json. Бот использует индекс при
+VECTOR_STORE=compact (см. embeddings.build_vector_store).
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+import shutil
+import logging
+import argparse
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.schema.vectorstore import VectorStore
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COMPACT_DIR = "compact"
+MANIFEST_FILE = "manifest.json"
+MODES = ("int8", "pq")
+
+# Строки, обрабатываемые за один шаг поиска: ограничивает временную память
+_SCAN_BLOCK = 65536
+
+_store_bytes = metrics.gauge("compact_store_bytes", "Compact vector store file sizes by kind")
+_store_recall = metrics.gauge("compact_store_recall", "Recall@k of quantized search vs exact search measured at build")
+
+
+class ReadOnlyStoreError(RuntimeError):
+    """Запись в компактное хранилище: оно только пересобирается целиком."""
+    pass
+
+
+class BlobStore:
+    """
+    Документы в сжатом blob-файле: docs.bin (zlib-записи) и docs.idx (смещения).
+
+    Файлы отображаются в память; распаковывается только запрошенная запись.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "docs.idx"), "rb") as f:
+            self._offsets = array("q")
+            self._offsets.frombytes(f.read())
+        with open(os.path.join(path, "docs.bin"), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    @staticmethod
+    def write(path: str, records: Iterable[Tuple[str, str, dict]]) -> int:
+        """Записывает (id, текст, метаданные) и возвращает число записей."""
+        offsets = array("q", [0])
+        with open(os.path.join(path, "docs.bin"), "wb") as f:
+            for chunk_id, text, metadata in records:
+                payload = json.dumps({"id": chunk_id, "t": text, "m": metadata}, ensure_ascii=False)
+                data = zlib.compress(payload.encode("utf-8"), 6)
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        with open(os.path.join(path, "docs.idx"), "wb") as f:
+            f.write(offsets.tobytes())
+        return len(offsets) - 1
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get(self, index: int) -> Tuple[str, str, dict]:
+        start, end = self._offsets[index], self._offsets[index + 1]
+        record = json.loads(zlib.decompress(self._data[start:end]).decode("utf-8"))
+        return record["id"], record["t"], record["m"]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Симметричная int8-квантизация с масштабом на вектор: x ≈ codes * scale.
+
+    Масштабы хранятся в float16 (2 байта на вектор вместо 4): коды
+    считаются уже по округленному масштабу, так что ошибка не растет.
+    """
+    scales = (np.abs(vectors).max(axis=1) / 127.0).astype(np.float16)
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None].astype(np.float32)), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def _kmeans(data: np.ndarray, clusters: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Алгоритм Ллойда; пустые кластеры переинициализируются случайными точками."""
+    centroids = data[rng.choice(len(data), size=clusters, replace=len(data) < clusters)].copy()
+    for _ in range(iterations):
+        assign = _nearest(data, centroids)
+        counts = np.bincount(assign, minlength=clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+    return centroids
+
+
+def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * data @ centroids.T
+    return distances.argmin(axis=1)
+
+
+def train_pq(vectors: np.ndarray, subspaces: int, iterations: int = 15, sample: int = 20000,
+             seed: int = 0) -> np.ndarray:
+    """
+    Обучает кодовые книги PQ.
+
+    Returns:
+        np.ndarray: Центроиды формы (subspaces, 256, dim // subspaces)
+    """
+    dim = vectors.shape[1]
+    if dim % subspaces:
+        raise ValueError(f"Dimension {dim} is not divisible by {subspaces} subspaces")
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample:
+        vectors = vectors[rng.choice(len(vectors), size=sample, replace=False)]
+    width = dim // subspaces
+    return np.stack([
+        _kmeans(vectors[:, m * width:(m + 1) * width], 256, iterations, rng) for m in range(subspaces)
+    ]).astype(np.float32)
+
+
+def encode_pq(vectors: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+    subspaces, _, width = codebooks.shape
+    codes = np.empty((len(vectors), subspaces), dtype=np.uint8)
+    for m in range(subspaces):
+        codes[:, m] = _nearest(vectors[:, m * width:(m + 1) * width], codebooks[m])
+    return codes
+
+
+def build_index(path: str, vectors: np.ndarray, records: List[Tuple[str, str, dict]], model: str,
+                mode: str = "int8", rescore: bool = False, pq_subspaces: int = 48,
+                eval_queries: int = 200, k: int = 10) -> Dict[str, Any]:
+    """
+    Строит компактный индекс в директории path (атомарно заменяя существующий).
+
+    Args:
+        path: Директория индекса
+        vectors: Векторы фрагментов (N x dim)
+        records: (id, текст, метаданные) в порядке векторов
+        model: Модель эмбеддингов, которой получены векторы
+        mode: "int8" или "pq"
+        rescore: Сохранить float16-векторы для пересчета кандидатов
+        pq_subspaces: Число подпространств PQ (байт на вектор)
+        eval_queries: Сколько векторов корпуса использовать как запросы для оценки recall
+        k: Глубина оценки recall
+
+    Returns:
+        Dict[str, Any]: Содержимое manifest.json
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown compact store mode '{mode}', expected one of {MODES}")
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    started = time.perf_counter()
+    if mode == "int8":
+        codes, scales = quantize_int8(vectors)
+        np.save(os.path.join(tmp_path, "scales.npy"), scales)
+    else:
+        codebooks = train_pq(vectors, pq_subspaces)
+        codes = encode_pq(vectors, codebooks)
+        np.save(os.path.join(tmp_path, "codebooks.npy"), codebooks)
+    np.save(os.path.join(tmp_path, "codes.npy"), codes)
+    if rescore:
+        np.save(os.path.join(tmp_path, "vectors.f16.npy"), vectors.astype(np.float16))
+    count = BlobStore.write(tmp_path, records)
+
+    manifest = {
+        "model": model, "dim": int(vectors.shape[1]), "count": count, "mode": mode,
+        "rescore": rescore, "pq_subspaces": pq_subspaces if mode == "pq" else None,
+        "built_at": time.time(), "build_s": round(time.perf_counter() - started, 2),
+    }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    # Оценка качества: ближайшие соседи выборки векторов по точному и квантизованному поиску
+    index = CompactIndex(tmp_path)
+    manifest["float32_bytes"] = int(vectors.nbytes)
+    manifest["vector_bytes"] = index.vector_bytes()
+    manifest["compression"] = round(manifest["float32_bytes"] / max(manifest["vector_bytes"], 1), 2)
+    manifest.update(measure_recall(index, vectors, eval_queries, k))
+    del index
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    # Открытые отображения старого индекса остаются валидными после переименования
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    logger.info(f"Compact index built: {manifest}")
+    return manifest
+
+
+def measure_recall(index: "CompactIndex", vectors: np.ndarray, queries: int, k: int) -> Dict[str, float]:
+    """Recall@k квантизованного поиска (с пересчетом и без) относительно точного."""
+    if not len(vectors) or queries <= 0:
+        return {}
+    rng = np.random.default_rng(1)
+    sample = vectors[rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)]
+    k = min(k, len(vectors))
+    result: Dict[str, float] = {}
+    variants = [("recall", False)] + ([("recall_rescored", True)] if index.rescore else [])
+    for name, rescore in variants:
+        hits = 0
+        for query in sample:
+            exact = set(np.argsort(-(vectors @ query))[:k].tolist())
+            found = {i for i, _ in index.search(query, k, rescore=rescore)}
+            hits += len(exact & found)
+        result[f"{name}@{k}"] = round(hits / (len(sample) * k), 4)
+    return result
+
+
+class CompactIndex:
+    """Квантизованные векторы и документы компактного индекса (только чтение)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.mode = self.manifest["mode"]
+        self.codes = np.load(os.path.join(path, "codes.npy"), mmap_mode="r")
+        if self.mode == "int8":
+            self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+        else:
+            self.codebooks = np.load(os.path.join(path, "codebooks.npy"))
+        float_path = os.path.join(path, "vectors.f16.npy")
+        self.vectors = np.load(float_path, mmap_mode="r") if os.path.exists(float_path) else None
+        self.rescore = self.vectors is not None
+        self.docs = BlobStore(path)
+
+    def vector_bytes(self) -> int:
+        """Размер кодов (то, что сканируется при каждом поиске)."""
+        size = self.codes.nbytes
+        size += self.scales.nbytes if self.mode == "int8" else self.codebooks.nbytes
+        return int(size)
+
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        if self.mode == "pq":
+            subspaces, _, width = self.codebooks.shape
+            # Таблица скалярных произведений подвектора запроса со всеми центроидами
+            table = np.einsum("mcw,mw->mc", self.codebooks, query.reshape(subspaces, width))
+            rows = np.arange(subspaces)
+        for start in range(0, len(self.codes), _SCAN_BLOCK):
+            block = np.asarray(self.codes[start:start + _SCAN_BLOCK])
+            end = start + len(block)
+            if self.mode == "int8":
+                scores[start:end] = (block.astype(np.float32) @ query) * self.scales[start:end].astype(np.float32)
+            else:
+                scores[start:end] = table[rows, block].sum(axis=1)
+        return scores
+
+    def search(self, query: np.ndarray, k: int, candidates: Optional[int] = None,
+               rescore: Optional[bool] = None) -> List[Tuple[int, float]]:
+        """
+        Ближайшие по косинусу фрагменты.
+
+        Args:
+            query: Нормализованный вектор запроса
+            k: Число результатов
+            candidates: Сколько кандидатов пересчитывать по float-векторам (по умолчанию 4k)
+            rescore: Пересчитывать кандидатов (по умолчанию — если есть float-векторы)
+
+        Returns:
+            List[Tuple[int, float]]: (номер фрагмента, сходство) по убыванию сходства
+        """
+        if not len(self.codes) or k <= 0:
+            return []
+        rescore = self.rescore if rescore is None else rescore and self.rescore
+        scores = self._scores(np.asarray(query, dtype=np.float32))
+        depth = min(len(scores), max(k, candidates or 4 * k) if rescore else k)
+        top = np.argpartition(-scores, depth - 1)[:depth]
+        if rescore:
+            # Чтение с диска по возрастанию номеров — последовательнее для page cache
+            top = np.sort(top)
+            exact = np.asarray(self.vectors[top], dtype=np.float32) @ query
+            order = np.argsort(-exact)[:k]
+            return [(int(top[i]), float(exact[i])) for i in order]
+        ranked = top[np.argsort(-scores[top])][:k]
+        return [(int(i), float(scores[i])) for i in ranked]
+
+    def reconstruct(self, indices: List[int]) -> np.ndarray:
+        """Приближенные (или float16) векторы фрагментов — для MMR."""
+        if self.rescore:
+            return np.asarray(self.vectors[indices], dtype=np.float32)
+        codes = np.asarray(self.codes[indices])
+        if self.mode == "int8":
+            return codes.astype(np.float32) * np.asarray(self.scales[indices], dtype=np.float32)[:, None]
+        rows = np.arange(self.codebooks.shape[0])
+        return self.codebooks[rows, codes].reshape(len(codes), -1)
+
+    def document(self, index: int) -> Document:
+        _, text, metadata = self.docs.get(index)
+        return Document(page_content=text, metadata=dict(metadata))
+
+
+class CompactVectorStore(VectorStore):
+    """
+    LangChain-хранилище поверх CompactIndex (только чтение).
+
+    Поддерживает similarity и MMR-поиск, поэтому as_retriever() работает так же,
+    как для Chroma. Пополнение — пересборкой индекса (compact_store.py build).
+    """
+
+    def __init__(self, index: CompactIndex, embedding: Embeddings):
+        self.index = index
+        self._embedding = embedding
+        for kind, name in (("codes", "codes.npy"), ("float16", "vectors.f16.npy"), ("documents", "docs.bin")):
+            file_path = os.path.join(index.path, name)
+            _store_bytes.set(os.path.getsize(file_path) if os.path.exists(file_path) else 0, kind=kind)
+        for key, value in index.manifest.items():
+            if key.startswith("recall"):
+                _store_recall.set(value, kind=key)
+
+    @classmethod
+    def load(cls, path: str, embedding: Embeddings) -> "CompactVectorStore":
+        return cls(CompactIndex(path), embedding)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        return _normalize(np.asarray([self._embedding.embed_query(query)], dtype=np.float32))[0]
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        """
+        Не поддерживается: коды и кодовые книги считаются по всему корпусу.
+
+        Метод есть только потому, что он абстрактный в VectorStore, без
+        которого не работает as_retriever().
+
+        Raises:
+            ReadOnlyStoreError: Всегда
+        """
+        raise ReadOnlyStoreError("Compact store is read-only; rebuild it with `python compact_store.py build`")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   **kwargs: Any) -> "CompactVectorStore":
+        """Строит индекс в kwargs["path"] (mode, rescore, model — как в build_index)."""
+        path = kwargs.pop("path")
+        metadatas = metadatas or [{} for _ in texts]
+        ids = kwargs.pop("ids", None) or [str(i) for i in range(len(texts))]
+        vectors = np.asarray(embedding.embed_documents(list(texts)), dtype=np.float32)
+        build_index(path, vectors, list(zip(ids, texts, metadatas)), kwargs.pop("model", ""), **kwargs)
+        return cls.load(path, embedding)
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return [(self.index.document(i), score) for i, score in self.index.search(self._embed_query(query), k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        query = _normalize(np.asarray([embedding], dtype=np.float32))[0]
+        return [self.index.document(i) for i, _ in self.index.search(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Сходство — косинус в [-1, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, **kwargs: Any) -> List[Document]:
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+        query = _normalize(np.asarray([embedding], dtype=np.float32))[0]
+        candidates = [i for i, _ in self.index.search(query, fetch_k)]
+        if not candidates:
+            return []
+        selected = maximal_marginal_relevance(
+            query, list(_normalize(self.index.reconstruct(candidates))), k=k, lambda_mult=lambda_mult
+        )
+        return [self.index.document(candidates[i]) for i in selected]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5, **kwargs: Any) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding.embed_query(query), k, fetch_k, lambda_mult, **kwargs
+        )
+
+
+def compact_path(persist_dir: str) -> str:
+    return os.path.join(persist_dir, COMPACT_DIR)
+
+
+def build_from_chroma(persist_dir: str, mode: str = "int8", rescore: bool = False,
+                      pq_subspaces: int = 48, batch_size: int = 1024) -> Dict[str, Any]:
+    """Строит компактный индекс из векторов и документов активной коллекции Chroma."""
+    from langchain_community.vectorstores import Chroma
+    from embeddings import read_active_collection
+
+    active = read_active_collection(persist_dir)
+    collection = Chroma(collection_name=active["collection"], persist_directory=persist_dir)._collection
+    vectors: List[List[float]] = []
+    records: List[Tuple[str, str, dict]] = []
+    offset = 0
+    while True:
+        page = collection.get(limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+        if not page["ids"]:
+            break
+        vectors.extend(page["embeddings"])
+        records.extend(zip(page["ids"], page["documents"], [m or {} for m in page["metadatas"]]))
+        offset += len(page["ids"])
+    if not records:
+        raise ValueError(f"Collection {active['collection']} is empty, nothing to compact")
+    logger.info(f"Building {mode} compact index from {len(records)} chunks of {active['collection']}")
+    return build_index(
+        compact_path(persist_dir), np.asarray(vectors, dtype=np.float32), records, active["model"],
+        mode=mode, rescore=rescore, pq_subspaces=pq_subspaces,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Компактное векторное хранилище")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Построить индекс из активной коллекции Chroma")
+    build.add_argument("--mode", choices=MODES, default=os.getenv("COMPACT_STORE_MODE", "int8"))
+    build.add_argument("--rescore", action="store_true",
+                       default=os.getenv("COMPACT_STORE_RESCORE", "0") == "1",
+                       help="Хранить float16-векторы для пересчета кандидатов")
+    build.add_argument("--pq-subspaces", type=int, default=int(os.getenv("COMPACT_STORE_PQ_SUBSPACES", "48")))
+    sub.add_parser("info", help="Показать manifest текущего индекса")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    persist_dir = os.getenv("PERSIST_DIRECTORY") or os.getenv("CHROMA_DB_PATH") or "./chroma_db"
+    if args.command == "build":
+        manifest = build_from_chroma(persist_dir, args.mode, args.rescore, args.pq_subspaces)
+    else:
+        with open(os.path.join(compact_path(persist_dir), MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    print(json.dumps(manifest, indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Доставка ответов в Telegram.
+
+Обработчик ставит ответ в очередь и не ждет отправки. Фоновые воркеры:
+    - делят длинный ответ на сообщения по границам абзацев (лимит 4096 символов);
+    - соблюдают лимиты Telegram: общий (~30 сообщений/с) и на чат (~1 сообщение/с);
+    - повторяют отправку с backoff при RetryAfter (flood control) и сетевых ошибках;
+    - сохраняют порядок сообщений внутри чата.
+
+Первая часть ответа заменяет сообщение "Обрабатываю ваш запрос...", остальные
+отправляются новыми сообщениями. С TELEGRAM_PARSE_MODE (HTML или MarkdownV2)
+Markdown ответа переводится в разметку Telegram; если Telegram ее не принял,
+часть отправляется простым текстом.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+from postprocess import PARSE_MODES, format_for_telegram
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+_messages_total = metrics.counter("delivery_messages_total", "Outgoing Telegram messages by outcome")
+_retries_total = metrics.counter("delivery_retries_total", "Telegram send retries by reason")
+_delivery_latency = metrics.histogram("delivery_latency_seconds", "Time from enqueue to the last chunk being sent")
+_queue_depth = metrics.gauge("delivery_queue_depth", "Answers waiting for delivery")
+
+
+def _split_point(text: str, limit: int) -> int:
+    """Позиция разреза не дальше limit: абзац, строка, предложение, пробел — в порядке предпочтения."""
+    window = text[:limit]
+    for separator in ("\n\n", "\n", ". ", "! ", "? ", " "):
+        index = window.rfind(separator)
+        # Не режем слишком близко к началу: иначе получим много коротких сообщений
+        if index >= limit // 3:
+            return index + len(separator)
+    return limit
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Делит текст на части не длиннее limit по границам абзацев.
+
+    Args:
+        text: Текст ответа
+        limit: Максимальная длина сообщения
+
+    Returns:
+        List[str]: Непустые части в исходном порядке
+    """
+    chunks: List[str] = []
+    rest = text.strip()
+    while len(rest) > limit:
+        cut = _split_point(rest, limit)
+        chunk = rest[:cut].strip()
+        if chunk:
+            chunks.append(chunk)
+        rest = rest[cut:].lstrip()
+    if rest:
+        chunks.append(rest)
+    return chunks
+
+
+class TokenBucket:
+    """
+    Асинхронный token bucket.
+
+    Args:
+        rate: Токенов в секунду
+        capacity: Максимальный запас (размер всплеска)
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def idle(self) -> bool:
+        """Bucket полон — его можно удалить без потери ограничения."""
+        self._refill()
+        return self._tokens >= self.capacity
+
+
+class Delivery:
+    """Ответ, ожидающий доставки."""
+
+    __slots__ = ("chat_id", "text", "placeholder", "on_done", "enqueued")
+
+    def __init__(self, chat_id: int, text: str, placeholder: Any = None,
+                 on_done: Optional[Callable[[Optional[BaseException]], None]] = None):
+        self.chat_id = chat_id
+        self.text = text
+        self.placeholder = placeholder
+        self.on_done = on_done
+        self.enqueued = time.monotonic()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self.on_done is not None:
+            try:
+                self.on_done(error)
+            except Exception as e:
+                logger.error(f"Delivery callback for chat {self.chat_id} failed: {e}")
+
+
+class DeliveryQueue:
+    """
+    Очередь исходящих ответов с ограничением скорости и повторами.
+
+    Args:
+        bot: telegram.Bot
+        workers: Число параллельных воркеров (разные чаты отправляются параллельно)
+        global_rate: Сообщений в секунду на весь бот
+        chat_rate: Сообщений в секунду в один чат
+        max_attempts: Попыток отправки одного сообщения
+        max_queue: Максимальная длина очереди (при заполнении обработчик ждет)
+        parse_mode: Разметка Telegram ("HTML", "MarkdownV2" или None — простой текст)
+        tenant: Имя тенанта (метка метрик)
+    """
+
+    def __init__(self, bot: Any, workers: int = 4, global_rate: float = 25.0, chat_rate: float = 1.0,
+                 max_attempts: int = 5, max_queue: int = 1000, parse_mode: Optional[str] = None,
+                 tenant: str = "default"):
+        if parse_mode and parse_mode not in PARSE_MODES:
+            raise ValueError(f"Unsupported parse mode '{parse_mode}': use one of {', '.join(PARSE_MODES)}")
+        self.bot = bot
+        self.parse_mode = parse_mode or None
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_rate = chat_rate
+        self.max_attempts = max_attempts
+        self.tenant = tenant
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._tasks: List[asyncio.Task] = []
+        _queue_depth.set_function(lambda: self._queue.qsize(), tenant=tenant)
+
+    @classmethod
+    def from_env(cls, bot: Any, **overrides: Any) -> "DeliveryQueue":
+        """Очередь с настройками DELIVERY_*; overrides (не None) имеют приоритет (лимиты тенанта)."""
+        options = dict(
+            workers=int(os.getenv("DELIVERY_WORKERS", "4")),
+            global_rate=float(os.getenv("DELIVERY_GLOBAL_RATE", "25")),
+            chat_rate=float(os.getenv("DELIVERY_CHAT_RATE", "1")),
+            max_attempts=int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5")),
+            max_queue=int(os.getenv("DELIVERY_MAX_QUEUE", "1000")),
+            parse_mode=os.getenv("TELEGRAM_PARSE_MODE") or None,
+        )
+        options.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(bot, **options)
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Дожидается отправки очереди (не дольше timeout) и останавливает воркеров."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Delivery queue not drained on shutdown ({self._queue.qsize()} answers left)")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while not self._queue.empty():
+            self._queue.get_nowait().finish(RuntimeError("Delivery queue closed before sending"))
+            self._queue.task_done()
+
+    async def submit(self, chat_id: int, text: str, placeholder: Any = None,
+                     on_done: Optional[Callable[[Optional[BaseException]], None]] = None) -> None:
+        """
+        Ставит ответ в очередь доставки.
+
+        Args:
+            chat_id: ID чата
+            text: Текст ответа (любой длины)
+            placeholder: Сообщение-заглушка, которое заменяется первой частью ответа
+            on_done: Вызывается после отправки всех частей (None) или отказа от нее (ошибка)
+        """
+        await self._queue.put(Delivery(chat_id, text, placeholder, on_done))
+
+    async def _worker(self) -> None:
+        while True:
+            delivery = await self._queue.get()
+            try:
+                await self._deliver(delivery)
+            except asyncio.CancelledError as e:
+                delivery.finish(e)
+                raise
+            except Exception as e:
+                logger.error(f"Failed to deliver answer to chat {delivery.chat_id}: {e}")
+                delivery.finish(e)
+            else:
+                delivery.finish()
+            finally:
+                self._queue.task_done()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Чаты без недавних отправок больше не ограничивают скорость
+                for idle_chat in [c for c, b in self._chat_buckets.items() if b.idle()]:
+                    lock = self._chat_locks.get(idle_chat)
+                    if lock is None or not lock.locked():
+                        self._chat_buckets.pop(idle_chat, None)
+                        self._chat_locks.pop(idle_chat, None)
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, capacity=1.0)
+        return bucket
+
+    async def _deliver(self, delivery: Delivery) -> None:
+        lock = self._chat_locks.setdefault(delivery.chat_id, asyncio.Lock())
+        # Один чат обслуживается одним воркером: части ответа не перемешиваются
+        async with lock:
+            # Экранирование удлиняет текст: с разметкой делим с запасом
+            limit = TELEGRAM_MESSAGE_LIMIT if self.parse_mode is None else TELEGRAM_MESSAGE_LIMIT * 3 // 4
+            chunks = split_message(delivery.text, limit)
+            for index, chunk in enumerate(chunks):
+                placeholder = delivery.placeholder if index == 0 else None
+                if self.parse_mode is not None and await self._send_formatted(delivery.chat_id, chunk, placeholder):
+                    continue
+                await self._send(delivery.chat_id, chunk, placeholder)
+            _delivery_latency.observe(time.monotonic() - delivery.enqueued)
+
+    async def _send_formatted(self, chat_id: int, text: str, placeholder: Any = None) -> bool:
+        """Отправка с разметкой; False — Telegram не принял разметку, нужно отправить простым текстом."""
+        from telegram.error import BadRequest
+
+        formatted = format_for_telegram(text, self.parse_mode)
+        if len(formatted) > TELEGRAM_MESSAGE_LIMIT:
+            return False
+        try:
+            await self._send(chat_id, formatted, placeholder, self.parse_mode)
+            return True
+        except BadRequest as e:
+            logger.warning(f"Telegram rejected {self.parse_mode} markup in chat {chat_id} ({e}), sending plain text")
+            return False
+
+    async def _send(self, chat_id: int, text: str, placeholder: Any = None, parse_mode: Optional[str] = None) -> None:
+        from telegram.error import BadRequest, NetworkError, RetryAfter
+
+        attempt = 0
+        while True:
+            attempt += 1
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                if placeholder is not None:
+                    try:
+                        await placeholder.edit_text(text, parse_mode=parse_mode)
+                    except BadRequest as e:
+                        # Заглушку удалили или ее нельзя изменить — отправляем новым сообщением
+                        logger.info(f"Cannot edit placeholder in chat {chat_id} ({e}), sending new message")
+                        placeholder = None
+                        await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                else:
+                    await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                _messages_total.inc(outcome="sent")
+                return
+            except RetryAfter as e:
+                reason, delay = "retry_after", float(e.retry_after)
+            except NetworkError as e:
+                # TimedOut — подкласс NetworkError; BadRequest тоже, но повторять его бессмысленно
+                if isinstance(e, BadRequest):
+                    _messages_total.inc(outcome="failed")
+                    raise
+                reason, delay = "network", min(2 ** attempt * 0.5, 30.0)
+            if attempt >= self.max_attempts:
+                _messages_total.inc(outcome="failed")
+                raise RuntimeError(f"Giving up after {attempt} attempts ({reason})")
+            _retries_total.inc(reason=reason)
+            logger.warning(f"Send to chat {chat_id} failed ({reason}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
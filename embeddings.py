@@ -1,12 +1,13 @@
 import os
+import json
 import logging
 import traceback
 from functools import lru_cache
-from typing import Optional, Any
+from typing import Dict, List, NamedTuple, Optional, Tuple, Any
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
+from langchain.schema.embeddings import Embeddings
 from langchain.schema.vectorstore import VectorStoreRetriever
-import traceback
 
 logger = logging.getLogger(__name__)
 
@@ -15,13 +16,243 @@ class VectorStoreInitializationError(Exception):
     pass
 
 
-@lru_cache(maxsize=1)
-def init_vector_store(persist_dir: Optional[str] = None) -> VectorStoreRetriever:
+class EmbeddingModelMismatchError(VectorStoreInitializationError):
+    """Коллекция построена другой моделью эмбеддингов (или с другой размерностью)."""
+    pass
+
+
+class EmbeddingModelSpec(NamedTuple):
+    """Модель эмбеддингов из каталога."""
+    name: str
+    hf_name: str
+    dim: int
+    query_prefix: str = ""
+    passage_prefix: str = ""
+
+
+# Каталог поддерживаемых моделей. E5 обучены с префиксами "query: "/"passage: "
+EMBEDDING_MODELS: Dict[str, EmbeddingModelSpec] = {
+    spec.name: spec for spec in [
+        EmbeddingModelSpec("all-MiniLM-L6-v2", "sentence-transformers/all-MiniLM-L6-v2", 384),
+        EmbeddingModelSpec("all-mpnet-base-v2", "sentence-transformers/all-mpnet-base-v2", 768),
+        EmbeddingModelSpec(
+            "paraphrase-multilingual-MiniLM-L12-v2",
+            "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2", 384
+        ),
+        EmbeddingModelSpec("multilingual-e5-small", "intfloat/multilingual-e5-small", 384, "query: ", "passage: "),
+        EmbeddingModelSpec("multilingual-e5-base", "intfloat/multilingual-e5-base", 768, "query: ", "passage: "),
+    ]
+}
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Коллекция, созданная до появления выбора модели (LangChain по умолчанию)
+LEGACY_COLLECTION = "langchain"
+# Указатель на активную коллекцию и ее модель внутри persist_dir
+ACTIVE_COLLECTION_FILE = "active_collection.json"
+
+
+def resolve_embedding_model(name: Optional[str] = None) -> EmbeddingModelSpec:
+    """
+    Находит модель в каталоге по короткому или полному (HuggingFace) имени.
+
+    Raises:
+        ValueError: Модель не из каталога
+    """
+    name = name or DEFAULT_EMBEDDING_MODEL
+    for spec in EMBEDDING_MODELS.values():
+        if name in (spec.name, spec.hf_name):
+            return spec
+    raise ValueError(f"Unsupported embedding model '{name}'. Supported: {', '.join(EMBEDDING_MODELS)}")
+
+
+class PrefixedEmbeddings(Embeddings):
+    """Добавляет к текстам префиксы запроса/документа, которых ожидает модель."""
+
+    def __init__(self, base: Embeddings, query_prefix: str = "", passage_prefix: str = ""):
+        self.base = base
+        self.query_prefix = query_prefix
+        self.passage_prefix = passage_prefix
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents([self.passage_prefix + text for text in texts])
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(self.query_prefix + text)
+
+
+@lru_cache(maxsize=4)
+def get_embedder(model_name: Optional[str] = None) -> Embeddings:
+    """Загружает модель эмбеддингов один раз на процесс (для каждой модели)."""
+    spec = resolve_embedding_model(model_name)
+    logger.info(f"Loading HuggingFace embeddings model {spec.hf_name}...")
+    embedder = HuggingFaceEmbeddings(
+        model_name=spec.hf_name,
+        model_kwargs={"device": "cpu"},  # Явно указываем CPU для совместимости
+        encode_kwargs={"normalize_embeddings": True}
+    )
+    logger.info("Embeddings model loaded successfully")
+    if spec.query_prefix or spec.passage_prefix:
+        return PrefixedEmbeddings(embedder, spec.query_prefix, spec.passage_prefix)
+    return embedder
+
+
+def read_active_collection(persist_dir: str) -> Dict[str, Any]:
+    """Активная коллекция и ее модель (для старых индексов — коллекция LangChain и MiniLM)."""
+    try:
+        with open(os.path.join(persist_dir, ACTIVE_COLLECTION_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        spec = resolve_embedding_model(DEFAULT_EMBEDDING_MODEL)
+        return {"collection": LEGACY_COLLECTION, "model": spec.name, "dim": spec.dim}
+
+
+def write_active_collection(persist_dir: str, collection: str, spec: EmbeddingModelSpec) -> None:
+    """Атомарно переключает активную коллекцию."""
+    path = os.path.join(persist_dir, ACTIVE_COLLECTION_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"collection": collection, "model": spec.name, "dim": spec.dim}, f)
+    os.replace(tmp_path, path)
+
+
+def collection_metadata(spec: EmbeddingModelSpec) -> Dict[str, Any]:
+    return {"embedding_model": spec.name, "embedding_dim": spec.dim}
+
+
+def check_collection_model(collection: Any, spec: EmbeddingModelSpec) -> None:
+    """
+    Проверяет, что коллекция Chroma построена моделью spec.
+
+    Сверяются метаданные коллекции, а для коллекций без них — размерность
+    сохраненных векторов.
+
+    Raises:
+        EmbeddingModelMismatchError: Модель или размерность не совпадают
+    """
+    metadata = collection.metadata or {}
+    model = metadata.get("embedding_model")
+    if model is not None and model != spec.name:
+        raise EmbeddingModelMismatchError(
+            f"Collection '{collection.name}' is embedded with {model}, not {spec.name}"
+        )
+    dim = metadata.get("embedding_dim")
+    if dim is None and collection.count() > 0:
+        sample = collection.get(limit=1, include=["embeddings"])["embeddings"]
+        dim = len(sample[0]) if sample else None
+    if dim is not None and int(dim) != spec.dim:
+        raise EmbeddingModelMismatchError(
+            f"Collection '{collection.name}' has {dim}-dimensional vectors, {spec.name} produces {spec.dim}"
+        )
+
+
+def claim_collection(collection: Any, spec: EmbeddingModelSpec) -> None:
+    """
+    Проверяет модель коллекции и записывает ее в метаданные новой (пустой) коллекции.
+
+    Метаданные непустой коллекции не меняются: иначе проверка прочитала бы
+    обратно только что записанную модель.
     """
-    Инициализирует или загружает векторное хранилище Chroma.
+    check_collection_model(collection, spec)
+    metadata = collection.metadata or {}
+    if "embedding_model" in metadata or collection.count() > 0:
+        return
+    # modify заменяет метаданные целиком, а параметры индекса hnsw:* менять нельзя
+    if any(key.startswith("hnsw:") for key in metadata):
+        return
+    collection.modify(metadata={**metadata, **collection_metadata(spec)})
+
+
+def open_collection(persist_dir: str, collection_name: str, spec: EmbeddingModelSpec) -> Chroma:
+    """Открывает (создавая при необходимости) коллекцию модели spec с проверкой модели."""
+    # Без collection_metadata: get_or_create_collection в Chroma 0.4 перезаписал бы
+    # сохраненные метаданные и проверка модели всегда проходила бы
+    vectordb = Chroma(
+        collection_name=collection_name,
+        persist_directory=persist_dir,
+        embedding_function=get_embedder(spec.name),
+    )
+    claim_collection(vectordb._collection, spec)
+    return vectordb
+
+
+def open_compact_store(persist_dir: str, spec: EmbeddingModelSpec) -> VectorStoreRetriever:
+    """Открывает компактный (квантизованный) индекс, построенный compact_store.py."""
+    from compact_store import CompactVectorStore, compact_path
+
+    path = compact_path(persist_dir)
+    if not os.path.exists(path):
+        raise VectorStoreInitializationError(
+            f"Compact index not found in {path}; build it with `python compact_store.py build`"
+        )
+    store = CompactVectorStore.load(path, get_embedder(spec.name))
+    manifest = store.index.manifest
+    if manifest["model"] != spec.name:
+        raise EmbeddingModelMismatchError(
+            f"Compact index is built with {manifest['model']}, active collection uses {spec.name}; rebuild it"
+        )
+    recall = {key: value for key, value in manifest.items() if key.startswith("recall")}
+    logger.info(
+        f"Compact vector store loaded: {manifest['count']} chunks, {manifest['mode']}, "
+        f"{manifest.get('compression')}x smaller vectors, {recall}"
+    )
+    return store.as_retriever(search_type="mmr", search_kwargs={"k": 3, "fetch_k": 10})
+
+
+def open_shards(persist_dir: str, fresh: bool = False, allowed: Optional[List[str]] = None) -> Any:
+    """Открывает шардированный индекс из shards.json (allowed или KB_SHARDS — доступные боту разделы)."""
+    from shards import open_sharded_retriever, read_shards
+
+    manifest = read_shards(persist_dir)
+    if manifest is None:
+        raise VectorStoreInitializationError(
+            f"KB_SHARDING=1, but {persist_dir} has no shard manifest; run ingest.py with KB_SHARDING=1"
+        )
+    if fresh:
+        _reset_chroma_clients()
+    if allowed is None:
+        allowed = [s.strip() for s in os.getenv("KB_SHARDS", "").split(",") if s.strip()]
+    return open_sharded_retriever(persist_dir, manifest, allowed or None)
+
+
+def _reset_chroma_clients() -> None:
+    """Сбрасывает кэш клиентов Chroma, чтобы новый экземпляр перечитал индекс с диска.
+
+    Уже открытые хранилища держат ссылку на свой клиент и продолжают работать.
+    """
+    try:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient.clear_system_cache()
+    except Exception as e:
+        logger.debug(f"Chroma client cache not cleared: {e}")
+
+
+@lru_cache(maxsize=8)
+def init_vector_store(persist_dir: Optional[str] = None, shards: Optional[Tuple[str, ...]] = None) -> VectorStoreRetriever:
+    """
+    Инициализирует или загружает векторное хранилище Chroma (кэшируется на процесс).
     
     Args:
         persist_dir: Директория для сохранения векторной БД
+        shards: Разделы базы знаний при KB_SHARDING=1 (None — KB_SHARDS)
+        
+    Returns:
+        VectorStoreRetriever: Инициализированный ретривер для поиска
+        
+    Raises:
+        VectorStoreInitializationError: Если не удалось инициализировать хранилище
+    """
+    return build_vector_store(persist_dir, shards=list(shards) if shards else None)
+
+
+def build_vector_store(persist_dir: Optional[str] = None, fresh: bool = False,
+                       shards: Optional[List[str]] = None) -> VectorStoreRetriever:
+    """
+    Открывает векторное хранилище Chroma без кэширования (для горячей перезагрузки).
+    
+    Args:
+        persist_dir: Директория для сохранения векторной БД
+        fresh: Перечитать индекс с диска, не используя открытый клиент Chroma
+        shards: Разделы базы знаний при KB_SHARDING=1 (None — KB_SHARDS)
         
     Returns:
         VectorStoreRetriever: Инициализированный ретривер для поиска
@@ -43,35 +274,49 @@ def init_vector_store(persist_dir: Optional[str] = None) -> VectorStoreRetriever
         # Проверяем доступность директории
         os.makedirs(persist_dir, exist_ok=True)
         
-        # Инициализируем модель эмбеддингов
+        # Шардированный индекс: по коллекции на раздел базы знаний (см. shards.py)
+        if os.getenv("KB_SHARDING", "0") == "1":
+            return open_shards(persist_dir, fresh, shards)
+
+        # Модель эмбеддингов определяется индексом, а не окружением: смешивать
+        # векторы разных моделей нельзя (смена модели — через reembed.py)
+        active = read_active_collection(persist_dir)
+        configured = os.getenv("EMBEDDING_MODEL")
         try:
-            logger.info("Loading HuggingFace embeddings model...")
-            embedder = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2",
-                model_kwargs={"device": "cpu"}  # Явно указываем CPU для совместимости
-            )
-            logger.info("Embeddings model loaded successfully")
+            spec = resolve_embedding_model(active["model"])
+            if configured and resolve_embedding_model(configured).name != spec.name:
+                logger.warning(
+                    f"EMBEDDING_MODEL={configured}, but the index is built with {spec.name}; "
+                    f"run `python reembed.py migrate --model {configured}` to switch"
+                )
+            # Модель эмбеддингов общая для всех версий хранилища
+            get_embedder(spec.name)
         except Exception as e:
             error_msg = f"Failed to load embeddings model: {str(e)}"
             logger.error(error_msg)
             raise VectorStoreInitializationError(error_msg) from e
         
+        if fresh:
+            _reset_chroma_clients()
+
+        if os.getenv("VECTOR_STORE", "chroma").lower() == "compact":
+            return open_compact_store(persist_dir, spec)
+
         # Проверяем существование базы данных
         db_exists = os.path.exists(persist_dir) and os.listdir(persist_dir)
         
         if db_exists:
             try:
-                logger.info("Loading existing vector database...")
-                vectordb = Chroma(
-                    persist_directory=persist_dir,
-                    embedding_function=embedder
-                )
+                logger.info(f"Loading existing vector database (collection {active['collection']}, {spec.name})...")
+                vectordb = open_collection(persist_dir, active["collection"], spec)
                 retriever = vectordb.as_retriever(
                     search_type="mmr",
                     search_kwargs={"k": 3, "fetch_k": 10}
                 )
                 logger.info("Vector database loaded successfully")
                 return retriever
+            except EmbeddingModelMismatchError:
+                raise
             except Exception as e:
                 error_msg = f"Failed to load existing vector database: {str(e)}"
                 logger.error(error_msg)
@@ -82,10 +327,7 @@ def init_vector_store(persist_dir: Optional[str] = None) -> VectorStoreRetriever
         # Создаем новую пустую базу данных без добавления фиктивного документа
         try:
             logger.info("Creating new empty vector database...")
-            vectordb = Chroma(
-                embedding_function=embedder,
-                persist_directory=persist_dir
-            )
+            vectordb = open_collection(persist_dir, active["collection"], spec)
             vectordb.persist()
             
             retriever = vectordb.as_retriever(
@@ -102,6 +344,8 @@ def init_vector_store(persist_dir: Optional[str] = None) -> VectorStoreRetriever
             logger.error(traceback.format_exc())
             raise VectorStoreInitializationError(error_msg) from e
             
+    except EmbeddingModelMismatchError:
+        raise
     except Exception as e:
         error_msg = f"Critical error in vector store initialization: {str(e)}"
         logger.critical(error_msg)
@@ -0,0 +1,163 @@
+"""
+Выделенные ограниченные пулы потоков для блокирующих операций бота.
+
+Каждый класс работы получает свой пул, чтобы быстрые операции не ждали
+за долгой генерацией LLM:
+    db  — запись и чтение SessionLog
+    cpu — постобработка ответов
+    embed — поиск по базе знаний (эмбеддинг запроса + Chroma)
+    shard — параллельный поиск по шардам базы знаний (из потоков embed)
+    llm — генерация ответа
+
+Размер пулов и длина очереди задаются переменными окружения
+<NAME>_EXECUTOR_WORKERS и <NAME>_EXECUTOR_MAX_PENDING. По умолчанию в
+работе и в очереди может быть до PENDING_PER_WORKER задач на поток; сверх
+этого задача отклоняется (ExecutorOverloadedError), 0 снимает ограничение.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = {"db": 4, "cpu": 2, "embed": 2, "shard": 4, "llm": 1}
+PENDING_PER_WORKER = 8
+
+_queue_wait = metrics.histogram("executor_queue_wait_seconds", "Time a job waits for a free executor thread")
+_run_time = metrics.histogram("executor_run_seconds", "Time a job runs in an executor thread")
+_pending = metrics.gauge("executor_pending_jobs", "Jobs submitted and not yet finished")
+_rejected = metrics.counter("executor_rejected_total", "Jobs rejected because the executor queue is full")
+
+
+class ExecutorOverloadedError(RuntimeError):
+    """Очередь пула заполнена: задача отклонена, чтобы не копить память."""
+    pass
+
+
+class BoundedExecutor:
+    """
+    ThreadPoolExecutor с ограниченной очередью и метриками.
+
+    Args:
+        name: Имя пула (используется в метриках и именах потоков)
+        workers: Число потоков
+        max_pending: Максимум задач в работе и в очереди (0 — без ограничения)
+        initializer: Функция, вызываемая в каждом потоке пула при старте
+    """
+
+    def __init__(self, name: str, workers: int, max_pending: int = 0, initializer: Optional[Callable] = None):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix=f"{name}-pool",
+            initializer=initializer
+        )
+        self._pending = 0
+        self._lock = threading.Lock()
+        _pending.set_function(lambda: self._pending, pool=name)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Ставит fn(*args, **kwargs) в пул с учетом очереди и метрик, сохраняя
+        contextvars вызывающего потока (для вызовов из потоков других пулов).
+
+        Raises:
+            ExecutorOverloadedError: Очередь пула заполнена
+        """
+        with self._lock:
+            if self.max_pending and self._pending >= self.max_pending:
+                _rejected.inc(pool=self.name)
+                raise ExecutorOverloadedError(f"Executor '{self.name}' is overloaded ({self._pending} pending)")
+            self._pending += 1
+        submitted = time.perf_counter()
+        ctx = contextvars.copy_context()
+        call = functools.partial(fn, *args, **kwargs)
+
+        def task():
+            started = time.perf_counter()
+            _queue_wait.observe(started - submitted, pool=self.name)
+            try:
+                return ctx.run(call)
+            finally:
+                _run_time.observe(time.perf_counter() - started, pool=self.name)
+
+        def release(_future: Future) -> None:
+            with self._lock:
+                self._pending -= 1
+
+        try:
+            future = self.executor.submit(task)
+        except BaseException:
+            release(None)
+            raise
+        future.add_done_callback(release)
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Выполняет fn(*args, **kwargs) в пуле, сохраняя contextvars вызывающей задачи."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_pools: Dict[str, BoundedExecutor] = {}
+_pools_lock = threading.Lock()
+_initializers: Dict[str, List[Callable]] = {}
+
+
+def add_initializer(name: str, fn: Callable) -> None:
+    """Регистрирует функцию инициализации потоков пула (до его создания)."""
+    _initializers.setdefault(name, []).append(fn)
+
+
+def _run_initializers(name: str) -> None:
+    for fn in _initializers.get(name, ()):
+        try:
+            fn()
+        except Exception as e:
+            logger.warning(f"Executor '{name}' thread initializer failed: {e}")
+
+
+def get_executor(name: str) -> BoundedExecutor:
+    """Возвращает (создавая при первом обращении) пул с заданным именем."""
+    pool = _pools.get(name)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            prefix = name.upper()
+            workers = int(os.getenv(f"{prefix}_EXECUTOR_WORKERS", str(DEFAULT_WORKERS.get(name, 2))))
+            max_pending = int(os.getenv(f"{prefix}_EXECUTOR_MAX_PENDING", str(workers * PENDING_PER_WORKER)))
+            pool = BoundedExecutor(name, workers, max_pending, functools.partial(_run_initializers, name))
+            _pools[name] = pool
+            logger.info(f"Executor '{name}' created: {workers} workers, max pending {max_pending or 'unbounded'}")
+        return pool
+
+
+async def run_in(name: str, fn: Callable, *args, **kwargs):
+    """Выполняет блокирующую функцию в пуле name."""
+    return await get_executor(name).run(fn, *args, **kwargs)
+
+
+def shutdown_all(wait: bool = True) -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=wait)
+        _pools.clear()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Предгенерированные ответы на частые вопросы.
+
+Пакетный режим (ночная задача после ingest.py):
+    python faq.py generate questions.txt --output faq_answers.json
+
+Вопросы читаются из файла (по одному на строку, # — комментарий), ответы
+генерируются QA цепью пачками с паддингом на всех ядрах и сохраняются в
+таблицу с версией базы знаний. Таблица записывается после каждой пачки,
+поэтому прерванный запуск продолжается с места остановки, а ответы для
+уже актуальной версии не перегенерируются.
+
+Бот перед вызовом модели ищет вопрос в таблице и использует только ответы
+для текущей версии базы знаний. По умолчанию нужно точное совпадение
+нормализованного вопроса. С FAQ_MATCH_THRESHOLD < 1 допускается нечеткое,
+но числа должны совпадать точно, а каждое отличающееся слово — быть
+опечаткой или другой формой слова из вопроса таблицы: "доставка в москву"
+и "доставка в минск" похожи как строки, но это разные вопросы.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import difflib
+import logging
+import argparse
+import threading
+from typing import Dict, Iterator, List, Optional
+
+from coalesce import normalize_question
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TABLE_PATH = "faq_answers.json"
+
+_NUMBER_RE = re.compile(r"\d+")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Сходство, при котором отличающиеся слова считаются опечаткой или формой одного слова
+WORD_MATCH_CUTOFF = 0.8
+
+
+def read_questions(path: str) -> List[str]:
+    """Читает вопросы из файла, пропуская пустые строки, комментарии и дубликаты."""
+    questions: List[str] = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            question = line.strip()
+            if not question or question.startswith("#"):
+                continue
+            key = normalize_question(question)
+            if key in seen:
+                continue
+            seen.add(key)
+            questions.append(question)
+    return questions
+
+
+def same_terms(question: str, candidate: str) -> bool:
+    """
+    Вопросы отличаются только опечатками и формами слов: числа совпадают,
+    а у каждого слова, которого нет в другом вопросе, там есть близкое.
+    """
+    if _NUMBER_RE.findall(question) != _NUMBER_RE.findall(candidate):
+        return False
+    words = set(_WORD_RE.findall(question))
+    other = set(_WORD_RE.findall(candidate))
+    for word in words ^ other:
+        pool = other if word in words else words
+        if not difflib.get_close_matches(word, pool, n=1, cutoff=WORD_MATCH_CUTOFF):
+            return False
+    return True
+
+
+def load_table(path: str) -> Dict[str, dict]:
+    """Загружает таблицу ответов {нормализованный вопрос: запись} (пустую, если файла нет)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("entries", {})
+    except FileNotFoundError:
+        return {}
+
+
+def save_table(path: str, entries: Dict[str, dict]) -> None:
+    """Атомарно записывает таблицу ответов (чекпоинт)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"updated_at": time.time(), "entries": entries}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+class FaqTable:
+    """
+    Таблица предгенерированных ответов с поиском по вопросу.
+
+    Файл перечитывается при изменении (после ночной перегенерации) без
+    перезапуска бота.
+
+    Args:
+        path: Путь к таблице
+        fuzzy_cutoff: Порог сходства для нечеткого совпадения (0..1, 1 — только точное)
+    """
+
+    def __init__(self, path: str = DEFAULT_TABLE_PATH, fuzzy_cutoff: float = 1.0):
+        self.path = path
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._entries: Dict[str, dict] = {}
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _refresh(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            with self._lock:
+                self._entries, self._mtime = {}, None
+            return
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            try:
+                self._entries = load_table(self.path)
+                self._mtime = mtime
+                logger.info(f"FAQ table loaded: {len(self._entries)} answers from {self.path}")
+            except Exception as e:
+                logger.error(f"Failed to load FAQ table {self.path}: {e}")
+
+    def lookup(self, question: str, kb_version: str) -> Optional[str]:
+        """
+        Ищет готовый ответ на вопрос.
+
+        Args:
+            question: Вопрос пользователя
+            kb_version: Текущая версия базы знаний
+
+        Returns:
+            Optional[str]: Ответ или None
+        """
+        self._refresh()
+        entries = self._entries
+        if not entries:
+            return None
+        key = normalize_question(question)
+        entry = entries.get(key)
+        if entry is None and self.fuzzy_cutoff < 1.0:
+            matches = difflib.get_close_matches(key, entries.keys(), n=3, cutoff=self.fuzzy_cutoff)
+            entry = next((entries[match] for match in matches if same_terms(key, match)), None)
+        if entry is None or entry.get("kb_version") != kb_version:
+            return None
+        return entry["answer"]
+
+
+def _batches(items: List[str], size: int) -> Iterator[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def generate(questions_path: str, output_path: str, batch_size: int = 16, threads: int = 0) -> int:
+    """
+    Генерирует недостающие ответы и сохраняет таблицу после каждой пачки.
+
+    Args:
+        questions_path: Файл с вопросами
+        output_path: Таблица ответов (дополняется, если существует)
+        batch_size: Размер пачки генерации
+        threads: Число потоков torch (0 — все ядра)
+
+    Returns:
+        int: Число сгенерированных ответов
+    """
+    import torch
+    from chains import init_qa_chain, init_llm_pipeline
+    from embeddings import init_vector_store
+    from kb_reload import read_kb_version
+
+    torch.set_num_threads(threads or os.cpu_count() or 1)
+
+    persist_dir = os.getenv("PERSIST_DIRECTORY") or os.getenv("CHROMA_DB_PATH") or "./chroma_db"
+    kb_version = read_kb_version(persist_dir)
+    if kb_version is None:
+        raise RuntimeError(f"No knowledge base version in {persist_dir}: run ingest.py first")
+
+    entries = load_table(output_path)
+    questions = read_questions(questions_path)
+    todo = [q for q in questions if entries.get(normalize_question(q), {}).get("kb_version") != kb_version]
+    logger.info(f"{len(questions)} questions, {len(todo)} to generate for knowledge base version {kb_version}")
+    if not todo:
+        return 0
+
+    llm = init_llm_pipeline()
+    if hasattr(llm, "pipeline"):
+        # Пакетная генерация decoder-only модели: паддинг слева
+        tokenizer = llm.pipeline.tokenizer
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        llm.pipeline._batch_size = batch_size
+        llm.batch_size = batch_size
+    qa_chain, _ = init_qa_chain(init_vector_store(persist_dir))
+    combine_chain = qa_chain.combine_documents_chain
+
+    done = 0
+    for batch in _batches(todo, batch_size):
+        started = time.perf_counter()
+        inputs = [
+            combine_chain._get_inputs(qa_chain.retriever.get_relevant_documents(q), question=q)
+            for q in batch
+        ]
+        outputs = combine_chain.llm_chain.apply(inputs)
+        for question, output in zip(batch, outputs):
+            entries[normalize_question(question)] = {
+                "question": question,
+                "answer": output[combine_chain.llm_chain.output_key].strip(),
+                "kb_version": kb_version,
+                "generated_at": time.time(),
+            }
+        save_table(output_path, entries)
+        done += len(batch)
+        logger.info(f"Generated {done}/{len(todo)} answers ({time.perf_counter() - started:.1f}s per batch)")
+    return done
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Предгенерация ответов на частые вопросы")
+    sub = parser.add_subparsers(dest="command", required=True)
+    gen = sub.add_parser("generate", help="Сгенерировать недостающие ответы")
+    gen.add_argument("questions", help="Файл с вопросами, по одному на строку")
+    gen.add_argument("--output", default=os.getenv("FAQ_TABLE_PATH", DEFAULT_TABLE_PATH))
+    gen.add_argument("--batch-size", type=int, default=16)
+    gen.add_argument("--threads", type=int, default=0, help="Потоки torch (0 — все ядра)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "generate":
+        generate(args.questions, args.output, args.batch_size, args.threads)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
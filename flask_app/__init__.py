@@ -1,41 +1,71 @@
 import os
+import time
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import inspect
 
 db = SQLAlchemy()
 
 
-def create_app():
+def create_app(state_dir=None):
+    """
+    Создает Flask-приложение health/admin API.
+
+    Args:
+        state_dir: Директория состояния процесса бота. Если задана, /health и
+            /metrics отдают данные, выгруженные ботом (сервер в отдельном
+            процессе); иначе — метрики текущего процесса.
+    """
     app = Flask(__name__)
-    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv(
-        "DATABASE_URI", "sqlite:///flask_app.db"
-    )
+    app.config["STATE_DIR"] = state_dir
+    database_uri = os.getenv("DATABASE_URI", "sqlite:///flask_app.db")
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_pre_ping": True,
-        "connect_args": {"check_same_thread": False}
-    }
+    engine_options = {"pool_pre_ping": True}
+    if database_uri.startswith("sqlite"):
+        engine_options["connect_args"] = {"check_same_thread": False}
+    else:
+        engine_options["pool_size"] = int(os.getenv("DB_POOL_SIZE", "5"))
+        engine_options["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+        engine_options["pool_recycle"] = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
 
     db.init_app(app)
 
     # Health endpoint
     @app.get("/health")
     def health():
-        return {"status": "ok"}, 200
+        if state_dir is None:
+            return {"status": "ok"}, 200
+        from flask_app.server import read_heartbeat
+        heartbeat = read_heartbeat(state_dir)
+        if heartbeat is None:
+            return {"status": "starting"}, 200
+        age = time.time() - heartbeat.get("ts", 0)
+        stale_after = float(os.getenv("HEALTH_STALE_AFTER", "60"))
+        loop_age = heartbeat.get("loop_heartbeat_age")
+        healthy = age < stale_after and (loop_age is None or loop_age < stale_after)
+        body = dict(heartbeat, status="ok" if healthy else "unhealthy", age=age)
+        return body, 200 if healthy else 503
+
+    # Prometheus metrics endpoint
+    @app.get("/metrics")
+    def metrics_endpoint():
+        if state_dir is None:
+            import metrics
+            text = metrics.render()
+        else:
+            from flask_app.server import read_metrics
+            text = read_metrics(state_dir)
+        return text, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+    from flask_app.admin import admin_bp
+    from flask_app.analytics import analytics_bp
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(analytics_bp)
 
     with app.app_context():
-        db.create_all()
-        # Lightweight migration for username column
-        try:
-            inspector = inspect(db.engine)
-            columns = [col["name"] for col in inspector.get_columns("sessions")]
-            if "username" not in columns:
-                with db.engine.connect() as conn:
-                    conn.execute(db.text("ALTER TABLE sessions ADD COLUMN username VARCHAR(255)"))
-                    conn.commit()
-        except Exception:
-            # Ignore if fails (e.g., not SQLite or already exists)
-            pass
-
-    return app
\ No newline at end of file
+        from flask_app import models  # noqa: F401
+        from persistence.migrations import migrate
+        migrate(db.engine)
+
+    return app
@@ -0,0 +1,170 @@
+"""
+Административные эндпоинты: просмотр логов сессий с keyset-пагинацией и
+профилирование процесса бота по запросу (/admin/profile).
+
+Доступ по заголовку `Authorization: Bearer <ADMIN_API_TOKEN>`. Если
+ADMIN_API_TOKEN не задан, эндпоинты отключены (404).
+"""
+
+import os
+import hmac
+from datetime import datetime
+from functools import wraps
+
+from flask import Blueprint, abort, jsonify, request
+
+admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
+
+MAX_PAGE_SIZE = 500
+
+
+def require_admin_token(view):
+    """Проверка токена администратора для эндпоинтов /admin."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = os.getenv("ADMIN_API_TOKEN")
+        if not token:
+            abort(404)
+        header = request.headers.get("Authorization", "")
+        supplied = header[7:] if header.startswith("Bearer ") else ""
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            abort(401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def parse_datetime_arg(name: str):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, description=f"Invalid {name}: expected ISO 8601 datetime")
+
+
+def page_size() -> int:
+    try:
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        abort(400, description="Invalid limit")
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def serialize_session(log) -> dict:
+    return {
+        "id": log.id,
+        "user_id": log.user_id,
+        "username": log.username,
+        "query": log.query,
+        "response": log.response,
+        "timestamp": log.timestamp.isoformat() if log.timestamp else None,
+    }
+
+
+@admin_bp.get("/sessions")
+@require_admin_token
+def list_sessions():
+    """
+    Логи сессий от новых к старым.
+
+    Параметры: user_id, username, since, until (ISO 8601), limit (<= 500),
+    cursor — id последней записи предыдущей страницы (next_cursor из ответа).
+    """
+    from flask_app import db
+    from flask_app.models import SessionLog
+
+    # Колонка query модели заслоняет SessionLog.query — запрос через сессию
+    query = db.session.query(SessionLog)
+    if request.args.get("user_id"):
+        query = query.filter(SessionLog.user_id == request.args.get("user_id", type=int))
+    if request.args.get("username"):
+        query = query.filter(SessionLog.username == request.args["username"])
+    since = parse_datetime_arg("since")
+    if since:
+        query = query.filter(SessionLog.timestamp >= since)
+    until = parse_datetime_arg("until")
+    if until:
+        query = query.filter(SessionLog.timestamp < until)
+    cursor = request.args.get("cursor", type=int)
+    if cursor:
+        query = query.filter(SessionLog.id < cursor)
+
+    limit = page_size()
+    rows = query.order_by(SessionLog.id.desc()).limit(limit).all()
+    return jsonify({
+        "items": [serialize_session(row) for row in rows],
+        "next_cursor": rows[-1].id if len(rows) == limit else None,
+    })
+
+
+@admin_bp.get("/sessions/<int:session_id>")
+@require_admin_token
+def get_session(session_id: int):
+    from flask_app import db
+    from flask_app.models import SessionLog
+
+    log = db.session.get(SessionLog, session_id)
+    if log is None:
+        abort(404)
+    return jsonify(serialize_session(log))
+
+
+def profile_state_dir() -> str:
+    from flask import current_app
+    from flask_app.server import get_state_dir
+    return current_app.config.get("STATE_DIR") or get_state_dir()
+
+
+@admin_bp.post("/profile/<command>")
+@require_admin_token
+def request_profile(command: str):
+    """
+    Запрашивает профиль у процесса бота (см. profiling.py).
+
+    command: cpu (seconds, include_idle, action=stop), heap (action=start|snapshot|stop)
+    или stacks. Параметры — в query string или JSON. Ответ 202 с id запроса;
+    результат — GET /admin/profile/<id>, файл — GET /admin/profile/<id>/file.
+    """
+    from profiling import PROFILE_COMMANDS, submit_request
+
+    if command not in PROFILE_COMMANDS:
+        abort(404)
+    params = dict(request.args)
+    params.update(request.get_json(silent=True) or {})
+    if "seconds" in params:
+        try:
+            params["seconds"] = float(params["seconds"])
+        except (TypeError, ValueError):
+            abort(400, description="Invalid seconds")
+    if "include_idle" in params:
+        params["include_idle"] = str(params["include_idle"]).lower() in ("1", "true", "yes")
+    request_id = submit_request(profile_state_dir(), command, params)
+    return jsonify({"id": request_id, "status": "pending"}), 202
+
+
+@admin_bp.get("/profile/<request_id>")
+@require_admin_token
+def get_profile(request_id: str):
+    from profiling import is_pending, read_result
+
+    state_dir = profile_state_dir()
+    result = read_result(state_dir, request_id)
+    if result is not None:
+        return jsonify(result)
+    if is_pending(state_dir, request_id):
+        return jsonify({"id": request_id, "status": "pending"}), 202
+    abort(404)
+
+
+@admin_bp.get("/profile/<request_id>/file")
+@require_admin_token
+def get_profile_file(request_id: str):
+    from flask import send_file
+    from profiling import read_result
+
+    result = read_result(profile_state_dir(), request_id)
+    # Отдаем только файл, записанный процессом бота для этого запроса
+    if result is None or not result.get("path") or not os.path.isfile(result["path"]):
+        abort(404)
+    return send_file(result["path"], mimetype="text/plain", as_attachment=True)
@@ -0,0 +1,439 @@
+"""
+Аналитика по SessionLog на инкрементальных агрегатах.
+
+Сырые записи sessions один раз сворачиваются в почасовые и посуточные
+агрегаты (rollup_totals, rollup_users, rollup_topics), после чего отчеты
+читают только агрегаты, а не весь лог. Водяной знак rollup_state хранит
+последний обработанный id, поэтому каждый запуск обрабатывает только новые
+строки. Старые сырые строки, уже учтенные в агрегатах, удаляются compact().
+
+Запуск вручную:
+    python -m flask_app.analytics rollup
+    python -m flask_app.analytics compact --raw-days 90 --hourly-days 14
+"""
+
+import os
+import json
+import logging
+import threading
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from flask import Blueprint, abort, jsonify, request
+from sqlalchemy import func
+
+from flask_app import db
+from flask_app.admin import page_size, require_admin_token, serialize_session, parse_datetime_arg
+from flask_app.models import RollupState, RollupTopic, RollupTotals, RollupUser, SessionLog
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ("hour", "day")
+WATERMARK = "sessions"
+
+# Корзины задержки (мс) для объединяемых гистограмм; последняя — +Inf
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 5000, 10000, 20000, 30000, 60000, 120000, 300000)
+
+# Темы запросов: первая совпавшая группа ключевых основ
+TOPIC_KEYWORDS = (
+    ("delivery", ("доставк", "курьер", "самовывоз", "пункт выдачи", "мкад", "отправк")),
+    ("payment", ("оплат", "рассрочк", "кредит", "счет", "счёт", "карт")),
+    ("returns", ("возврат", "вернуть", "обмен")),
+    ("warranty", ("гаранти", "ремонт", "сервисн")),
+    ("availability", ("наличи", "под заказ", "склад", "когда будет")),
+    ("price", ("цен", "стоит", "стоимост", "скидк", "акци", "прайс", "дешев", "дорог")),
+    ("catalog", ("ноутбук", "компьютер", "монитор", "процессор", "видеокарт", "характеристик", "модел")),
+)
+
+
+def classify_topic(text: str) -> str:
+    lowered = text.lower()
+    for topic, stems in TOPIC_KEYWORDS:
+        if any(stem in lowered for stem in stems):
+            return topic
+    return "other"
+
+
+def period_start(ts: datetime, period: str) -> datetime:
+    if period == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def merge_hist(target: List[int], source: List[int]) -> List[int]:
+    size = len(LATENCY_BUCKETS_MS) + 1
+    target = (target + [0] * size)[:size]
+    for i, n in enumerate(source[:size]):
+        target[i] += n
+    return target
+
+
+def hist_percentile(hist: List[int], p: float) -> Optional[float]:
+    """Перцентиль задержки (мс) по верхним границам корзин."""
+    total = sum(hist)
+    if not total:
+        return None
+    rank = p / 100.0 * total
+    seen = 0
+    for bound, n in zip(LATENCY_BUCKETS_MS + (float("inf"),), hist):
+        seen += n
+        if seen >= rank:
+            return bound
+    return float("inf")
+
+
+def _aggregate(rows) -> Tuple[dict, dict, dict]:
+    totals: Dict[tuple, dict] = {}
+    users: Dict[tuple, List[int]] = {}
+    topics: Dict[tuple, int] = {}
+    for row in rows:
+        ts = row.timestamp or datetime.utcnow()
+        hit = 1 if row.cache_hit else 0
+        topic = classify_topic(row.query or "")
+        for period in PERIODS:
+            bucket = period_start(ts, period)
+            agg = totals.setdefault((period, bucket), {
+                "queries": 0, "cache_hits": 0, "latency_count": 0, "latency_sum_ms": 0,
+                "hist": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            })
+            agg["queries"] += 1
+            agg["cache_hits"] += hit
+            if row.latency_ms is not None:
+                agg["latency_count"] += 1
+                agg["latency_sum_ms"] += row.latency_ms
+                agg["hist"][bisect_left(LATENCY_BUCKETS_MS, row.latency_ms)] += 1
+            user = users.setdefault((period, bucket, row.user_id), [0, 0])
+            user[0] += 1
+            user[1] += hit
+            topics[(period, bucket, topic)] = topics.get((period, bucket, topic), 0) + 1
+    return totals, users, topics
+
+
+def _apply(totals: dict, users: dict, topics: dict) -> None:
+    for (period, bucket), agg in totals.items():
+        row = db.session.get(RollupTotals, (period, bucket))
+        if row is None:
+            row = RollupTotals(
+                period=period, bucket_start=bucket, queries=0, cache_hits=0,
+                latency_count=0, latency_sum_ms=0, latency_hist="[]"
+            )
+            db.session.add(row)
+        row.queries += agg["queries"]
+        row.cache_hits += agg["cache_hits"]
+        row.latency_count += agg["latency_count"]
+        row.latency_sum_ms += agg["latency_sum_ms"]
+        row.latency_hist = json.dumps(merge_hist(json.loads(row.latency_hist or "[]"), agg["hist"]))
+    for (period, bucket, user_id), (queries, hits) in users.items():
+        row = db.session.get(RollupUser, (period, bucket, user_id))
+        if row is None:
+            row = RollupUser(period=period, bucket_start=bucket, user_id=user_id, queries=0, cache_hits=0)
+            db.session.add(row)
+        row.queries += queries
+        row.cache_hits += hits
+    for (period, bucket, topic), queries in topics.items():
+        row = db.session.get(RollupTopic, (period, bucket, topic))
+        if row is None:
+            row = RollupTopic(period=period, bucket_start=bucket, topic=topic, queries=0)
+            db.session.add(row)
+        row.queries += queries
+
+
+def _watermark() -> int:
+    last_id = db.session.query(RollupState.last_id).filter(RollupState.name == WATERMARK).scalar()
+    if last_id is None:
+        db.session.add(RollupState(name=WATERMARK, last_id=0))
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+        return 0
+    return last_id
+
+
+def run_rollup(batch_size: int = 5000, max_batches: Optional[int] = None, settle_seconds: float = 60.0) -> int:
+    """
+    Сворачивает новые строки sessions в агрегаты (вызывать в app context).
+
+    Водяной знак сдвигается условным UPDATE в той же транзакции, что и
+    агрегаты: если параллельно работает другой экземпляр, он получит
+    rowcount == 0 и откатится, строки не будут учтены дважды. Строки моложе
+    settle_seconds откладываются до следующего запуска.
+
+    Returns:
+        int: Число обработанных строк
+    """
+    processed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        old = _watermark()
+        rows = (
+            db.session.query(SessionLog)
+            .filter(SessionLog.id > old)
+            .order_by(SessionLog.id)
+            .limit(batch_size)
+            .all()
+        )
+        # Свежие строки не трогаем: при нескольких писателях строка с меньшим
+        # id может закоммититься позже строки с большим и оказаться за водяным знаком
+        cutoff = datetime.utcnow() - timedelta(seconds=settle_seconds)
+        settled = 0
+        while settled < len(rows) and rows[settled].timestamp and rows[settled].timestamp < cutoff:
+            settled += 1
+        rows = rows[:settled]
+        if not rows:
+            break
+        new = rows[-1].id
+        result = db.session.execute(
+            db.text(
+                "UPDATE rollup_state SET last_id = :new, updated_at = :now "
+                "WHERE name = :name AND last_id = :old"
+            ),
+            {"new": new, "now": datetime.utcnow(), "name": WATERMARK, "old": old}
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            logger.info("Rollup watermark moved by another worker, stopping")
+            break
+        _apply(*_aggregate(rows))
+        db.session.commit()
+        processed += len(rows)
+        batches += 1
+    if processed:
+        logger.info(f"Rolled up {processed} session rows")
+    return processed
+
+
+def compact(raw_retention_days: int = 90, hourly_retention_days: int = 14, batch_size: int = 5000) -> dict:
+    """
+    Удаляет старые данные, уже учтенные в агрегатах.
+
+    Сырые строки sessions старше raw_retention_days удаляются пачками и только
+    до водяного знака; почасовые агрегаты старше hourly_retention_days
+    удаляются (посуточные остаются).
+    """
+    watermark = _watermark()
+    raw_cutoff = datetime.utcnow() - timedelta(days=raw_retention_days)
+    deleted_raw = 0
+    while True:
+        ids = [
+            row_id for (row_id,) in db.session.query(SessionLog.id)
+            .filter(SessionLog.timestamp < raw_cutoff, SessionLog.id <= watermark)
+            .order_by(SessionLog.id)
+            .limit(batch_size)
+        ]
+        if not ids:
+            break
+        db.session.query(SessionLog).filter(SessionLog.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted_raw += len(ids)
+
+    hourly_cutoff = period_start(datetime.utcnow() - timedelta(days=hourly_retention_days), "hour")
+    deleted_hourly = 0
+    for model in (RollupTotals, RollupUser, RollupTopic):
+        deleted_hourly += model.query.filter(
+            model.period == "hour", model.bucket_start < hourly_cutoff
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    logger.info(f"Compaction removed {deleted_raw} raw rows and {deleted_hourly} hourly rollup rows")
+    return {"raw_rows": deleted_raw, "hourly_rollups": deleted_hourly}
+
+
+# --- Запросы для дашбордов (только агрегаты) ---
+
+def _range(query, model, period: str, since: Optional[datetime], until: Optional[datetime]):
+    query = query.filter(model.period == period)
+    if since:
+        query = query.filter(model.bucket_start >= since)
+    if until:
+        query = query.filter(model.bucket_start < until)
+    return query
+
+
+def summary(period: str, since: Optional[datetime] = None, until: Optional[datetime] = None) -> dict:
+    """Запросы, доля попаданий в кэш и перцентили задержки по периодам и в целом."""
+    rows = _range(RollupTotals.query, RollupTotals, period, since, until).order_by(RollupTotals.bucket_start).all()
+    buckets = []
+    total_hist: List[int] = []
+    total_queries = total_hits = 0
+    for row in rows:
+        hist = json.loads(row.latency_hist or "[]")
+        total_hist = merge_hist(total_hist, hist)
+        total_queries += row.queries
+        total_hits += row.cache_hits
+        buckets.append({
+            "bucket_start": row.bucket_start.isoformat(),
+            "queries": row.queries,
+            "cache_hits": row.cache_hits,
+            "cache_hit_rate": row.cache_hits / row.queries if row.queries else 0.0,
+            "latency_mean_ms": row.latency_sum_ms / row.latency_count if row.latency_count else None,
+            "latency_p50_ms": hist_percentile(hist, 50),
+            "latency_p95_ms": hist_percentile(hist, 95),
+            "latency_p99_ms": hist_percentile(hist, 99),
+        })
+    return {
+        "period": period,
+        "queries": total_queries,
+        "cache_hits": total_hits,
+        "cache_hit_rate": total_hits / total_queries if total_queries else 0.0,
+        "latency_p50_ms": hist_percentile(total_hist, 50),
+        "latency_p95_ms": hist_percentile(total_hist, 95),
+        "latency_p99_ms": hist_percentile(total_hist, 99),
+        "buckets": buckets,
+    }
+
+
+def top_users(period: str, since=None, until=None, limit: int = 20) -> List[dict]:
+    total = func.sum(RollupUser.queries).label("queries")
+    query = db.session.query(RollupUser.user_id, total, func.sum(RollupUser.cache_hits))
+    rows = (
+        _range(query, RollupUser, period, since, until)
+        .group_by(RollupUser.user_id)
+        .order_by(total.desc())
+        .limit(limit)
+        .all()
+    )
+    return [{"user_id": user_id, "queries": int(q), "cache_hits": int(h or 0)} for user_id, q, h in rows]
+
+
+def top_topics(period: str, since=None, until=None, limit: int = 10) -> List[dict]:
+    total = func.sum(RollupTopic.queries).label("queries")
+    query = db.session.query(RollupTopic.topic, total)
+    rows = (
+        _range(query, RollupTopic, period, since, until)
+        .group_by(RollupTopic.topic)
+        .order_by(total.desc())
+        .limit(limit)
+        .all()
+    )
+    return [{"topic": topic, "queries": int(q)} for topic, q in rows]
+
+
+# --- HTTP API ---
+
+analytics_bp = Blueprint("analytics", __name__, url_prefix="/admin/analytics")
+
+
+def _period() -> str:
+    period = request.args.get("period", "day")
+    if period not in PERIODS:
+        abort(400, description=f"period must be one of {PERIODS}")
+    return period
+
+
+@analytics_bp.get("/summary")
+@require_admin_token
+def summary_endpoint():
+    return jsonify(summary(_period(), parse_datetime_arg("since"), parse_datetime_arg("until")))
+
+
+@analytics_bp.get("/top-users")
+@require_admin_token
+def top_users_endpoint():
+    return jsonify(top_users(_period(), parse_datetime_arg("since"), parse_datetime_arg("until"), page_size()))
+
+
+@analytics_bp.get("/top-topics")
+@require_admin_token
+def top_topics_endpoint():
+    return jsonify(top_topics(_period(), parse_datetime_arg("since"), parse_datetime_arg("until"), page_size()))
+
+
+@analytics_bp.get("/export/sessions")
+@require_admin_token
+def export_sessions():
+    """Выгрузка сырых строк по возрастанию id; следующая страница — after_id=next_after_id."""
+    after_id = request.args.get("after_id", 0, type=int)
+    limit = page_size()
+    rows = db.session.query(SessionLog).filter(SessionLog.id > after_id).order_by(SessionLog.id).limit(limit).all()
+    return jsonify({
+        "items": [dict(serialize_session(row), latency_ms=row.latency_ms, cache_hit=bool(row.cache_hit)) for row in rows],
+        "next_after_id": rows[-1].id if len(rows) == limit else None,
+    })
+
+
+@analytics_bp.get("/export/rollups")
+@require_admin_token
+def export_rollups():
+    """Выгрузка агрегатов по возрастанию bucket_start; следующая страница — after=next_after."""
+    period = _period()
+    after = parse_datetime_arg("after")
+    limit = page_size()
+    query = RollupTotals.query.filter(RollupTotals.period == period)
+    if after:
+        query = query.filter(RollupTotals.bucket_start > after)
+    rows = query.order_by(RollupTotals.bucket_start).limit(limit).all()
+    return jsonify({
+        "items": [
+            {
+                "bucket_start": row.bucket_start.isoformat(),
+                "queries": row.queries,
+                "cache_hits": row.cache_hits,
+                "latency_count": row.latency_count,
+                "latency_sum_ms": row.latency_sum_ms,
+                "latency_hist": json.loads(row.latency_hist or "[]"),
+            }
+            for row in rows
+        ],
+        "latency_buckets_ms": list(LATENCY_BUCKETS_MS),
+        "next_after": rows[-1].bucket_start.isoformat() if len(rows) == limit else None,
+    })
+
+
+class AnalyticsWorker:
+    """
+    Фоновая агрегация и очистка (запускается в процессе health/admin сервера).
+
+    Интервал задается ANALYTICS_INTERVAL (сек, 0 — отключено), сроки хранения —
+    ANALYTICS_RAW_RETENTION_DAYS и ANALYTICS_HOURLY_RETENTION_DAYS.
+    """
+
+    def __init__(self, app, interval: float):
+        self.app = app
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    run_rollup()
+                    compact(
+                        raw_retention_days=int(os.getenv("ANALYTICS_RAW_RETENTION_DAYS", "90")),
+                        hourly_retention_days=int(os.getenv("ANALYTICS_HOURLY_RETENTION_DAYS", "14")),
+                    )
+            except Exception as e:
+                logger.error(f"Analytics rollup failed: {e}")
+
+    def start(self) -> None:
+        if self.interval > 0:
+            threading.Thread(target=self._run, name="analytics-worker", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main(argv=None) -> None:
+    import argparse
+    from flask_app import create_app
+
+    parser = argparse.ArgumentParser(description="SessionLog analytics maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rollup", help="Свернуть новые строки в агрегаты")
+    compact_parser = sub.add_parser("compact", help="Удалить старые сырые строки и почасовые агрегаты")
+    compact_parser.add_argument("--raw-days", type=int, default=int(os.getenv("ANALYTICS_RAW_RETENTION_DAYS", "90")))
+    compact_parser.add_argument("--hourly-days", type=int, default=int(os.getenv("ANALYTICS_HOURLY_RETENTION_DAYS", "14")))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    app = create_app()
+    with app.app_context():
+        if args.command == "rollup":
+            run_rollup()
+        else:
+            run_rollup()
+            compact(args.raw_days, args.hourly_days)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,9 @@ from flask_app import db
 
 class SessionLog(db.Model):
     __tablename__ = "sessions"
+    __table_args__ = (
+        db.Index("ix_sessions_user_id_timestamp", "user_id", "timestamp"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.BigInteger, nullable=False, index=True)
@@ -11,6 +14,54 @@ class SessionLog(db.Model):
     query = db.Column(db.Text, nullable=False)
     response = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    latency_ms = db.Column(db.Integer, nullable=True)
+    cache_hit = db.Column(db.Boolean, nullable=True, default=False)
 
     def __repr__(self):
-        return f"<SessionLog {self.id}: {self.user_id} (@{self.username}) at {self.timestamp}>"
\ No newline at end of file
+        return f"<SessionLog {self.id}: {self.user_id} (@{self.username}) at {self.timestamp}>"
+
+
+class RollupTotals(db.Model):
+    """Агрегаты за час/день: число запросов, попадания в кэш, гистограмма задержек."""
+    __tablename__ = "rollup_totals"
+
+    period = db.Column(db.String(8), primary_key=True)  # hour | day
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    queries = db.Column(db.Integer, nullable=False, default=0)
+    cache_hits = db.Column(db.Integer, nullable=False, default=0)
+    latency_count = db.Column(db.Integer, nullable=False, default=0)
+    latency_sum_ms = db.Column(db.BigInteger, nullable=False, default=0)
+    latency_hist = db.Column(db.Text, nullable=False, default="[]")  # JSON: счетчики по корзинам
+
+
+class RollupUser(db.Model):
+    """Число запросов пользователя за час/день."""
+    __tablename__ = "rollup_users"
+    __table_args__ = (
+        db.Index("ix_rollup_users_period_user", "period", "user_id", "bucket_start"),
+    )
+
+    period = db.Column(db.String(8), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.BigInteger, primary_key=True)
+    queries = db.Column(db.Integer, nullable=False, default=0)
+    cache_hits = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RollupTopic(db.Model):
+    """Число запросов по теме за час/день."""
+    __tablename__ = "rollup_topics"
+
+    period = db.Column(db.String(8), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    topic = db.Column(db.String(32), primary_key=True)
+    queries = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RollupState(db.Model):
+    """Водяной знак инкрементальной агрегации: последний обработанный SessionLog.id."""
+    __tablename__ = "rollup_state"
+
+    name = db.Column(db.String(32), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,204 @@
+"""
+Продакшн-сервер для health/admin API.
+
+Flask-приложение обслуживается waitress с ограниченным пулом потоков в
+отдельном процессе, поэтому проверки здоровья и сбор метрик не конкурируют
+с инференсом за GIL. Процесс бота периодически выгружает метрики и пульс
+в STATE_DIR (StateExporter), а сервер отдает их из файлов.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import signal
+import logging
+import threading
+import subprocess
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILE = "metrics.prom"
+HEARTBEAT_FILE = "heartbeat.json"
+
+
+def get_state_dir() -> str:
+    return os.getenv("STATE_DIR", os.path.join("logs", "state"))
+
+
+def _write_atomic(path: str, data: str) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class StateExporter:
+    """
+    Фоновый поток процесса бота: выгружает метрики и пульс для сервера.
+
+    Args:
+        state_dir: Директория обмена состоянием с сервером
+        status_fn: Функция, возвращающая словарь статуса бота для /health
+        interval: Период выгрузки, сек
+    """
+
+    def __init__(self, state_dir: str, status_fn: Callable[[], dict], interval: float = 5.0):
+        self.state_dir = state_dir
+        self.status_fn = status_fn
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def export(self) -> None:
+        import metrics
+        os.makedirs(self.state_dir, exist_ok=True)
+        _write_atomic(os.path.join(self.state_dir, METRICS_FILE), metrics.render())
+        heartbeat = {"ts": time.time(), "pid": os.getpid()}
+        heartbeat.update(self.status_fn())
+        _write_atomic(os.path.join(self.state_dir, HEARTBEAT_FILE), json.dumps(heartbeat))
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.export()
+            except Exception as e:
+                logger.warning(f"Failed to export bot state: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="state-exporter", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def read_heartbeat(state_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(state_dir, HEARTBEAT_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_metrics(state_dir: str) -> str:
+    try:
+        with open(os.path.join(state_dir, METRICS_FILE), encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def serve(host: str, port: int, state_dir: Optional[str] = None) -> None:
+    """
+    Запускает waitress в текущем процессе (блокирующий вызов).
+
+    Параметры пула задаются переменными окружения:
+        HEALTH_SERVER_THREADS — число рабочих потоков (4)
+        HEALTH_SERVER_CONNECTION_LIMIT — максимум одновременных соединений (100)
+        HEALTH_SERVER_KEEPALIVE — таймаут простоя keep-alive соединения, сек (30)
+    SIGTERM завершает сервер: новые соединения не принимаются, выполняющиеся
+    запросы дорабатывают (waitress ждет их до 5 секунд).
+    """
+    from waitress import create_server
+    from flask_app import create_app
+
+    app = create_app(state_dir=state_dir)
+    if state_dir is not None:
+        # Агрегация аналитики в процессе сервера, вне процесса инференса
+        from flask_app.analytics import AnalyticsWorker
+        AnalyticsWorker(app, float(os.getenv("ANALYTICS_INTERVAL", "300"))).start()
+    server = create_server(
+        app,
+        host=host,
+        port=port,
+        threads=int(os.getenv("HEALTH_SERVER_THREADS", "4")),
+        connection_limit=int(os.getenv("HEALTH_SERVER_CONNECTION_LIMIT", "100")),
+        channel_timeout=int(os.getenv("HEALTH_SERVER_KEEPALIVE", "30")),
+        ident="lfp-bot",
+    )
+
+    def on_term(signum, frame):
+        # waitress перехватывает SystemExit и останавливает пул с ожиданием задач
+        raise SystemExit(0)
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, on_term)
+    logger.info(f"Health/admin server listening on http://{host}:{port}")
+    server.run()
+
+
+def _watch_parent(parent_pid: int) -> None:
+    """Завершает сервер, если процесс бота завершился (не оставляем сирот)."""
+    while True:
+        time.sleep(2)
+        if os.getppid() != parent_pid:
+            logger.warning("Bot process exited, stopping health server")
+            os._exit(0)
+
+
+def main(argv=None) -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description="Health/admin API server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("HEALTH_PORT", "5000")))
+    parser.add_argument("--state-dir", default=get_state_dir())
+    parser.add_argument("--parent-pid", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.parent_pid:
+        threading.Thread(target=_watch_parent, args=(args.parent_pid,), name="parent-watch", daemon=True).start()
+    try:
+        serve(args.host, args.port, args.state_dir)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
+def start_server_process(host: str = "0.0.0.0", port: int = 5000, state_dir: Optional[str] = None):
+    """
+    Запускает сервер отдельным процессом `python -m flask_app.server`.
+
+    Отдельный интерпретатор не импортирует bot.py и не делит с ним GIL.
+    При выходе бота процесс сервера получает SIGTERM.
+    """
+    state_dir = state_dir or get_state_dir()
+    os.makedirs(state_dir, exist_ok=True)
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "flask_app.server",
+            "--host", host,
+            "--port", str(port),
+            "--state-dir", os.path.abspath(state_dir),
+            "--parent-pid", str(os.getpid()),
+        ],
+        cwd=project_root
+    )
+
+    def stop():
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    atexit.register(stop)
+    return process
+
+
+def start_server_thread(host: str = "0.0.0.0", port: int = 5000) -> threading.Thread:
+    """Запускает waitress в потоке текущего процесса (метрики читаются напрямую)."""
+    thread = threading.Thread(target=serve, args=(host, port), name="health-server", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,31 @@
 import os
 import glob
+import hashlib
 import logging
 from typing import List, Tuple
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
+from embeddings import (
+    open_collection,
+    read_active_collection,
+    resolve_embedding_model,
+    write_active_collection,
+)
+from kb_reload import compute_kb_version, write_kb_version
+from shards import build_shards, read_shards, shard_for_path
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-def find_files(root: str) -> List[str]:
-    # Индексируем только текстовые форматы
+def find_files(root: str, recursive: bool = False) -> List[str]:
+    # Индексируем только текстовые форматы (с recursive — и в подкаталогах-разделах)
     patterns = ["*.txt", "*.md"]
     files: List[str] = []
     for pattern in patterns:
-        files.extend(glob.glob(os.path.join(root, pattern)))
-    return files
+        files.extend(glob.glob(os.path.join(root, "**", pattern) if recursive else os.path.join(root, pattern),
+                               recursive=recursive))
+    return sorted(files)
 
 
 def read_text_file(path: str) -> str:
@@ -25,6 +33,11 @@ def read_text_file(path: str) -> str:
         return f.read()
 
 
+def chunk_id(source: str, content: str) -> str:
+    """Стабильный ID фрагмента: не меняется при повторной индексации того же текста."""
+    return hashlib.sha1(f"{source}\0{content}".encode("utf-8")).hexdigest()[:20]
+
+
 def load_texts(paths: List[str]) -> Tuple[List[str], List[dict]]:
     texts: List[str] = []
     metadatas: List[dict] = []
@@ -40,12 +53,63 @@ def load_texts(paths: List[str]) -> Tuple[List[str], List[dict]]:
                 logger.warning(f"Empty content skipped: {path}")
                 continue
             texts.append(content)
-            metadatas.append({"source": path})
+            metadatas.append({"source": path, "chunk_id": chunk_id(path, content)})
         except Exception as e:
             logger.warning(f"Failed to load {path}: {e}")
     return texts, metadatas
 
 
+def ingest_collection(persist_dir: str, texts: List[str], metadatas: List[dict]):
+    """Дописывает документы в активную коллекцию и возвращает ее модель."""
+    # Индекс остается на модели, которой построен: смена модели — через reembed.py
+    active = read_active_collection(persist_dir)
+    spec = resolve_embedding_model(os.getenv("EMBEDDING_MODEL") or active["model"])
+    logger.info(f"Initializing embeddings ({spec.hf_name})...")
+    vectordb = open_collection(persist_dir, active["collection"], spec)
+    if spec.name != active["model"]:
+        if vectordb._collection.count() > 0:
+            raise SystemExit(
+                f"Knowledge base is embedded with {active['model']}, EMBEDDING_MODEL is {spec.name}. "
+                f"Run `python reembed.py migrate --model {spec.name}` first."
+            )
+        write_active_collection(persist_dir, active["collection"], spec)
+
+    logger.info(f"Building/Updating Chroma at: {persist_dir} (collection {active['collection']})")
+    vectordb.add_texts(
+        texts=texts,
+        metadatas=metadatas,
+        ids=[metadata["chunk_id"] for metadata in metadatas]
+    )
+    vectordb.persist()
+
+    if os.getenv("VECTOR_STORE", "chroma").lower() == "compact":
+        from compact_store import build_from_chroma
+        build_from_chroma(
+            persist_dir,
+            mode=os.getenv("COMPACT_STORE_MODE", "int8"),
+            rescore=os.getenv("COMPACT_STORE_RESCORE", "0") == "1",
+            pq_subspaces=int(os.getenv("COMPACT_STORE_PQ_SUBSPACES", "48")),
+        )
+    return spec
+
+
+def ingest_shards(persist_dir: str, root: str, texts: List[str], metadatas: List[dict]):
+    """
+    Строит коллекции по разделам базы знаний (KB_SHARDING=1) и возвращает их модель.
+
+    Шарды каждый раз строятся из файлов заново, поэтому смена EMBEDDING_MODEL
+    не требует reembed.py.
+    """
+    previous = read_shards(persist_dir)
+    spec = resolve_embedding_model(os.getenv("EMBEDDING_MODEL") or (previous or {}).get("model"))
+    for metadata in metadatas:
+        metadata["shard"] = shard_for_path(root, metadata["source"])
+    logger.info(f"Building sharded knowledge base at: {persist_dir} ({spec.hf_name})")
+    manifest = build_shards(persist_dir, root, texts, metadatas, spec)
+    logger.info(f"Shards: {', '.join(manifest['shards'])} (old generation kept until `reembed.py cleanup`)")
+    return spec
+
+
 def main():
     root = os.getenv("KB_PATH", "knowledge_base")
     persist_dir = (
@@ -54,8 +118,9 @@ def main():
         or "./chroma_db"
     )
 
+    sharding = os.getenv("KB_SHARDING", "0") == "1"
     logger.info(f"Loading documents from: {root}")
-    paths = find_files(root)
+    paths = find_files(root, recursive=sharding)
     if not paths:
         logger.warning("No documents found to ingest")
         return
@@ -66,21 +131,16 @@ def main():
         logger.warning("No documents loaded")
         return
 
-    logger.info("Initializing embeddings...")
-    embedder = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={"device": "cpu"}
-    )
+    os.makedirs(persist_dir, exist_ok=True)
+    if sharding:
+        spec = ingest_shards(persist_dir, root, texts, metadatas)
+    else:
+        spec = ingest_collection(persist_dir, texts, metadatas)
 
-    logger.info(f"Building/Updating Chroma at: {persist_dir}")
-    vectordb = Chroma.from_texts(
-        texts=texts,
-        embedding=embedder,
-        metadatas=metadatas,
-        persist_directory=persist_dir
-    )
-    vectordb.persist()
-    logger.info("Ingestion completed successfully")
+    # Версия пишется последней: бот сбрасывает кэш поиска при ее смене
+    version = compute_kb_version(texts, metadatas, model=spec.name)
+    write_kb_version(persist_dir, version, len(texts))
+    logger.info(f"Ingestion completed successfully (knowledge base version {version})")
 
 
 if __name__ == "__main__":
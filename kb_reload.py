@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import traceback
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Файл с версией содержимого базы знаний, который пишет ingest.py
+KB_VERSION_FILE = "kb_version.json"
+
+
+def compute_kb_version(texts: Iterable[str], metadatas: Iterable[dict], model: str = "") -> str:
+    """Версия базы знаний — хэш проиндексированных документов, их источников и модели эмбеддингов."""
+    digest = hashlib.sha256()
+    if model:
+        digest.update(f"model:{model}\0".encode("utf-8"))
+    for text, metadata in sorted(zip(texts, metadatas), key=lambda item: item[1].get("source", "")):
+        digest.update(metadata.get("source", "").encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def write_kb_version(persist_dir: str, version: str, documents: int) -> None:
+    """Атомарно записывает версию базы знаний рядом с индексом Chroma."""
+    path = os.path.join(persist_dir, KB_VERSION_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "documents": documents, "built_at": time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def read_kb_version(persist_dir: str) -> Optional[str]:
+    """Читает версию, записанную ingest.py (None, если индекс создан без нее)."""
+    try:
+        with open(os.path.join(persist_dir, KB_VERSION_FILE), "r", encoding="utf-8") as f:
+            return json.load(f).get("version")
+    except (OSError, ValueError):
+        return None
+
+
+class KnowledgeBaseSnapshot:
+    """
+    Неизменяемый набор ресурсов базы знаний: ретривер, QA цепь и промпт.
+
+    version — порядковый номер загрузки в процессе, kb_version — версия
+    содержимого индекса из ingest.py (или "load-<version>", если ее нет).
+    """
+
+    __slots__ = ("retriever", "qa_chain", "system_prompt", "version", "kb_version", "loaded_at")
+
+    def __init__(self, retriever: Any, qa_chain: Any, system_prompt: str, version: int,
+                 kb_version: Optional[str] = None):
+        self.retriever = retriever
+        self.qa_chain = qa_chain
+        self.system_prompt = system_prompt
+        self.version = version
+        self.kb_version = kb_version or f"load-{version}"
+        self.loaded_at = time.time()
+
+
+def _paths_fingerprint(paths: Iterable[str]) -> Tuple:
+    """Отпечаток набора файлов/директорий: (путь, размер, mtime) для всех файлов."""
+    entries: List[Tuple[str, int, float]] = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in files:
+                    full = os.path.join(root, name)
+                    try:
+                        st = os.stat(full)
+                    except OSError:
+                        continue
+                    entries.append((full, st.st_size, st.st_mtime))
+        elif os.path.exists(path):
+            st = os.stat(path)
+            entries.append((path, st.st_size, st.st_mtime))
+    return tuple(sorted(entries))
+
+
+class KnowledgeBaseManager:
+    """
+    Держит текущий снимок базы знаний и атомарно подменяет его при перезагрузке.
+
+    Обработчики берут `manager.current` один раз в начале запроса, поэтому
+    запросы в процессе выполнения дорабатывают на старой версии. LLM при
+    перезагрузке не пересоздается: build_chain использует закэшированный пайплайн.
+
+    Args:
+        build_retriever: Функция создания нового ретривера (fresh=True)
+        build_chain: Функция (retriever, system_prompt) -> qa_chain
+        read_prompt: Функция чтения системного промпта с диска
+        watch_paths: Файлы/директории, изменения которых вызывают перезагрузку
+        read_version: Функция чтения версии содержимого индекса
+    """
+
+    def __init__(
+        self,
+        build_retriever: Callable[[], Any],
+        build_chain: Callable[[Any, str], Any],
+        read_prompt: Callable[[], str],
+        watch_paths: Iterable[str] = (),
+        read_version: Optional[Callable[[], Optional[str]]] = None,
+    ):
+        self.build_retriever = build_retriever
+        self.build_chain = build_chain
+        self.read_prompt = read_prompt
+        self.read_version = read_version
+        self.watch_paths = list(watch_paths)
+        self._current: Optional[KnowledgeBaseSnapshot] = None
+        self._version = 0
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def current(self) -> Optional[KnowledgeBaseSnapshot]:
+        return self._current
+
+    def load(self, retriever: Any = None) -> KnowledgeBaseSnapshot:
+        """Создает новый снимок (блокирующий вызов, выполнять вне event loop)."""
+        # Версию читаем до открытия индекса: при гонке с ingest.py результаты
+        # нового индекса попадут под старую версию и будут сброшены при
+        # следующей перезагрузке (а не наоборот — старые под новой)
+        kb_version = self.read_version() if self.read_version else None
+        if retriever is None:
+            retriever = self.build_retriever()
+        try:
+            system_prompt = self.read_prompt()
+        except Exception as e:
+            if self._current is None:
+                raise
+            logger.error(f"Failed to read system prompt, keeping previous one: {e}")
+            system_prompt = self._current.system_prompt
+        qa_chain = self.build_chain(retriever, system_prompt)
+        self._version += 1
+        return KnowledgeBaseSnapshot(retriever, qa_chain, system_prompt, self._version, kb_version)
+
+    def swap(self, snapshot: KnowledgeBaseSnapshot) -> None:
+        """Атомарно делает снимок текущим."""
+        self._current = snapshot
+        logger.info(f"Knowledge base version {snapshot.version} ({snapshot.kb_version}) is now active")
+
+    def reload(self) -> bool:
+        """
+        Пересобирает ретривер и промпт и подменяет текущий снимок.
+
+        Returns:
+            bool: True если перезагрузка выполнена, False если уже идет другая
+                перезагрузка или произошла ошибка (старая версия остается активной)
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            logger.info("Knowledge base reload already in progress, skipping")
+            return False
+        try:
+            started = time.perf_counter()
+            logger.info("Reloading knowledge base...")
+            snapshot = self.load()
+            self.swap(snapshot)
+            self.last_error = None
+            logger.info(f"Knowledge base reloaded in {time.perf_counter() - started:.1f}s")
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Knowledge base reload failed, keeping previous version: {e}")
+            logger.error(traceback.format_exc())
+            return False
+        finally:
+            self._reload_lock.release()
+
+    def start_watcher(self, interval: float) -> None:
+        """
+        Запускает фоновый поток, отслеживающий изменения watch_paths.
+
+        Перезагрузка выполняется, когда отпечаток изменился и оставался
+        стабильным между двумя опросами (ingest.py успел дописать файлы).
+        """
+        if self._watcher is not None or interval <= 0 or not self.watch_paths:
+            return
+
+        def watch():
+            applied = _paths_fingerprint(self.watch_paths)
+            pending = None
+            while not self._stop.wait(interval):
+                try:
+                    fingerprint = _paths_fingerprint(self.watch_paths)
+                except Exception as e:
+                    logger.warning(f"Knowledge base watcher failed to scan files: {e}")
+                    continue
+                if fingerprint == applied:
+                    pending = None
+                elif fingerprint != pending:
+                    pending = fingerprint
+                elif self.reload():
+                    applied = fingerprint
+                    pending = None
+
+        self._watcher = threading.Thread(target=watch, name="kb-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Knowledge base watcher started (interval {interval}s)")
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
@@ -0,0 +1,235 @@
+"""
+Очередь заданий LLM с приоритетами и дедлайнами.
+
+Задания выбираются из очереди по классу приоритета (администраторы,
+платные пользователи, короткие вопросы, остальные), затем по порядку
+поступления. Внутри класса приоритета тенанты (боты одного процесса)
+обслуживаются справедливо по весам: виртуальное время тенанта растет на
+1/вес за каждое задание (start-time fair queuing), поэтому поток запросов
+одного бота не вытесняет остальных. Задание, дедлайн которого истек в очереди, отбрасывается
+до запуска модели; если дедлайн истекает во время генерации, декодирование
+останавливается критерием остановки (см. chains.JobStoppingCriteria),
+который читает текущее задание из contextvar.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import itertools
+import contextvars
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+import metrics
+from executors import run_in
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CLASSES = ("admin", "paid", "short", "normal")
+
+_jobs_total = metrics.counter("llm_jobs_total", "LLM jobs by priority class and outcome")
+_job_wait = metrics.histogram("llm_job_queue_wait_seconds", "Time an LLM job waits in the priority queue")
+_queue_depth = metrics.gauge("llm_job_queue_depth", "LLM jobs waiting in the priority queue")
+
+
+class JobDeadlineExceeded(Exception):
+    """Дедлайн задания истек (в очереди или во время генерации)."""
+    pass
+
+
+class Job:
+    """
+    Задание LLM.
+
+    Args:
+        fn: Блокирующая функция, выполняемая в пуле llm
+        args: Аргументы функции
+        priority: Класс приоритета из PRIORITY_CLASSES
+        deadline: Момент time.monotonic(), после которого результат не нужен (None — без дедлайна)
+        max_new_tokens: Ограничение длины генерации (None — по настройке модели)
+        tenant: Тенант (бот), которому принадлежит задание
+    """
+
+    def __init__(self, fn: Callable, args: tuple, priority: str = "normal", deadline: Optional[float] = None,
+                 max_new_tokens: Optional[int] = None, tenant: str = "default"):
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.deadline = deadline
+        self.max_new_tokens = max_new_tokens
+        self.tenant = tenant
+        self.virtual_start = 0.0
+        self.steps = 0
+        self.submitted = time.monotonic()
+        self.cancel_event = threading.Event()
+        self.future: Optional[asyncio.Future] = None
+        # Контекст отправителя (ID запроса для логов и т.п.) — задание выполняется в нем
+        self.context = contextvars.copy_context()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def should_stop(self) -> bool:
+        """Проверяется критерием остановки на каждом шаге декодирования."""
+        return self.cancel_event.is_set() or self.expired()
+
+    def step(self) -> bool:
+        """Шаг декодирования: True, если генерацию пора остановить (в т.ч. по max_new_tokens)."""
+        self.steps += 1
+        if self.max_new_tokens is not None and self.steps >= self.max_new_tokens:
+            return True
+        return self.should_stop()
+
+
+current_job: contextvars.ContextVar[Optional[Job]] = contextvars.ContextVar("current_llm_job", default=None)
+
+
+def should_stop_current_job() -> bool:
+    """True, если выполняемое в этом потоке задание отменено или просрочено."""
+    job = current_job.get()
+    return job is not None and job.should_stop()
+
+
+def step_current_job() -> bool:
+    """Учитывает шаг декодирования текущего задания; True — остановить генерацию."""
+    job = current_job.get()
+    return job is not None and job.step()
+
+
+class LLMScheduler:
+    """
+    Приоритетная очередь перед пулом llm.
+
+    Число одновременно выполняемых заданий равно числу потоков пула, поэтому
+    ожидание происходит здесь, где видны приоритеты и дедлайны, а не в
+    FIFO-очереди ThreadPoolExecutor.
+
+    Args:
+        concurrency: Число одновременно выполняемых заданий
+        weights: Веса тенантов (по умолчанию 1)
+    """
+
+    def __init__(self, concurrency: int = 1, weights: Optional[Dict[str, float]] = None):
+        self.concurrency = concurrency
+        self.weights: Dict[str, float] = dict(weights or {})
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._virtual_finish: Dict[str, float] = {}
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        return cls(concurrency=int(os.getenv("LLM_EXECUTOR_WORKERS", "1")))
+
+    def _ensure_started(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            _queue_depth.set_function(lambda: self._queue.qsize())
+            loop = asyncio.get_running_loop()
+            self._workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def set_weight(self, tenant: str, weight: float) -> None:
+        self.weights[tenant] = weight
+
+    def _virtual_tag(self, job: Job) -> float:
+        """Виртуальное время завершения задания для справедливого порядка между тенантами."""
+        job.virtual_start = max(self._virtual_time, self._virtual_finish.get(job.tenant, 0.0))
+        finish = job.virtual_start + 1.0 / self.weights.get(job.tenant, 1.0)
+        self._virtual_finish[job.tenant] = finish
+        return finish
+
+    async def submit(self, fn: Callable, *args, priority: str = "normal", timeout: Optional[float] = None,
+                     max_new_tokens: Optional[int] = None, tenant: str = "default"):
+        """
+        Ставит задание в очередь и ждет результата.
+
+        Args:
+            fn: Блокирующая функция
+            *args: Аргументы функции
+            priority: Класс приоритета
+            timeout: Время от постановки в очередь до дедлайна, сек (None — без дедлайна)
+            max_new_tokens: Ограничение длины генерации (короткие служебные задания)
+            tenant: Тенант, в чью долю очереди засчитывается задание
+
+        Raises:
+            JobDeadlineExceeded: Дедлайн истек до или во время выполнения
+        """
+        self._ensure_started()
+        deadline = time.monotonic() + timeout if timeout else None
+        job = Job(fn, args, priority, deadline, max_new_tokens, tenant)
+        job.future = asyncio.get_running_loop().create_future()
+        # Отмена ожидающего (например, задача обработчика отменена) останавливает генерацию
+        job.future.add_done_callback(lambda f: f.cancelled() and job.cancel_event.set())
+        rank = PRIORITY_CLASSES.index(priority) if priority in PRIORITY_CLASSES else len(PRIORITY_CLASSES)
+        self._queue.put_nowait((rank, self._virtual_tag(job), next(self._seq), job))
+        return await job.future
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, _, job = await self._queue.get()
+            self._virtual_time = max(self._virtual_time, job.virtual_start)
+            try:
+                await self._execute(job)
+            except Exception as e:
+                logger.error(f"LLM scheduler worker error: {e}")
+
+    async def _execute(self, job: Job) -> None:
+        if job.future.done():
+            _jobs_total.inc(priority=job.priority, outcome="cancelled")
+            return
+        _job_wait.observe(time.monotonic() - job.submitted, priority=job.priority)
+        if job.expired():
+            _jobs_total.inc(priority=job.priority, outcome="expired")
+            logger.warning(f"Dropping expired LLM job ({job.priority}) after {time.monotonic() - job.submitted:.1f}s in queue")
+            job.future.set_exception(JobDeadlineExceeded("Deadline exceeded while queued"))
+            return
+        job.context.run(current_job.set, job)
+        try:
+            result = await run_in("llm", job.context.run, job.fn, *job.args)
+        except Exception as e:
+            outcome, error = "error", e
+        else:
+            outcome, error = "done", None
+        if error is None and job.should_stop():
+            # Генерация была прервана: частичный ответ не возвращаем
+            outcome, error = "expired", JobDeadlineExceeded("Deadline exceeded during generation")
+        _jobs_total.inc(priority=job.priority, outcome=outcome)
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    async def close(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+
+def classify_priority(user_id: int, query: str, admin_ids: Iterable[int] = (), paid_ids: Iterable[int] = (),
+                      short_query_chars: int = 80) -> str:
+    """
+    Определяет класс приоритета запроса.
+
+    Args:
+        user_id: ID пользователя
+        query: Текст запроса
+        admin_ids: ID администраторов
+        paid_ids: ID платных пользователей
+        short_query_chars: Порог длины короткого вопроса
+
+    Returns:
+        str: Класс из PRIORITY_CLASSES
+    """
+    if user_id in admin_ids:
+        return "admin"
+    if user_id in paid_ids:
+        return "paid"
+    if len(query) <= short_query_chars:
+        return "short"
+    return "normal"
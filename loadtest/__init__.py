@@ -0,0 +1 @@
+"""Нагрузочное тестирование бота с локальной заглушкой Telegram Bot API."""
@@ -0,0 +1,201 @@
+"""
+Локальная заглушка Telegram Bot API для нагрузочного тестирования.
+
+Реализует методы, которые использует bot.py (getMe, getUpdates, sendMessage,
+editMessageText, setWebhook/deleteWebhook), и сообщает о каждом исходящем
+сообщении через колбэк on_message(chat_id, text).
+"""
+
+import json
+import time
+import random
+import logging
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {
+    "id": 100000001,
+    "is_bot": True,
+    "first_name": "LoadTestBot",
+    "username": "loadtest_bot",
+    "can_join_groups": False,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+class FakeBotAPI:
+    """
+    In-memory Bot API сервер.
+
+    Args:
+        host: Адрес для прослушивания
+        port: Порт (0 — выбрать свободный)
+        on_message: Колбэк для каждого исходящего сообщения бота
+        flood_rate: Доля запросов на отправку, отвечаемых 429 Too Many Requests
+        api_latency_ms: Искусственная задержка ответа API
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        on_message: Optional[Callable[[int, str], None]] = None,
+        flood_rate: float = 0.0,
+        api_latency_ms: float = 0.0,
+    ):
+        self.on_message = on_message
+        self.flood_rate = flood_rate
+        self.api_latency_ms = api_latency_ms
+        self._updates = deque()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._cond = threading.Condition()
+        self.calls = {}
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        logger.info(f"Fake Bot API listening on {self.base_url}")
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def make_update(self, user_id: int, text: str) -> dict:
+        """Создает JSON входящего сообщения от пользователя user_id."""
+        with self._cond:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+                "from": user,
+                "text": text,
+            },
+        }
+
+    def push_update(self, update: dict) -> None:
+        """Ставит обновление в очередь getUpdates (режим polling)."""
+        with self._cond:
+            self._updates.append(update)
+            self._cond.notify_all()
+
+    # --- Bot API ---
+
+    def _get_updates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._updates and self._updates[0]["update_id"] < offset:
+                self._updates.popleft()
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+            return [self._updates[i] for i in range(min(limit, len(self._updates)))]
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params["chat_id"])
+        with self._cond:
+            message_id = int(params.get("message_id") or 0) or self._next_message_id
+            self._next_message_id += 1
+        text = params.get("text", "")
+        if self.on_message is not None:
+            self.on_message(chat_id, text)
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    def handle(self, method: str, params: dict):
+        """Возвращает (http_status, payload) для вызова метода Bot API."""
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.api_latency_ms:
+            time.sleep(self.api_latency_ms / 1000.0)
+        if method in ("sendMessage", "editMessageText") and self.flood_rate and random.random() < self.flood_rate:
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = self._get_updates(params)
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(params)
+        else:
+            # setWebhook, deleteWebhook, sendChatAction, setMyCommands и т.п.
+            result = True
+        return 200, {"ok": True, "result": result}
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _params(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode("utf-8") if length else ""
+                content_type = self.headers.get("Content-Type", "")
+                if "json" in content_type and body:
+                    return json.loads(body)
+                raw = parse_qs(body)
+                raw.update(parse_qs(urlparse(self.path).query))
+                params = {}
+                for key, values in raw.items():
+                    value = values[-1]
+                    try:
+                        params[key] = json.loads(value)
+                    except ValueError:
+                        params[key] = value
+                return params
+
+            def _dispatch(self):
+                method = urlparse(self.path).path.rsplit("/", 1)[-1]
+                try:
+                    status, payload = api.handle(method, self._params())
+                except Exception as e:
+                    status, payload = 400, {"ok": False, "error_code": 400, "description": str(e)}
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+        return Handler
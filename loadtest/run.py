@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный и soak-тест бота без обращения к настоящему Telegram.
+
+Поднимает заглушку Bot API, собирает Application через bot.build_application
+и имитирует тысячи пользователей, которые задают вопросы и ждут ответа.
+LLM заменяется заглушкой с настраиваемой задержкой (INFERENCE_BACKEND=stub).
+
+Пример:
+    python -m loadtest.run --users 2000 --duration 600 --mode polling
+    python -m loadtest.run --users 500 --duration 14400 --mode webhook --report soak.json
+
+Режим webhook требует python-telegram-bot[webhooks] (tornado).
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadtest.fake_bot_api import FakeBotAPI  # noqa: E402
+
+logger = logging.getLogger("loadtest")
+
+QUERIES = [
+    "Сколько стоит ноутбук BusinessPro X1?",
+    "Есть ли в наличии GamerForce Z7?",
+    "Какие условия доставки по Москве?",
+    "а сколько стоит доставка за МКАД?",
+    "Можно ли забрать заказ самовывозом?",
+    "Какая гарантия на ноутбуки?",
+    "Какой процессор в BusinessPro X1?",
+    "Какие способы оплаты вы принимаете?",
+    "Доставляете ли вы в регионы?",
+    "Есть ли скидки для юридических лиц?",
+    "Сколько весит игровой ноутбук?",
+    "Как связаться с менеджером?",
+    "Какой режим работы пунктов выдачи?",
+    "Можно ли вернуть товар?",
+    "Какая видеокарта в GamerForce Z7?",
+    "а он есть в наличии?",
+]
+PLACEHOLDER_PREFIX = "⏳"
+ERROR_MARKERS = ("Извините", "Произошла ошибка", "Бот еще не", "❌")
+
+
+class Histogram:
+    """Гистограмма с логарифмическими корзинами: фиксированная память для soak-теста."""
+
+    def __init__(self, min_value: float = 1e-4, max_value: float = 3600.0, growth: float = 1.05):
+        self.min_value = min_value
+        self.log_growth = math.log(growth)
+        self.counts = [0] * (int(math.log(max_value / min_value) / self.log_growth) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        index = 0 if value <= self.min_value else int(math.log(value / self.min_value) / self.log_growth) + 1
+        self.counts[min(index, len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.min_value * math.exp(self.log_growth * index), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        # ru_maxrss в КБ на Linux (пиковое значение, если /proc недоступен)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_slope(samples: List[Tuple[float, int]]) -> float:
+    """Наклон роста RSS (МБ/час) методом наименьших квадратов."""
+    if len(samples) < 2:
+        return 0.0
+    n = len(samples)
+    mean_t = sum(t for t, _ in samples) / n
+    mean_m = sum(m for _, m in samples) / n
+    var = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not var:
+        return 0.0
+    cov = sum((t - mean_t) * (m - mean_m) for t, m in samples)
+    return cov / var * 3600 / (1024 * 1024)
+
+
+class Stats:
+    """Счетчики и гистограммы нагрузочного теста (потокобезопасно)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: Dict[int, Tuple[float, asyncio.Future, asyncio.AbstractEventLoop]] = {}
+        self.sent = 0
+        self.completed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latency = Histogram()
+        self.loop_lag = Histogram()
+        self.memory: List[Tuple[float, int]] = []
+        self.elapsed = 0.0
+
+    def on_bot_message(self, chat_id: int, text: str) -> None:
+        """Колбэк заглушки Bot API: первый ответ, не являющийся заглушкой, завершает запрос."""
+        if text.startswith(PLACEHOLDER_PREFIX):
+            return
+        with self.lock:
+            entry = self.pending.pop(chat_id, None)
+        if entry is None:
+            return
+        started, future, loop = entry
+        elapsed = time.monotonic() - started
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result((elapsed, text)))
+
+
+class LoadGenerator:
+    """Имитация пользователей в отдельном потоке со своим event loop."""
+
+    def __init__(self, api: FakeBotAPI, stats: Stats, args, webhook_url: Optional[str]):
+        self.api = api
+        self.stats = stats
+        self.args = args
+        self.webhook_url = webhook_url
+        self.client = None
+
+    async def send(self, update: dict) -> None:
+        if self.webhook_url:
+            response = await self.client.post(self.webhook_url, json=update)
+            response.raise_for_status()
+        else:
+            self.api.push_update(update)
+
+    async def user(self, user_id: int, deadline: float) -> None:
+        loop = asyncio.get_running_loop()
+        stats = self.stats
+        await asyncio.sleep(random.uniform(0, self.args.ramp_up))
+        while time.monotonic() < deadline:
+            future = loop.create_future()
+            with stats.lock:
+                stats.pending[user_id] = (time.monotonic(), future, loop)
+                stats.sent += 1
+            try:
+                await self.send(self.api.make_update(user_id, random.choice(QUERIES)))
+                elapsed, text = await asyncio.wait_for(future, self.args.timeout)
+                with stats.lock:
+                    stats.latency.add(elapsed)
+                    if text.startswith(ERROR_MARKERS):
+                        stats.errors += 1
+                    else:
+                        stats.completed += 1
+            except asyncio.TimeoutError:
+                with stats.lock:
+                    stats.pending.pop(user_id, None)
+                    stats.timeouts += 1
+            except Exception as e:
+                logger.warning(f"User {user_id} failed to send update: {e}")
+                with stats.lock:
+                    stats.pending.pop(user_id, None)
+                    stats.errors += 1
+            await asyncio.sleep(random.expovariate(1.0 / self.args.think_time) if self.args.think_time > 0 else 0)
+
+    async def main(self) -> None:
+        if self.webhook_url:
+            import httpx
+            limits = httpx.Limits(max_connections=self.args.webhook_connections)
+            self.client = httpx.AsyncClient(limits=limits, timeout=30)
+        deadline = time.monotonic() + self.args.duration
+        try:
+            await asyncio.gather(*(self.user(1_000_000 + i, deadline) for i in range(self.args.users)))
+        finally:
+            if self.client is not None:
+                await self.client.aclose()
+
+    def run(self) -> None:
+        asyncio.run(self.main())
+
+
+async def monitor_loop_lag(stats: Stats, interval: float = 0.1) -> None:
+    """Задержка event loop бота: насколько позже запланированного просыпается sleep."""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = time.monotonic() - started - interval
+        with stats.lock:
+            stats.loop_lag.add(max(lag, 0.0))
+
+
+def monitor_memory(stats: Stats, stop: threading.Event, interval: float) -> None:
+    started = time.monotonic()
+    while True:
+        with stats.lock:
+            stats.memory.append((time.monotonic() - started, rss_bytes()))
+        if stop.wait(interval):
+            return
+
+
+def progress_line(stats: Stats, elapsed: float, previous: int) -> Tuple[str, int]:
+    with stats.lock:
+        done = stats.completed + stats.errors
+        line = (
+            f"[{elapsed:7.0f}s] sent={stats.sent} ok={stats.completed} err={stats.errors} "
+            f"timeout={stats.timeouts} in_flight={len(stats.pending)} "
+            f"p95={stats.latency.percentile(95):.2f}s lag_p99={stats.loop_lag.percentile(99) * 1000:.1f}ms "
+            f"rss={rss_bytes() / 1024 / 1024:.0f}MB"
+        )
+    return line, done - previous
+
+
+async def run(application, api: FakeBotAPI, stats: Stats, args) -> None:
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+
+    webhook_url = None
+    if args.mode == "polling":
+        await application.updater.start_polling(poll_interval=0.0, timeout=10)
+    else:
+        webhook_url = f"http://127.0.0.1:{args.webhook_port}/webhook"
+        await application.updater.start_webhook(
+            listen="127.0.0.1",
+            port=args.webhook_port,
+            url_path="webhook",
+            webhook_url=webhook_url
+        )
+    await application.start()
+
+    lag_task = asyncio.create_task(monitor_loop_lag(stats))
+    stop_memory = threading.Event()
+    memory_thread = threading.Thread(
+        target=monitor_memory, args=(stats, stop_memory, args.memory_interval), name="loadtest-memory", daemon=True
+    )
+    memory_thread.start()
+
+    generator = threading.Thread(
+        target=LoadGenerator(api, stats, args, webhook_url).run, name="loadtest-generator", daemon=True
+    )
+    started = time.monotonic()
+    generator.start()
+    last_report = started
+    done_before = 0
+    while generator.is_alive():
+        await asyncio.sleep(0.5)
+        now = time.monotonic()
+        if now - last_report >= args.report_interval:
+            line, done = progress_line(stats, now - started, done_before)
+            done_before += done
+            logger.info(f"{line} rps={done / (now - last_report):.1f}")
+            last_report = now
+    stats.elapsed = time.monotonic() - started
+
+    lag_task.cancel()
+    stop_memory.set()
+    memory_thread.join()
+    await application.updater.stop()
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+
+
+def build_report(stats: Stats, api: FakeBotAPI, args) -> dict:
+    memory = [m for _, m in stats.memory]
+    finished = stats.completed + stats.errors
+    attempted = finished + stats.timeouts
+    return {
+        "config": vars(args),
+        "duration_s": stats.elapsed,
+        "requests": {
+            "sent": stats.sent,
+            "completed": stats.completed,
+            "errors": stats.errors,
+            "timeouts": stats.timeouts,
+            "error_rate": (stats.errors + stats.timeouts) / attempted if attempted else 0.0,
+        },
+        "throughput_rps": finished / stats.elapsed if stats.elapsed else 0.0,
+        "latency_s": stats.latency.summary(),
+        "event_loop_lag_s": stats.loop_lag.summary(),
+        "memory": {
+            "rss_start_mb": memory[0] / 1024 / 1024 if memory else 0.0,
+            "rss_end_mb": memory[-1] / 1024 / 1024 if memory else 0.0,
+            "rss_peak_mb": max(memory) / 1024 / 1024 if memory else 0.0,
+            "growth_mb_per_hour": memory_slope(stats.memory),
+        },
+        "bot_api_calls": dict(api.calls),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушкой Telegram Bot API")
+    parser.add_argument("--users", type=int, default=1000, help="Число одновременных пользователей")
+    parser.add_argument("--duration", type=float, default=300, help="Длительность теста, сек")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--think-time", type=float, default=5.0, help="Средняя пауза пользователя между вопросами, сек")
+    parser.add_argument("--ramp-up", type=float, default=30.0, help="Время подключения всех пользователей, сек")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Таймаут ожидания ответа, сек")
+    parser.add_argument("--llm-latency-ms", type=float, default=500.0, help="Задержка заглушки LLM")
+    parser.add_argument("--llm-jitter-ms", type=float, default=100.0, help="Разброс задержки заглушки LLM")
+    parser.add_argument("--real-llm", action="store_true", help="Использовать настоящую модель вместо заглушки")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Доля ответов 429 от Bot API")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="Задержка ответов Bot API")
+    parser.add_argument("--webhook-port", type=int, default=8443)
+    parser.add_argument("--webhook-connections", type=int, default=100)
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Период вывода прогресса, сек")
+    parser.add_argument("--memory-interval", type=float, default=5.0, help="Период замера RSS, сек")
+    parser.add_argument("--report", default="logs/loadtest_report.json", help="Файл JSON-отчета")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args) -> None:
+    """Окружение бота для теста (не переопределяет явно заданные переменные)."""
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:LOADTEST")
+    os.environ.setdefault("HUGGINGFACEHUB_API_TOKEN", "loadtest")
+    os.environ.setdefault("ENABLE_HEALTH_SERVER", "0")
+    os.environ.setdefault("KB_WATCH_INTERVAL", "0")
+    os.environ.setdefault("DATABASE_URI", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'loadtest.db')}")
+    # Заглушка Bot API нумерует обновления с 1: очередь прошлого прогона приняла бы их за повторы
+    os.environ.setdefault("UPDATE_QUEUE_PATH", os.path.join(tempfile.mkdtemp(), "update_queue.db"))
+    if not args.real_llm:
+        os.environ["INFERENCE_BACKEND"] = "stub"
+        os.environ["STUB_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+        os.environ["STUB_LLM_JITTER_MS"] = str(args.llm_jitter_ms)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+
+    import bot  # импорт после настройки окружения: bot.py инициализируется при импорте
+
+    # Логи бота на каждый запрос слишком подробны для нагрузочного теста
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    stats = Stats()
+    api = FakeBotAPI(on_message=stats.on_bot_message, flood_rate=args.flood_rate, api_latency_ms=args.api_latency_ms)
+    api.start()
+    try:
+        application = bot.build_application(base_url=api.base_url)
+        asyncio.run(run(application, api, stats, args))
+    finally:
+        api.stop()
+
+    report = build_report(stats, api, args)
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Неблокирующее структурированное логирование процесса бота.
+
+Обработчики логирования не выполняются на пути запроса: запись кладется в
+ограниченную очередь (QueueHandler), а форматирование, запись в файл с
+ротацией по размеру и вывод в консоль выполняет поток QueueListener. При
+переполнении очереди записи отбрасываются (метрика log_records_dropped_total) —
+обработчик сообщения никогда не ждет диска.
+
+Каждая запись получает контекст запроса (request_id, tenant, user_id) из
+contextvars: bind_request() в обработчике сообщения, пулы executors и
+задания LLM переносят контекст в свои потоки.
+
+Частые INFO-записи горячего пути можно сэмплировать по логгерам
+(LOG_SAMPLING="bot.requests=0.1"): решение принимается по request_id,
+поэтому запрос попадает в лог либо целиком, либо никак. WARNING и выше
+пишутся всегда.
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import zlib
+import logging
+import contextvars
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import metrics
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("log_request_id", default="-")
+tenant_var: contextvars.ContextVar[str] = contextvars.ContextVar("log_tenant", default="-")
+user_id_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("log_user_id", default=None)
+
+_dropped = metrics.counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+_sampled_out = metrics.counter("log_records_sampled_out_total", "INFO log records skipped by per-logger sampling")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_request_id() -> str:
+    return os.urandom(6).hex()
+
+
+def bind_request(tenant: str = "-", user_id: Optional[int] = None, request_id: Optional[str] = None) -> str:
+    """
+    Привязывает контекст запроса к текущей задаче asyncio (и ко всему, что она запускает).
+
+    Returns:
+        str: ID запроса
+    """
+    request_id = request_id or new_request_id()
+    request_id_var.set(request_id)
+    tenant_var.set(tenant)
+    user_id_var.set(user_id)
+    return request_id
+
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """`"bot.requests=0.1,chains=0.5"` → {"bot.requests": 0.1, "chains": 0.5}."""
+    rates: Dict[str, float] = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+class RequestContextFilter(logging.Filter):
+    """Добавляет к записи контекст запроса; выполняется в потоке, создавшем запись."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.tenant = tenant_var.get()
+        record.user_id = user_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Сэмплирование записей ниже WARNING по логгерам.
+
+    Args:
+        rates: Доля сохраняемых записей по имени логгера (действует и на дочерние логгеры)
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # Самое длинное совпадающее имя — самое специфичное правило
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+
+    def rate_for(self, name: str) -> float:
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate_for(record.name)
+        if rate >= 1.0:
+            return True
+        request_id = getattr(record, "request_id", "-")
+        if request_id != "-":
+            keep = zlib.crc32(request_id.encode()) / 2**32 < rate
+        else:
+            keep = random.random() < rate
+        if not keep:
+            _sampled_out.inc(logger=record.name)
+        return keep
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-запись на строку: время, уровень, логгер, сообщение и контекст запроса."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            "tenant": getattr(record, "tenant", "-"),
+            "thread": record.threadName,
+        }
+        if getattr(record, "user_id", None) is not None:
+            data["user_id"] = record.user_id
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке.
+
+    Стандартный prepare() форматирует запись для передачи между процессами;
+    слушатель работает в этом же процессе, поэтому запись передается как есть,
+    а сообщение собирается в потоке слушателя.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Ожидание места в очереди заблокировало бы event loop — запись теряется
+            _dropped.inc(level=record.levelname)
+
+
+def setup_logging(log_path: str = os.path.join("logs", "bot.log")) -> logging.handlers.QueueListener:
+    """
+    Настраивает корневой логгер процесса бота по переменным окружения.
+
+    LOG_LEVEL — уровень (INFO), LOG_FORMAT — формат файла (json | text),
+    LOG_MAX_BYTES / LOG_BACKUP_COUNT — ротация файла (10 МБ, 5 архивов),
+    LOG_QUEUE_SIZE — емкость очереди записей (10000),
+    LOG_SAMPLING — доли сохраняемых INFO-записей по логгерам.
+
+    Returns:
+        QueueListener: Поток записи логов (останавливается при выходе процесса)
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_path,
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+        encoding="utf-8",
+    )
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    # Порядок важен: контекст читается в потоке запроса, до сэмплирования по request_id
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(SamplingFilter(parse_sampling(os.getenv("LOG_SAMPLING", ""))))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging() -> None:
+    """Дописывает очередь и останавливает поток записи логов."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
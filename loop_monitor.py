@@ -0,0 +1,107 @@
+"""
+Мониторинг задержки event loop.
+
+Корутина-пульс засыпает на фиксированный интервал и измеряет, насколько
+позже она просыпается (гистограмма event_loop_lag_seconds). Отдельный
+поток-сторож проверяет свежесть пульса: если цикл не отвечает дольше
+порога, в лог пишется стек потока event loop, то есть место, где
+выполняется блокирующий колбэк.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_lag = metrics.histogram(
+    "event_loop_lag_seconds",
+    "Delay between scheduled and actual wake-up of the event loop heartbeat",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+_stalls = metrics.counter("event_loop_stalls_total", "Event loop stalls longer than the configured threshold")
+
+
+class LoopLagMonitor:
+    """
+    Args:
+        interval: Период пульса, сек
+        threshold: Порог задержки, после которого логируется стек, сек
+        cooldown: Минимальный интервал между дампами стека, сек
+    """
+
+    def __init__(self, interval: float = 0.25, threshold: float = 0.1, cooldown: float = 30.0):
+        self.interval = interval
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._last_dump = 0.0
+
+    @classmethod
+    def from_env(cls) -> "LoopLagMonitor":
+        return cls(
+            interval=float(os.getenv("LOOP_LAG_INTERVAL_MS", "250")) / 1000.0,
+            threshold=float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100")) / 1000.0,
+            cooldown=float(os.getenv("LOOP_LAG_DUMP_COOLDOWN", "30")),
+        )
+
+    async def _pulse(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        while True:
+            started = time.monotonic()
+            self._heartbeat = started
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - started - self.interval, 0.0)
+            _lag.observe(lag)
+            if lag > self.threshold:
+                _stalls.inc()
+                logger.warning(f"Event loop lag {lag * 1000:.0f} ms exceeds threshold")
+
+    def _watch(self) -> None:
+        stalled = False
+        while not self._stop.wait(self.interval / 2):
+            behind = time.monotonic() - self._heartbeat - self.interval
+            if behind <= self.threshold:
+                stalled = False
+                continue
+            now = time.monotonic()
+            if stalled or now - self._last_dump < self.cooldown or self._loop_thread_id is None:
+                continue
+            stalled = True
+            self._last_dump = now
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            logger.warning(f"Event loop blocked for {behind * 1000:.0f} ms, loop thread stack:\n{stack}")
+
+    def heartbeat_age(self) -> float:
+        """Сколько секунд назад event loop последний раз выполнил пульс."""
+        return max(time.monotonic() - self._heartbeat - self.interval, 0.0)
+
+    def start(self) -> None:
+        """Запускает пульс в текущем event loop и поток-сторож."""
+        if self._task is not None:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._pulse())
+        threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True).start()
+        logger.info(
+            f"Event loop lag monitor started (interval {self.interval * 1000:.0f} ms, "
+            f"threshold {self.threshold * 1000:.0f} ms)"
+        )
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,234 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Слова-маркеры уточняющих вопросов ("а сколько стоит доставка?", "а его цвет?")
+_FOLLOW_UP_PREFIXES = ("а ", "и ", "ну ", "тогда ", "ещё ", "еще ", "также ", "а,")
+_FOLLOW_UP_WORDS = frozenset({
+    "это", "этот", "эта", "эти", "этого", "этой", "этих", "тот", "та", "те", "того",
+    "он", "она", "оно", "они", "его", "её", "ее", "их", "ему", "ей", "им",
+    "там", "туда", "такой", "такая", "такие", "него", "неё", "нее", "них",
+})
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def approx_token_count(text: str) -> int:
+    """Грубая оценка числа токенов (~3 символа на токен для кириллицы)."""
+    return len(text) // 3 + 1
+
+
+class _Turn:
+    __slots__ = ("question", "answer", "tokens")
+
+    def __init__(self, question: str, answer: str, tokens: int):
+        self.question = question
+        self.answer = answer
+        self.tokens = tokens
+
+
+class _Conversation:
+    __slots__ = ("turns", "summary", "last_seen")
+
+    def __init__(self):
+        self.turns: Deque[_Turn] = deque()
+        self.summary = ""
+        self.last_seen = time.monotonic()
+
+
+class ConversationStore:
+    """
+    Ограниченное по памяти LRU-хранилище истории диалогов, ключ — user_id.
+
+    Args:
+        max_users: Максимальное число пользователей в памяти (LRU-вытеснение)
+        max_turns: Максимальное число пар вопрос/ответ на пользователя
+        token_budget: Бюджет токенов на историю, подставляемую в промпт
+        max_answer_chars: Длина ответа, сохраняемая в истории
+        idle_ttl: Время простоя (сек), после которого история сбрасывается
+        count_tokens: Функция подсчета токенов
+        loader: Опциональная функция (user_id, limit, since) -> [(query, response)]
+            для восстановления истории из SessionLog при промахе кэша; since —
+            время UTC, более ранние реплики не загружаются (простой или /reset)
+    """
+
+    def __init__(
+        self,
+        max_users: int = 10000,
+        max_turns: int = 6,
+        token_budget: int = 512,
+        max_answer_chars: int = 600,
+        idle_ttl: float = 3600.0,
+        count_tokens: Callable[[str], int] = approx_token_count,
+        loader: Optional[Callable[[int, int, datetime], List[Tuple[str, str]]]] = None,
+    ):
+        self.max_users = max_users
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.max_answer_chars = max_answer_chars
+        self.idle_ttl = idle_ttl
+        self.count_tokens = count_tokens
+        self.loader = loader
+        self._data: "OrderedDict[int, _Conversation]" = OrderedDict()
+        # Время /reset по пользователям (time.time()); старше idle_ttl не нужно
+        self._reset_at: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "ConversationStore":
+        """Создает хранилище с параметрами из переменных окружения."""
+        return cls(
+            max_users=int(os.getenv("CONVERSATION_MAX_USERS", "10000")),
+            max_turns=int(os.getenv("CONVERSATION_MAX_TURNS", "6")),
+            token_budget=int(os.getenv("CONVERSATION_TOKEN_BUDGET", "512")),
+            max_answer_chars=int(os.getenv("CONVERSATION_ANSWER_CHARS", "600")),
+            idle_ttl=float(os.getenv("CONVERSATION_IDLE_TTL", "3600")),
+            **kwargs,
+        )
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _get(self, user_id: int) -> Optional[_Conversation]:
+        conv = self._data.get(user_id)
+        if conv is None:
+            return None
+        if time.monotonic() - conv.last_seen > self.idle_ttl:
+            del self._data[user_id]
+            return None
+        self._data.move_to_end(user_id)
+        return conv
+
+    def _insert(self, user_id: int, conv: _Conversation) -> None:
+        self._data[user_id] = conv
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.max_users:
+            self._data.popitem(last=False)
+
+    def _hydrate(self, user_id: int) -> Optional[_Conversation]:
+        """Восстанавливает историю через loader (вызывать вне блокировки)."""
+        if self.loader is None:
+            return None
+        since = time.time() - self.idle_ttl
+        with self._lock:
+            since = max(since, self._reset_at.get(user_id, since))
+        try:
+            rows = self.loader(user_id, self.max_turns, datetime.utcfromtimestamp(since))
+        except Exception as e:
+            logger.warning(f"Failed to load conversation history for user {user_id}: {e}")
+            return None
+        if not rows:
+            return None
+        conv = _Conversation()
+        for question, answer in rows:
+            self._append(conv, question, answer)
+        return conv
+
+    def _append(self, conv: _Conversation, question: str, answer: str) -> None:
+        answer = (answer or "")[: self.max_answer_chars]
+        tokens = self.count_tokens(question) + self.count_tokens(answer)
+        conv.turns.append(_Turn(question, answer, tokens))
+        conv.last_seen = time.monotonic()
+        self._compact(conv)
+
+    def _compact(self, conv: _Conversation) -> None:
+        """Удерживает историю в пределах max_turns и token_budget.
+
+        Вытесненные реплики сворачиваются в короткое резюме из прошлых вопросов.
+        """
+        total = sum(t.tokens for t in conv.turns)
+        dropped = []
+        while conv.turns and (len(conv.turns) > self.max_turns or total > self.token_budget):
+            turn = conv.turns.popleft()
+            total -= turn.tokens
+            dropped.append(turn.question)
+        if not dropped:
+            return
+        topics = [q for q in conv.summary.split("; ") if q] + dropped
+        # Резюме не должно занимать больше четверти бюджета
+        limit = max(self.token_budget // 4, 1)
+        while topics and self.count_tokens("; ".join(topics)) > limit:
+            topics.pop(0)
+        conv.summary = "; ".join(topics)
+
+    def add_turn(self, user_id: int, question: str, answer: str) -> None:
+        """Добавляет пару вопрос/ответ в историю пользователя."""
+        with self._lock:
+            conv = self._get(user_id)
+            if conv is None:
+                conv = _Conversation()
+                self._insert(user_id, conv)
+            self._append(conv, question, answer)
+
+    def get_history(self, user_id: int) -> Tuple[str, List[Tuple[str, str]]]:
+        """
+        Возвращает резюме и список последних пар (вопрос, ответ).
+
+        При промахе кэша пытается восстановить историю через loader.
+        """
+        with self._lock:
+            conv = self._get(user_id)
+            if conv is not None:
+                return conv.summary, [(t.question, t.answer) for t in conv.turns]
+        conv = self._hydrate(user_id)
+        if conv is None:
+            return "", []
+        with self._lock:
+            # Другой поток мог успеть создать запись, пока мы читали БД
+            existing = self._get(user_id)
+            if existing is not None:
+                conv = existing
+            else:
+                self._insert(user_id, conv)
+            return conv.summary, [(t.question, t.answer) for t in conv.turns]
+
+    def clear(self, user_id: int) -> None:
+        """Сбрасывает историю пользователя (в том числе сохраненную в SessionLog для loader)."""
+        now = time.time()
+        with self._lock:
+            self._data.pop(user_id, None)
+            self._reset_at[user_id] = now
+            if len(self._reset_at) > self.max_users:
+                expired = now - self.idle_ttl
+                self._reset_at = {uid: at for uid, at in self._reset_at.items() if at > expired}
+
+
+def format_history(summary: str, turns: Iterable[Tuple[str, str]]) -> str:
+    """Форматирует историю диалога для подстановки в промпт."""
+    lines = []
+    if summary:
+        lines.append(f"Ранее обсуждали: {summary}")
+    for question, answer in turns:
+        lines.append(f"Клиент: {question}")
+        lines.append(f"Ассистент: {answer}")
+    return "\n".join(lines)
+
+
+def is_follow_up(query: str) -> bool:
+    """Эвристика: является ли запрос уточнением к предыдущему вопросу."""
+    text = query.strip().lower()
+    if text.startswith(_FOLLOW_UP_PREFIXES):
+        return True
+    words = _WORD_RE.findall(text)
+    if len(words) <= 3:
+        return True
+    return any(word in _FOLLOW_UP_WORDS for word in words)
+
+
+def rewrite_query(query: str, turns: List[Tuple[str, str]]) -> str:
+    """
+    Переписывает уточняющий запрос в самостоятельный для поиска по базе знаний.
+
+    "а сколько стоит доставка?" после "Есть ли у вас кресло Comfort?"
+    превращается в "Есть ли у вас кресло Comfort? а сколько стоит доставка?".
+    """
+    if not turns or not is_follow_up(query):
+        return query
+    previous_question = turns[-1][0]
+    return f"{previous_question} {query}"
@@ -0,0 +1,40 @@
+"""
+Асинхронный слой хранения логов сессий.
+
+Запись из обработчиков бота идет через BatchWriter без блокировки event
+loop: PostgreSQL (asyncpg, пул соединений, COPY) в продакшене, SQLite
+(aiosqlite, WAL) локально. Схема создается миграциями persistence.migrations.
+"""
+
+import os
+
+from persistence.base import BatchWriter, SessionRecord, SessionStore
+
+
+def create_store(database_uri: str) -> SessionStore:
+    """
+    Создает хранилище по URI базы данных (тот же DATABASE_URI, что у Flask).
+
+    Args:
+        database_uri: URI вида postgresql[+driver]://... или sqlite:///path
+
+    Returns:
+        SessionStore: Неподключенное хранилище
+    """
+    scheme, _, rest = database_uri.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    if dialect in ("postgresql", "postgres"):
+        from persistence.postgres import PostgresSessionStore
+        return PostgresSessionStore(
+            f"postgresql://{rest}",
+            min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+            max_size=int(os.getenv("DB_POOL_SIZE", "5"))
+        )
+    if dialect == "sqlite":
+        from persistence.sqlite import SQLiteSessionStore
+        # sqlite:///relative.db -> relative.db, sqlite:////abs.db -> /abs.db
+        return SQLiteSessionStore(rest[1:] if rest.startswith("/") else rest)
+    raise ValueError(f"Unsupported database for async session store: {dialect}")
+
+
+__all__ = ["BatchWriter", "SessionRecord", "SessionStore", "create_store"]
@@ -0,0 +1,123 @@
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_written = metrics.counter("session_log_written_total", "SessionLog rows written by the async writer")
+_dropped = metrics.counter("session_log_dropped_total", "SessionLog rows dropped (queue full or write failure)")
+_flush_seconds = metrics.histogram("session_log_flush_seconds", "Duration of one batched SessionLog insert")
+
+
+class SessionRecord(NamedTuple):
+    """Строка таблицы sessions (схема совпадает с flask_app.models.SessionLog)."""
+    user_id: int
+    username: Optional[str]
+    query: str
+    response: str
+    timestamp: datetime
+    latency_ms: Optional[int] = None
+    cache_hit: bool = False
+
+
+SESSION_COLUMNS = ("user_id", "username", "query", "response", "timestamp", "latency_ms", "cache_hit")
+
+
+class SessionStore(ABC):
+    """Асинхронное хранилище логов сессий (бэкенд реализует все методы)."""
+
+    @abstractmethod
+    async def connect(self) -> None:
+        ...
+
+    @abstractmethod
+    async def close(self) -> None:
+        ...
+
+    @abstractmethod
+    async def insert_many(self, records: Sequence[SessionRecord]) -> None:
+        ...
+
+    @abstractmethod
+    async def fetch_recent(self, user_id: int, limit: int,
+                           since: Optional[datetime] = None) -> List[Tuple[str, str]]:
+        """Последние пары (query, response) пользователя позже since (UTC), от старых к новым."""
+
+
+class BatchWriter:
+    """
+    Буферизованная запись логов: handler кладет запись в очередь и не ждет БД.
+
+    Фоновая задача сбрасывает очередь пачками (до batch_size записей или раз в
+    flush_interval секунд) одним COPY/executemany. При переполнении очереди
+    записи отбрасываются со счетчиком session_log_dropped_total.
+
+    Args:
+        store: Хранилище
+        batch_size: Максимальный размер пачки
+        flush_interval: Максимальная задержка записи, сек
+        max_queue: Максимальная длина очереди
+    """
+
+    def __init__(self, store: SessionStore, batch_size: int = 200, flush_interval: float = 0.5, max_queue: int = 10000):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+
+    def log(self, record: SessionRecord) -> None:
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            _dropped.inc(reason="queue_full")
+            logger.warning("Session log queue is full, dropping record")
+
+    async def _flush(self, batch: List[SessionRecord]) -> None:
+        started = time.perf_counter()
+        try:
+            await self.store.insert_many(batch)
+            _written.inc(len(batch))
+        except Exception as e:
+            _dropped.inc(len(batch), reason="write_error")
+            logger.error(f"Failed to write {len(batch)} session log records: {e}")
+        finally:
+            _flush_seconds.observe(time.perf_counter() - started)
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        """Останавливает фоновую задачу и записывает остаток очереди."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        for i in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[i:i + self.batch_size])
@@ -0,0 +1,171 @@
+"""
+Версионированные миграции схемы БД.
+
+Каждая миграция — функция (conn, dialect), применяемая один раз; номер
+примененной версии записывается в schema_migrations. Миграции учитывают
+базы, созданные до их появления (через db.create_all и ALTER TABLE), и
+проверяют наличие таблиц/колонок перед изменением.
+
+Для PostgreSQL весь прогон выполняется под advisory lock, поэтому
+несколько реплик бота могут стартовать одновременно.
+"""
+
+import logging
+from typing import Callable, List, Tuple, Union
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+# Произвольный ключ advisory lock для миграций
+_PG_LOCK_KEY = 7318452009
+
+
+def _timestamp_type(dialect: str) -> str:
+    return "TIMESTAMP" if dialect == "postgresql" else "DATETIME"
+
+
+def _columns(conn: Connection, table: str) -> List[str]:
+    return [col["name"] for col in inspect(conn).get_columns(table)]
+
+
+def _has_table(conn: Connection, table: str) -> bool:
+    return inspect(conn).has_table(table)
+
+
+def m001_create_sessions(conn: Connection, dialect: str) -> None:
+    if _has_table(conn, "sessions"):
+        return
+    id_type = "SERIAL" if dialect == "postgresql" else "INTEGER"
+    conn.execute(text(f"""
+        CREATE TABLE sessions (
+            id {id_type} NOT NULL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            query TEXT NOT NULL,
+            response TEXT NOT NULL,
+            timestamp {_timestamp_type(dialect)}
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sessions_user_id ON sessions (user_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sessions_timestamp ON sessions (timestamp)"))
+
+
+def m002_sessions_username(conn: Connection, dialect: str) -> None:
+    if "username" not in _columns(conn, "sessions"):
+        conn.execute(text("ALTER TABLE sessions ADD COLUMN username VARCHAR(255)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sessions_username ON sessions (username)"))
+
+
+def m003_sessions_latency_cache(conn: Connection, dialect: str) -> None:
+    columns = _columns(conn, "sessions")
+    if "latency_ms" not in columns:
+        conn.execute(text("ALTER TABLE sessions ADD COLUMN latency_ms INTEGER"))
+    if "cache_hit" not in columns:
+        conn.execute(text("ALTER TABLE sessions ADD COLUMN cache_hit BOOLEAN"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_sessions_user_id_timestamp ON sessions (user_id, timestamp)"
+    ))
+
+
+def m004_rollup_tables(conn: Connection, dialect: str) -> None:
+    ts = _timestamp_type(dialect)
+    json_type = "JSON" if dialect == "postgresql" else "TEXT"
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS rollup_totals (
+            period VARCHAR(8) NOT NULL,
+            bucket_start {ts} NOT NULL,
+            queries INTEGER NOT NULL,
+            cache_hits INTEGER NOT NULL,
+            latency_count INTEGER NOT NULL,
+            latency_sum_ms BIGINT NOT NULL,
+            latency_hist {json_type} NOT NULL,
+            PRIMARY KEY (period, bucket_start)
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS rollup_users (
+            period VARCHAR(8) NOT NULL,
+            bucket_start {ts} NOT NULL,
+            user_id BIGINT NOT NULL,
+            queries INTEGER NOT NULL,
+            cache_hits INTEGER NOT NULL,
+            PRIMARY KEY (period, bucket_start, user_id)
+        )
+    """))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_rollup_users_period_user ON rollup_users (period, user_id, bucket_start)"
+    ))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS rollup_topics (
+            period VARCHAR(8) NOT NULL,
+            bucket_start {ts} NOT NULL,
+            topic VARCHAR(32) NOT NULL,
+            queries INTEGER NOT NULL,
+            PRIMARY KEY (period, bucket_start, topic)
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name VARCHAR(32) NOT NULL PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            updated_at {ts}
+        )
+    """))
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection, str], None]]] = [
+    (1, "create_sessions", m001_create_sessions),
+    (2, "sessions_username", m002_sessions_username),
+    (3, "sessions_latency_cache", m003_sessions_latency_cache),
+    (4, "rollup_tables", m004_rollup_tables),
+]
+
+
+def _applied_versions(conn: Connection) -> set:
+    ts = _timestamp_type(conn.dialect.name)
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER NOT NULL PRIMARY KEY,
+            name VARCHAR(64) NOT NULL,
+            applied_at {ts} DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def migrate(bind: Union[Engine, str]) -> List[int]:
+    """
+    Применяет недостающие миграции.
+
+    Args:
+        bind: SQLAlchemy Engine или URI базы данных
+
+    Returns:
+        List[int]: Номера примененных в этом запуске миграций
+    """
+    engine = create_engine(bind) if isinstance(bind, str) else bind
+    dialect = engine.dialect.name
+    applied_now = []
+    with engine.begin() as conn:
+        if dialect == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PG_LOCK_KEY})
+        applied = _applied_versions(conn)
+        for version, name, fn in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info(f"Applying migration {version:03d}_{name}")
+            fn(conn, dialect)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                {"version": version, "name": name}
+            )
+            applied_now.append(version)
+    return applied_now
+
+
+def current_version(bind: Union[Engine, str]) -> int:
+    engine = create_engine(bind) if isinstance(bind, str) else bind
+    with engine.begin() as conn:
+        applied = _applied_versions(conn)
+    return max(applied, default=0)
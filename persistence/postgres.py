@@ -0,0 +1,51 @@
+import logging
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from persistence.base import SESSION_COLUMNS, SessionRecord, SessionStore
+
+logger = logging.getLogger(__name__)
+
+
+class PostgresSessionStore(SessionStore):
+    """
+    Хранилище на пуле соединений asyncpg.
+
+    Пачки записываются через COPY: вставка только добавляет строки и не
+    берет блокировок на существующие, поэтому несколько реплик бота пишут
+    в одну базу без конкуренции.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool = None
+
+    async def connect(self) -> None:
+        import asyncpg
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        logger.info(f"PostgreSQL session store connected (pool {self.min_size}-{self.max_size})")
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def insert_many(self, records: Sequence[SessionRecord]) -> None:
+        async with self._pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                "sessions",
+                records=[tuple(r) for r in records],
+                columns=list(SESSION_COLUMNS)
+            )
+
+    async def fetch_recent(self, user_id: int, limit: int,
+                           since: Optional[datetime] = None) -> List[Tuple[str, str]]:
+        async with self._pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT query, response FROM sessions WHERE user_id = $1 AND timestamp > $2 "
+                "ORDER BY timestamp DESC LIMIT $3",
+                user_id, since or datetime.min, limit
+            )
+        return [(row["query"], row["response"]) for row in reversed(rows)]
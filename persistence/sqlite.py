@@ -0,0 +1,65 @@
+import logging
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from persistence.base import SESSION_COLUMNS, SessionRecord, SessionStore
+
+logger = logging.getLogger(__name__)
+
+# Формат, в котором SQLAlchemy хранит DateTime в SQLite
+_SQLITE_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Хранилище на aiosqlite для локального запуска.
+
+    База открывается в режиме WAL: читатели (health/admin сервер, аналитика)
+    не блокируют запись, а запись пачками держит блокировку минимально.
+    """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._conn = None
+
+    async def connect(self) -> None:
+        import aiosqlite
+        self._conn = await aiosqlite.connect(self.path)
+        await self._conn.execute("PRAGMA journal_mode=WAL")
+        await self._conn.execute("PRAGMA synchronous=NORMAL")
+        await self._conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        logger.info(f"SQLite session store connected: {self.path}")
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def insert_many(self, records: Sequence[SessionRecord]) -> None:
+        rows = [
+            (
+                r.user_id, r.username, r.query, r.response,
+                r.timestamp.strftime(_SQLITE_TIMESTAMP_FORMAT), r.latency_ms, int(bool(r.cache_hit)),
+            )
+            for r in records
+        ]
+        placeholders = ", ".join("?" for _ in SESSION_COLUMNS)
+        await self._conn.executemany(
+            f"INSERT INTO sessions ({', '.join(SESSION_COLUMNS)}) VALUES ({placeholders})",
+            rows
+        )
+        await self._conn.commit()
+
+    async def fetch_recent(self, user_id: int, limit: int,
+                           since: Optional[datetime] = None) -> List[Tuple[str, str]]:
+        # Строки времени одного формата сравниваются лексикографически
+        since_text = (since or datetime.min).strftime(_SQLITE_TIMESTAMP_FORMAT)
+        cursor = await self._conn.execute(
+            "SELECT query, response FROM sessions WHERE user_id = ? AND timestamp > ? "
+            "ORDER BY timestamp DESC LIMIT ?",
+            (user_id, since_text, limit)
+        )
+        rows = await cursor.fetchall()
+        await cursor.close()
+        return [(q, r) for q, r in reversed(rows)]
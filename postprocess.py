@@ -0,0 +1,178 @@
+"""
+Постобработка ответов модели и подготовка текста для Telegram.
+
+Управляющие токены чата (<|im_end|> и т.п.) в первую очередь убираются при
+декодировании: генерация останавливается на токенах конца реплики
+(end_of_turn_token_ids), а pipeline декодирует с skip_special_tokens, то
+есть по ID специальных токенов токенизатора. clean_answer — страховка для
+текста, где теги пришли обычным текстом (заглушка LLM, модели без
+специальных токенов, FAQ): обрезает ответ на первом маркере конца реплики
+и за один проход регулярным выражением убирает оставшиеся теги,
+нормализует пробелы и пустые строки. Переводы строк, отступы списков и
+блоки кода сохраняются.
+
+format_for_telegram переводит Markdown ответа (**жирный**, *курсив*,
+`код`, блоки ```, [ссылки](https://...), заголовки #) в разметку Telegram
+HTML или MarkdownV2 и экранирует остальной текст — тоже за один проход.
+"""
+
+import re
+import html
+from typing import Any, Callable, Dict, List, Optional
+
+TRUNCATION_NOTE = "\n\n[Ответ сокращен]"
+
+# Маркеры конца реплики: все, что модель сгенерировала после них, — выдуманные следующие реплики
+END_OF_TURN_MARKERS = ("<|im_end|>", "<|endoftext|>", "<|eot_id|>", "<|end|>", "</s>")
+
+PARSE_MODES = ("HTML", "MarkdownV2")
+
+_END_OF_TURN_RE = re.compile("|".join(re.escape(marker) for marker in END_OF_TURN_MARKERS))
+_LEADING_CONTROL_RE = re.compile(r"\A(?:\s|<\|im_start\|>(?:assistant)?|<\|[a-z_]{1,32}\|>|<s>)+")
+
+# Опережающая проверка первого символа отсекает большинство позиций до перебора альтернатив
+_NORMALIZE_RE = re.compile(
+    r"(?=[`<\[\n \t\u00a0])(?:"
+    r"(?P<code>```.*?(?:```|\Z))"
+    r"|(?P<token><\|im_start\|>(?:system|user|assistant)?\n?|<\|[a-z_]{1,32}\|>|\[/?INST\]|</?s>)"
+    r"|(?P<blank>\n(?:[ \t\u00a0]*\n){2,})"
+    r"|(?P<trailing>[ \t\u00a0]+(?=\n|\Z))"
+    r"|(?P<space>(?<=\S)(?:[ \t\u00a0]{2,}|[\t\u00a0]))"
+    r")",
+    re.DOTALL,
+)
+_NORMALIZE_REPLACEMENTS: Dict[str, Optional[str]] = {
+    "code": None,  # блок кода без изменений
+    "token": "",
+    "blank": "\n\n",
+    "trailing": "",
+    "space": " ",
+}
+
+_MARKUP_RE = re.compile(
+    r"(?=[`*\[#])(?:"
+    r"```(?:[\w+-]*\n)?(?P<pre>.*?)```"
+    r"|`(?P<code>[^`\n]+)`"
+    r"|\*\*(?P<bold>[^\n]+?)\*\*"
+    r"|(?<![\w*\\])\*(?=\S)(?P<italic>[^*\n]+?)(?<=\S)\*(?![\w*])"
+    r"|\[(?P<link_text>[^\]\n]+)\]\((?P<url>https?://[^)\s]+)\)"
+    r"|^#{1,6}[ \t]+(?P<heading>[^\n]+)$"
+    r")",
+    re.DOTALL | re.MULTILINE,
+)
+# Экранирование MarkdownV2 таблицей str.translate (быстрее подстановки регулярным выражением)
+_MDV2_ESCAPE = str.maketrans({char: "\\" + char for char in "_*[]()~`>#+-=|{}.!\\"})
+_MDV2_CODE_ESCAPE = str.maketrans({char: "\\" + char for char in "`\\"})
+_MDV2_URL_ESCAPE = str.maketrans({char: "\\" + char for char in ")\\"})
+
+
+def _normalize_match(match: "re.Match") -> str:
+    replacement = _NORMALIZE_REPLACEMENTS[match.lastgroup]
+    return match.group() if replacement is None else replacement
+
+
+def clean_answer(text: str, max_chars: int = 0) -> str:
+    """
+    Очищает ответ модели от управляющих тегов и лишних пробелов.
+
+    Args:
+        text: Ответ модели
+        max_chars: Ограничение длины (0 — без ограничения)
+
+    Returns:
+        str: Ответ без тегов; абзацы, списки и блоки кода сохранены
+    """
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = _LEADING_CONTROL_RE.sub("", text)
+    end = _END_OF_TURN_RE.search(text)
+    if end is not None:
+        text = text[:end.start()]
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars] + TRUNCATION_NOTE
+    return _NORMALIZE_RE.sub(_normalize_match, text).strip()
+
+
+def end_of_turn_token_ids(tokenizer: Any) -> List[int]:
+    """
+    ID токенов, на которых генерация должна остановиться: eos и специальные
+    токены конца реплики из END_OF_TURN_MARKERS, известные токенизатору.
+    """
+    ids: List[int] = []
+    if getattr(tokenizer, "eos_token_id", None) is not None:
+        ids.append(tokenizer.eos_token_id)
+    special = set(getattr(tokenizer, "all_special_ids", ()))
+    for marker in END_OF_TURN_MARKERS:
+        token_id = tokenizer.convert_tokens_to_ids(marker)
+        if token_id in special and token_id != getattr(tokenizer, "unk_token_id", None) and token_id not in ids:
+            ids.append(token_id)
+    return ids
+
+
+# --- Разметка Telegram ---
+
+def _escape_html(text: str) -> str:
+    return html.escape(text, quote=False)
+
+
+def _escape_markdown_v2(text: str) -> str:
+    return text.translate(_MDV2_ESCAPE)
+
+
+def _html_entity(match: "re.Match") -> str:
+    kind = match.lastgroup
+    if kind == "url":
+        return f'<a href="{html.escape(match.group("url"))}">{_escape_html(match.group("link_text"))}</a>'
+    inner = _escape_html(match.group(kind))
+    if kind == "pre":
+        return f"<pre>{inner}</pre>"
+    if kind == "code":
+        return f"<code>{inner}</code>"
+    if kind == "italic":
+        return f"<i>{inner}</i>"
+    return f"<b>{inner}</b>"  # bold, heading
+
+
+def _markdown_v2_entity(match: "re.Match") -> str:
+    kind = match.lastgroup
+    if kind == "url":
+        url = match.group("url").translate(_MDV2_URL_ESCAPE)
+        return f"[{_escape_markdown_v2(match.group('link_text'))}]({url})"
+    if kind in ("pre", "code"):
+        inner = match.group(kind).translate(_MDV2_CODE_ESCAPE)
+        return f"```\n{inner}```" if kind == "pre" else f"`{inner}`"
+    inner = _escape_markdown_v2(match.group(kind))
+    if kind == "italic":
+        return f"_{inner}_"
+    return f"*{inner}*"  # bold, heading
+
+
+def _render(text: str, escape: Callable[[str], str], entity: Callable[["re.Match"], str]) -> str:
+    parts: List[str] = []
+    position = 0
+    for match in _MARKUP_RE.finditer(text):
+        parts.append(escape(text[position:match.start()]))
+        parts.append(entity(match))
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return "".join(parts)
+
+
+def format_for_telegram(text: str, parse_mode: Optional[str] = None) -> str:
+    """
+    Готовит текст к отправке с parse_mode Telegram.
+
+    Args:
+        text: Очищенный ответ (Markdown модели)
+        parse_mode: "HTML", "MarkdownV2" или None (простой текст без изменений)
+
+    Returns:
+        str: Текст с разметкой Telegram; непарные маркеры Markdown экранируются как обычный текст
+    """
+    if not parse_mode:
+        return text
+    if parse_mode == "HTML":
+        return _render(text, _escape_html, _html_entity)
+    if parse_mode == "MarkdownV2":
+        return _render(text, _escape_markdown_v2, _markdown_v2_entity)
+    raise ValueError(f"Unsupported parse mode '{parse_mode}': use one of {', '.join(PARSE_MODES)}")
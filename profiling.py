@@ -0,0 +1,455 @@
+"""
+Профилирование работающего бота без перезапуска.
+
+Доступно администратору процесса (ADMIN_TELEGRAM_ID) командой /profile и
+через эндпоинты /admin/profile сервера health/admin:
+    - cpu N — сэмплирующий профилировщик: N секунд с периодом
+      PROFILE_SAMPLE_INTERVAL_MS снимает стеки всех потоков (event loop,
+      пулы executors, to_thread) через sys._current_frames. Результат —
+      свернутые стеки (формат flamegraph.pl/speedscope) и сводка по функциям;
+    - heap start|snapshot|stop — снимки tracemalloc и разница с предыдущим
+      снимком (рост памяти по строкам кода);
+    - stacks — текущие стеки всех потоков и задач asyncio.
+
+Результаты пишутся в PROFILE_DIR (logs/profiles). Сервер health/admin
+работает в отдельном процессе, поэтому его запросы передаются через файлы в
+STATE_DIR/profile: сервер кладет запрос в requests/, поток
+ProfileRequestWatcher процесса бота выполняет его и пишет ответ в results/.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import traceback
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_REQUESTS_DIR = "requests"
+PROFILE_RESULTS_DIR = "results"
+PROFILE_COMMANDS = ("cpu", "heap", "stacks")
+MAX_RESULT_SUMMARY = 100_000
+
+# Кадры ожидания: поток с таким кадром на вершине стека простаивает
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py", os.path.join("concurrent", "futures", "thread.py"))
+
+_captures = metrics.counter("profile_captures_total", "Profiles captured on demand")
+
+
+class ProfilerBusyError(RuntimeError):
+    """Профилирование CPU уже выполняется."""
+    pass
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    return frame.f_code.co_filename.endswith(_IDLE_FILES)
+
+
+def _thread_names() -> Dict[int, str]:
+    return {thread.ident: thread.name for thread in threading.enumerate()}
+
+
+def _timestamp() -> str:
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+def _write_text(path: str, text: str) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class CpuSampler:
+    """
+    Сэмплирующий профилировщик по стекам всех потоков процесса.
+
+    Профиль «по стенным часам»: потоки, ожидающие в очереди или select,
+    по умолчанию не учитываются (include_idle=False), поэтому в сводке
+    остаются потоки, которые выполняют код или ждут в нативном вызове
+    (генерация LLM, эмбеддер, блокирующий ввод-вывод в event loop).
+
+    Args:
+        interval: Период сэмплирования, сек
+        include_idle: Учитывать простаивающие потоки
+    """
+
+    def __init__(self, interval: float = 0.01, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def sample(self) -> None:
+        """Один снимок стеков всех потоков, кроме собственного."""
+        names = _thread_names()
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own or (not self.include_idle and _is_idle(frame)):
+                continue
+            labels: List[str] = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(labels))] += 1
+        self.samples += 1
+
+    def _run(self, seconds: float) -> None:
+        deadline = time.perf_counter() + seconds
+        while not self._stop.is_set() and time.perf_counter() < deadline:
+            self.sample()
+            self._stop.wait(self.interval)
+        self.duration = time.perf_counter() - self.started_at
+
+    def start(self, seconds: float) -> None:
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, args=(seconds,), name="cpu-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def collapsed(self) -> str:
+        """Свернутые стеки: `поток;функция;...;функция число_сэмплов`."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 30) -> str:
+        """Сводка: сэмплы по потокам, собственное и включительное время функций."""
+        by_thread: Counter = Counter()
+        own: Counter = Counter()
+        inclusive: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            by_thread[frames[0]] += count
+            if len(frames) > 1:
+                own[frames[-1]] += count
+            for label in set(frames[1:]):
+                inclusive[label] += count
+        total = max(self.samples, 1)
+        lines = [
+            f"CPU profile: {self.samples} samples in {self.duration:.1f}s "
+            f"(interval {self.interval * 1000:.0f}ms, idle threads {'included' if self.include_idle else 'excluded'})",
+            "",
+            "Samples by thread (% of samples where the thread was active):",
+        ]
+        lines += [f"  {count * 100 / total:6.1f}%  {name}" for name, count in by_thread.most_common()]
+        lines += ["", f"Top {top} functions by own samples:"]
+        lines += [f"  {count * 100 / total:6.1f}%  {label}" for label, count in own.most_common(top)]
+        lines += ["", f"Top {top} functions by inclusive samples:"]
+        lines += [f"  {count * 100 / total:6.1f}%  {label}" for label, count in inclusive.most_common(top)]
+        return "\n".join(lines) + "\n"
+
+
+def format_thread_stacks(loop: Optional[asyncio.AbstractEventLoop] = None) -> str:
+    """
+    Стеки всех потоков и задач asyncio.
+
+    Задачи читаются без синхронизации с event loop: дамп нужен именно тогда,
+    когда цикл может быть заблокирован, и ждать его нельзя.
+    """
+    names = _thread_names()
+    lines = [f"Thread stacks at {time.strftime('%Y-%m-%d %H:%M:%S')} (pid {os.getpid()})", ""]
+    for ident, frame in sorted(sys._current_frames().items(), key=lambda item: names.get(item[0], "")):
+        lines.append(f"--- Thread {names.get(ident, '?')} (id {ident}){' [idle]' if _is_idle(frame) else ''}")
+        lines.append("".join(traceback.format_stack(frame)).rstrip())
+        lines.append("")
+    if loop is not None:
+        try:
+            tasks = list(asyncio.all_tasks(loop))
+        except RuntimeError as e:
+            tasks = []
+            lines.append(f"Cannot list asyncio tasks: {e}")
+        lines.append(f"=== asyncio tasks: {len(tasks)}")
+        for task in tasks:
+            lines.append(f"--- {task!r}")
+            for frame in task.get_stack():
+                lines.append("".join(traceback.format_stack(frame, limit=1)).rstrip())
+            lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """
+    Захват профилей по запросу администратора.
+
+    Args:
+        output_dir: Директория файлов с результатами
+        sample_interval: Период сэмплирования CPU, сек
+        max_seconds: Максимальная длительность профиля CPU, сек
+        heap_frames: Глубина стека, сохраняемая tracemalloc
+    """
+
+    def __init__(self, output_dir: str, sample_interval: float = 0.01, max_seconds: float = 300.0,
+                 heap_frames: int = 1):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.max_seconds = max_seconds
+        self.heap_frames = heap_frames
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._cpu: Optional[CpuSampler] = None
+        self._heap_previous: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Profiler":
+        return cls(
+            output_dir=os.getenv("PROFILE_DIR", os.path.join("logs", "profiles")),
+            sample_interval=float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10")) / 1000.0,
+            max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", "300")),
+            heap_frames=int(os.getenv("PROFILE_HEAP_FRAMES", "1")),
+        )
+
+    def _path(self, name: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.abspath(os.path.join(self.output_dir, name))
+
+    # --- CPU ---
+
+    def start_cpu(self, seconds: float, include_idle: bool = False) -> CpuSampler:
+        """
+        Запускает профиль CPU в фоновом потоке.
+
+        Raises:
+            ProfilerBusyError: Профиль CPU уже снимается
+        """
+        with self._lock:
+            if self._cpu is not None and self._cpu.running:
+                raise ProfilerBusyError("CPU profile is already running")
+            self._cpu = CpuSampler(self.sample_interval, include_idle)
+            self._cpu.start(max(0.1, min(seconds, self.max_seconds)))
+            return self._cpu
+
+    def stop_cpu(self) -> bool:
+        """Досрочно завершает профиль CPU (False — профиль не выполнялся)."""
+        sampler = self._cpu
+        if sampler is None or not sampler.running:
+            return False
+        sampler.stop()
+        return True
+
+    def finish_cpu(self, sampler: CpuSampler) -> Dict[str, Any]:
+        """Дожидается профиля и сохраняет свернутые стеки и сводку."""
+        sampler.join()
+        name = f"cpu_{_timestamp()}"
+        _write_text(self._path(f"{name}.collapsed"), sampler.collapsed())
+        summary = sampler.summary()
+        path = self._path(f"{name}.txt")
+        _write_text(path, summary)
+        _captures.inc(kind="cpu")
+        logger.info(f"CPU profile saved to {path}")
+        return {"kind": "cpu", "path": path, "collapsed": self._path(f"{name}.collapsed"),
+                "samples": sampler.samples, "summary": summary}
+
+    def profile_cpu(self, seconds: float, include_idle: bool = False) -> Dict[str, Any]:
+        """Блокирующий вариант: профиль CPU на seconds секунд."""
+        return self.finish_cpu(self.start_cpu(seconds, include_idle))
+
+    # --- Heap ---
+
+    def heap(self, action: str = "snapshot", top: int = 30) -> Dict[str, Any]:
+        """
+        Управление tracemalloc.
+
+        Args:
+            action: start — начать трассировку, snapshot — снимок и разница
+                с предыдущим (трассировка включается при необходимости),
+                stop — выключить трассировку
+            top: Число строк в отчете
+        """
+        with self._lock:
+            if action == "stop":
+                tracemalloc.stop()
+                self._heap_previous = None
+                return {"kind": "heap", "status": "stopped"}
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.heap_frames)
+                self._heap_previous = None
+                if action == "start":
+                    return {"kind": "heap", "status": "started"}
+            if action == "start":
+                return {"kind": "heap", "status": "already tracing"}
+            if action != "snapshot":
+                raise ValueError(f"Unknown heap action '{action}': use start, snapshot or stop")
+
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [f"Heap snapshot: traced {current / 2**20:.1f} MiB (peak {peak / 2**20:.1f} MiB)", "",
+                     f"Top {top} allocations by line:"]
+            lines += [f"  {stat}" for stat in snapshot.statistics("lineno")[:top]]
+            if self._heap_previous is not None:
+                lines += ["", f"Top {top} changes since previous snapshot:"]
+                lines += [f"  {stat}" for stat in snapshot.compare_to(self._heap_previous, "lineno")[:top]]
+            else:
+                lines += ["", "No previous snapshot: take another one to see the growth"]
+            self._heap_previous = snapshot
+
+        report = "\n".join(lines) + "\n"
+        path = self._path(f"heap_{_timestamp()}.txt")
+        _write_text(path, report)
+        _captures.inc(kind="heap")
+        logger.info(f"Heap snapshot saved to {path}")
+        return {"kind": "heap", "status": "snapshot", "path": path, "summary": report}
+
+    # --- Stacks ---
+
+    def stacks(self) -> Dict[str, Any]:
+        """Дамп стеков потоков и задач asyncio."""
+        report = format_thread_stacks(self.loop)
+        path = self._path(f"stacks_{_timestamp()}.txt")
+        _write_text(path, report)
+        _captures.inc(kind="stacks")
+        logger.info(f"Thread stacks saved to {path}")
+        return {"kind": "stacks", "path": path, "summary": report}
+
+    def execute(self, command: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Выполняет команду профилирования (блокирующе) и возвращает результат."""
+        params = params or {}
+        if command == "cpu":
+            if params.get("action") == "stop":
+                return {"kind": "cpu", "status": "stopped" if self.stop_cpu() else "not running"}
+            return self.profile_cpu(float(params.get("seconds", 10)), bool(params.get("include_idle", False)))
+        if command == "heap":
+            return self.heap(params.get("action", "snapshot"))
+        if command == "stacks":
+            return self.stacks()
+        raise ValueError(f"Unknown profile command '{command}': use {', '.join(PROFILE_COMMANDS)}")
+
+
+_profiler: Optional[Profiler] = None
+
+
+def get_profiler() -> Profiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler.from_env()
+    return _profiler
+
+
+# --- Обмен запросами с сервером health/admin ---
+
+def submit_request(state_dir: str, command: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Кладет запрос профилирования для процесса бота; возвращает его ID."""
+    if command not in PROFILE_COMMANDS:
+        raise ValueError(f"Unknown profile command '{command}'")
+    request_id = uuid.uuid4().hex
+    directory = os.path.join(state_dir, "profile", PROFILE_REQUESTS_DIR)
+    os.makedirs(directory, exist_ok=True)
+    _write_text(os.path.join(directory, f"{request_id}.json"),
+                json.dumps({"id": request_id, "command": command, "params": params or {}, "ts": time.time()}))
+    return request_id
+
+
+def read_result(state_dir: str, request_id: str) -> Optional[Dict[str, Any]]:
+    """Результат запроса (None — еще выполняется или не существует)."""
+    if not request_id.isalnum():
+        return None
+    try:
+        with open(os.path.join(state_dir, "profile", PROFILE_RESULTS_DIR, f"{request_id}.json"),
+                  encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_pending(state_dir: str, request_id: str) -> bool:
+    return request_id.isalnum() and os.path.exists(
+        os.path.join(state_dir, "profile", PROFILE_REQUESTS_DIR, f"{request_id}.json")
+    )
+
+
+class ProfileRequestWatcher:
+    """
+    Поток процесса бота: выполняет запросы профилирования от сервера.
+
+    Каждый запрос выполняется в своем потоке, чтобы дамп стеков не ждал
+    окончания долгого профиля CPU.
+
+    Args:
+        state_dir: Директория обмена состоянием с сервером
+        profiler: Профилировщик процесса
+        interval: Период опроса директории запросов, сек
+    """
+
+    def __init__(self, state_dir: str, profiler: Profiler, interval: float = 1.0):
+        self.requests_dir = os.path.join(state_dir, "profile", PROFILE_REQUESTS_DIR)
+        self.results_dir = os.path.join(state_dir, "profile", PROFILE_RESULTS_DIR)
+        self.profiler = profiler
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._active: set = set()
+
+    def _handle(self, path: str) -> None:
+        request_id = os.path.splitext(os.path.basename(path))[0]
+        try:
+            with open(path, encoding="utf-8") as f:
+                request = json.load(f)
+            result = self.profiler.execute(request["command"], request.get("params"))
+            result["status"] = result.get("status", "done")
+        except Exception as e:
+            logger.warning(f"Profile request {request_id} failed: {e}")
+            result = {"status": "error", "error": str(e)}
+        result["id"] = request_id
+        if len(result.get("summary", "")) > MAX_RESULT_SUMMARY:
+            result["summary"] = result["summary"][:MAX_RESULT_SUMMARY] + "\n... (see file)\n"
+        os.makedirs(self.results_dir, exist_ok=True)
+        _write_text(os.path.join(self.results_dir, f"{request_id}.json"), json.dumps(result, ensure_ascii=False))
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self._active.discard(path)
+
+    def poll(self) -> None:
+        try:
+            names = sorted(os.listdir(self.requests_dir))
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.requests_dir, name)
+            if not name.endswith(".json") or path in self._active:
+                continue
+            self._active.add(path)
+            threading.Thread(target=self._handle, args=(path,), name="profile-request", daemon=True).start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="profile-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
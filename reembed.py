@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Смена модели эмбеддингов и сравнение моделей на базе знаний.
+
+Векторы разных моделей (и разной размерности) несовместимы, поэтому смена
+модели — это перестроение индекса. migrate строит новую коллекцию Chroma
+рядом с активной из уже проиндексированных фрагментов (исходные файлы не
+нужны), затем атомарно переключает указатель active_collection.json и версию
+базы знаний. Бот продолжает отвечать из старой коллекции, пока идет
+перестроение, и подхватывает новую при горячей перезагрузке.
+
+    python reembed.py migrate --model multilingual-e5-small
+    python reembed.py cleanup                  # удалить неактивные коллекции и старые шарды
+    python reembed.py bench --models all-MiniLM-L6-v2,multilingual-e5-small --queries queries.jsonl
+
+Файл запросов для bench — JSONL: {"query": "...", "relevant": ["knowledge_base/delivery.md"]},
+relevant — источники (source) или chunk_id фрагментов, которые должны найтись.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_community.vectorstores import Chroma
+
+from embeddings import (
+    EMBEDDING_MODELS,
+    EmbeddingModelSpec,
+    get_embedder,
+    open_collection,
+    read_active_collection,
+    resolve_embedding_model,
+    write_active_collection,
+)
+from kb_reload import compute_kb_version, write_kb_version
+from shards import read_shards
+
+logger = logging.getLogger(__name__)
+
+
+def get_persist_dir() -> str:
+    return os.getenv("PERSIST_DIRECTORY") or os.getenv("CHROMA_DB_PATH") or "./chroma_db"
+
+
+def collection_name_for(spec: EmbeddingModelSpec) -> str:
+    """Имя новой коллекции: модель и время (ограничения Chroma: 3-63 символа, [a-zA-Z0-9_-])."""
+    slug = re.sub(r"[^a-zA-Z0-9_-]+", "_", spec.name).lower()[:40]
+    return f"kb_{slug}_{int(time.time())}"
+
+
+def iter_chunks(collection: Any, batch_size: int) -> Iterator[Tuple[List[str], List[str], List[dict]]]:
+    """Фрагменты коллекции пачками: (ids, тексты, метаданные)."""
+    offset = 0
+    while True:
+        page = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+        if not page["ids"]:
+            return
+        yield page["ids"], page["documents"], [m or {} for m in page["metadatas"]]
+        offset += len(page["ids"])
+
+
+def migrate(model: str, persist_dir: Optional[str] = None, batch_size: int = 64, force: bool = False) -> Optional[str]:
+    """
+    Перестраивает индекс моделью model в новой коллекции и делает ее активной.
+
+    Args:
+        model: Имя модели из каталога embeddings.EMBEDDING_MODELS
+        persist_dir: Директория индекса Chroma
+        batch_size: Фрагментов на один вызов эмбеддера
+        force: Перестроить, даже если индекс уже на этой модели
+
+    Returns:
+        Optional[str]: Имя новой активной коллекции (None, если перестраивать нечего)
+    """
+    persist_dir = persist_dir or get_persist_dir()
+    spec = resolve_embedding_model(model)
+    active = read_active_collection(persist_dir)
+    if active["model"] == spec.name and not force:
+        logger.info(f"Collection {active['collection']} is already embedded with {spec.name}")
+        return None
+
+    # Старую коллекцию только читаем — эмбеддер для нее не нужен
+    source = Chroma(collection_name=active["collection"], persist_directory=persist_dir)._collection
+    total = source.count()
+    name = collection_name_for(spec)
+    logger.info(f"Re-embedding {total} chunks from {active['collection']} ({active['model']}) "
+                f"into {name} ({spec.name}, dim {spec.dim})")
+    target = open_collection(persist_dir, name, spec)
+
+    texts: List[str] = []
+    metadatas: List[dict] = []
+    started = time.perf_counter()
+    for ids, batch_texts, batch_metadatas in iter_chunks(source, batch_size):
+        target.add_texts(texts=batch_texts, metadatas=batch_metadatas, ids=ids)
+        texts.extend(batch_texts)
+        metadatas.extend(batch_metadatas)
+        logger.info(f"Re-embedded {len(texts)}/{total} chunks ({time.perf_counter() - started:.1f}s)")
+
+    if target._collection.count() != total:
+        raise RuntimeError(
+            f"Collection {name} has {target._collection.count()} chunks, expected {total}; active index unchanged"
+        )
+    target.persist()
+
+    # Сначала указатель, затем версия: бот перезагружается по изменению файлов,
+    # а новая версия сбрасывает кэш поиска, построенный старой моделью
+    write_active_collection(persist_dir, name, spec)
+    if os.getenv("VECTOR_STORE", "chroma").lower() == "compact":
+        from compact_store import build_from_chroma
+        build_from_chroma(
+            persist_dir,
+            mode=os.getenv("COMPACT_STORE_MODE", "int8"),
+            rescore=os.getenv("COMPACT_STORE_RESCORE", "0") == "1",
+            pq_subspaces=int(os.getenv("COMPACT_STORE_PQ_SUBSPACES", "48")),
+        )
+    version = compute_kb_version(texts, metadatas, model=spec.name)
+    write_kb_version(persist_dir, version, len(texts))
+    logger.info(f"Active collection switched to {name} (knowledge base version {version}); "
+                f"old collection {active['collection']} kept until `reembed.py cleanup`")
+    return name
+
+
+def cleanup(persist_dir: Optional[str] = None) -> List[str]:
+    """Удаляет все коллекции, кроме активной и шардов текущего поколения (после перезагрузки бота)."""
+    persist_dir = persist_dir or get_persist_dir()
+    active = read_active_collection(persist_dir)["collection"]
+    keep = {active}
+    manifest = read_shards(persist_dir)
+    if manifest:
+        keep.update(info["collection"] for info in manifest["shards"].values())
+    client = Chroma(collection_name=active, persist_directory=persist_dir)._client
+    removed = []
+    for collection in client.list_collections():
+        if collection.name not in keep:
+            client.delete_collection(collection.name)
+            removed.append(collection.name)
+            logger.info(f"Deleted collection {collection.name}")
+    return removed
+
+
+def read_queries(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def recall_at_k(retrieved: Sequence[Sequence[str]], relevant: Sequence[str], k: int) -> float:
+    """
+    Доля релевантных фрагментов/источников, найденных в первых k результатах.
+
+    Args:
+        retrieved: Ключи найденных фрагментов по рангу (например, [chunk_id, source])
+        relevant: Ожидаемые chunk_id или источники
+        k: Глубина выдачи
+    """
+    if not relevant:
+        return 0.0
+    found = {key for keys in retrieved[:k] for key in keys}
+    return sum(1 for item in relevant if item in found) / len(relevant)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def bench(models: List[str], queries_path: str, k: int = 3, persist_dir: Optional[str] = None) -> Dict[str, Dict]:
+    """
+    Сравнивает модели по recall@k и задержке на фрагментах активной коллекции.
+
+    Корпус эмбеддится каждой моделью в памяти; активный индекс не меняется.
+    """
+    import numpy as np
+
+    persist_dir = persist_dir or get_persist_dir()
+    source = Chroma(collection_name=read_active_collection(persist_dir)["collection"],
+                    persist_directory=persist_dir)._collection
+    keys: List[Tuple[str, ...]] = []
+    texts: List[str] = []
+    for ids, batch_texts, batch_metadatas in iter_chunks(source, 256):
+        for chunk, text, metadata in zip(ids, batch_texts, batch_metadatas):
+            keys.append((chunk, metadata.get("chunk_id", chunk), metadata.get("source", "")))
+            texts.append(text)
+    queries = read_queries(queries_path)
+    logger.info(f"Benchmarking {len(models)} models on {len(texts)} chunks and {len(queries)} queries")
+
+    results: Dict[str, Dict] = {}
+    for model in models:
+        spec = resolve_embedding_model(model)
+        embedder = get_embedder(spec.name)
+        started = time.perf_counter()
+        corpus = np.asarray(embedder.embed_documents(texts), dtype=np.float32)
+        corpus /= np.linalg.norm(corpus, axis=1, keepdims=True) + 1e-12
+        index_s = time.perf_counter() - started
+
+        recalls: List[float] = []
+        latencies: List[float] = []
+        for query in queries:
+            started = time.perf_counter()
+            vector = np.asarray(embedder.embed_query(query["query"]), dtype=np.float32)
+            top = np.argsort(-(corpus @ vector))[:k]
+            latencies.append(time.perf_counter() - started)
+            recalls.append(recall_at_k([keys[i] for i in top], query.get("relevant", []), k))
+
+        results[spec.name] = {
+            "dim": spec.dim,
+            f"recall@{k}": round(sum(recalls) / max(len(recalls), 1), 4),
+            "query_p50_ms": round(_percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+            "query_p95_ms": round(_percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+            "index_s": round(index_s, 2),
+        }
+        logger.info(f"{spec.name}: {results[spec.name]}")
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Смена и сравнение моделей эмбеддингов")
+    sub = parser.add_subparsers(dest="command", required=True)
+    mig = sub.add_parser("migrate", help="Перестроить индекс другой моделью и переключиться на него")
+    mig.add_argument("--model", default=os.getenv("EMBEDDING_MODEL"), required=not os.getenv("EMBEDDING_MODEL"),
+                     help=f"Одна из: {', '.join(EMBEDDING_MODELS)}")
+    mig.add_argument("--batch-size", type=int, default=64)
+    mig.add_argument("--force", action="store_true", help="Перестроить, даже если модель не изменилась")
+    sub.add_parser("cleanup", help="Удалить неактивные коллекции")
+    ben = sub.add_parser("bench", help="Сравнить модели по recall@k и задержке")
+    ben.add_argument("--models", default=",".join(EMBEDDING_MODELS))
+    ben.add_argument("--queries", required=True, help="JSONL с полями query и relevant")
+    ben.add_argument("--k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "migrate":
+        migrate(args.model, batch_size=args.batch_size, force=args.force)
+    elif args.command == "cleanup":
+        cleanup()
+    elif args.command == "bench":
+        models = [m.strip() for m in args.models.split(",") if m.strip()]
+        print(json.dumps(bench(models, args.queries, args.k), ensure_ascii=False, indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
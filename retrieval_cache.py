@@ -0,0 +1,117 @@
+"""
+LRU-кэш результатов поиска по базе знаний.
+
+Ключ — нормализованный поисковый запрос; запись хранит ID и тексты
+найденных фрагментов. Кэш привязан к версии базы знаний (kb_version.json,
+который пишет ingest.py): при смене версии все записи сбрасываются.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+import metrics
+from coalesce import normalize_question
+
+logger = logging.getLogger(__name__)
+
+_hits = metrics.counter("retrieval_cache_hits_total", "Retrieval results served from the cache")
+_misses = metrics.counter("retrieval_cache_misses_total", "Retrievals that went to the vector store")
+_saved = metrics.counter("retrieval_cache_saved_seconds_total", "Retrieval time saved by cache hits")
+_retrieval_seconds = metrics.histogram("retrieval_seconds", "Duration of embedding + vector store search")
+_entries = metrics.gauge("retrieval_cache_entries", "Entries in the retrieval cache")
+
+# Фрагмент: (chunk_id, текст, метаданные)
+Chunk = Tuple[Optional[str], str, dict]
+
+
+class RetrievalCache:
+    """
+    Потокобезопасный LRU: нормализованный запрос -> найденные фрагменты.
+
+    Args:
+        max_entries: Максимальное число запросов в кэше
+        tenant: Имя тенанта (метка метрик)
+    """
+
+    def __init__(self, max_entries: int = 1024, tenant: str = "default"):
+        self.max_entries = max_entries
+        self.tenant = tenant
+        self._entries: "OrderedDict[str, Tuple[List[Chunk], float]]" = OrderedDict()
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+        _entries.set_function(lambda: len(self._entries), tenant=tenant)
+
+    @classmethod
+    def from_env(cls, tenant: str = "default") -> Optional["RetrievalCache"]:
+        """Кэш размера RETRIEVAL_CACHE_SIZE (None, если размер 0)."""
+        size = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+        return cls(size, tenant=tenant) if size > 0 else None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_version(self, version: str) -> None:
+        if version != self._version:
+            if self._entries:
+                logger.info(f"Knowledge base version changed to {version}, dropping {len(self._entries)} cached retrievals")
+            self._entries.clear()
+            self._version = version
+
+    def get(self, version: str, query: str) -> Optional[List[Chunk]]:
+        key = normalize_question(query)
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        chunks, cost = entry
+        _hits.inc()
+        _saved.inc(cost)
+        return chunks
+
+    def put(self, version: str, query: str, chunks: List[Chunk], cost: float) -> None:
+        """
+        Сохраняет результат поиска.
+
+        Args:
+            version: Версия базы знаний, на которой выполнен поиск
+            query: Поисковый запрос
+            chunks: Найденные фрагменты
+            cost: Время поиска, сек (учитывается как сэкономленное при попадании)
+        """
+        key = normalize_question(query)
+        with self._lock:
+            # Результат, полученный на старой версии, не должен вытеснить новые
+            if self._version is not None and version != self._version:
+                return
+            self._check_version(version)
+            self._entries[key] = (chunks, cost)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def cached_documents(cache: Optional[RetrievalCache], version: Optional[str], query: str) -> Optional[List[Any]]:
+    """Документы из кэша (None — промах или кэш отключен)."""
+    if cache is None or version is None:
+        return None
+    chunks = cache.get(version, query)
+    if chunks is None:
+        return None
+    from langchain.schema import Document
+    return [Document(page_content=text, metadata=dict(metadata)) for _, text, metadata in chunks]
+
+
+def store_documents(cache: Optional[RetrievalCache], version: Optional[str], query: str,
+                    docs: List[Any], elapsed: float) -> None:
+    """Учитывает время поиска и сохраняет найденные документы в кэш."""
+    _retrieval_seconds.observe(elapsed)
+    if cache is not None and version is not None:
+        _misses.inc()
+        chunks = [(doc.metadata.get("chunk_id"), doc.page_content, dict(doc.metadata)) for doc in docs]
+        cache.put(version, query, chunks, elapsed)
+
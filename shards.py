@@ -0,0 +1,273 @@
+"""
+Шардированная база знаний: отдельные коллекции Chroma по разделам.
+
+Раздел — подкаталог базы знаний (knowledge_base/delivery/*.md → шард
+"delivery"); файлы в корне попадают в шард "general". ingest.py при
+KB_SHARDING=1 строит по коллекции на раздел и записывает манифест
+shards.json: коллекции, центроиды эмбеддингов разделов и ключевые слова
+из knowledge_base/shard_rules.json ({"delivery": ["доставк", "курьер"]}).
+
+Запрос маршрутизируется легковесным роутером:
+    - ключевые слова: шарды, слова которых встречаются в запросе;
+    - иначе — ближайшие центроиды к эмбеддингу запроса (лучший и те,
+      что отстают от него не больше чем на KB_SHARD_MARGIN).
+Выбранные шарды ищутся параллельно в пуле shard, кандидаты объединяются
+по расстоянию, и из них, как в поиске по одной коллекции, MMR отбирает
+разнообразные фрагменты. Стоимость поиска зависит от числа выбранных
+шардов, а не от размера всей базы; KB_SHARDS ограничивает бота подмножеством разделов
+(несколько ботов на одном индексе).
+"""
+
+import os
+import re
+import json
+import math
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.schema import BaseRetriever, Document
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+import metrics
+from executors import get_executor
+
+logger = logging.getLogger(__name__)
+
+SHARDS_FILE = "shards.json"
+SHARD_RULES_FILE = "shard_rules.json"
+DEFAULT_SHARD = "general"
+
+_shard_queries = metrics.counter("kb_shard_queries_total", "Knowledge base searches by shard and routing method")
+_shards_searched = metrics.histogram(
+    "kb_shards_searched", "Shards searched per query", buckets=(1, 2, 3, 4, 6, 8, 12, 16)
+)
+
+
+def slugify_shard(name: str) -> str:
+    """Имя шарда, допустимое в имени коллекции Chroma."""
+    slug = re.sub(r"[^a-z0-9_-]+", "_", name.lower()).strip("_-")
+    return slug[:30] or DEFAULT_SHARD
+
+
+def shard_for_path(root: str, path: str) -> str:
+    """Шард файла базы знаний: первый подкаталог относительно root."""
+    parts = os.path.relpath(path, root).split(os.sep)
+    return slugify_shard(parts[0]) if len(parts) > 1 else DEFAULT_SHARD
+
+
+def shard_collection_name(shard: str, generation: int) -> str:
+    return f"kb_{shard}_{generation}"
+
+
+def read_shard_rules(root: str) -> Dict[str, List[str]]:
+    """Ключевые слова разделов из knowledge_base/shard_rules.json (в нижнем регистре)."""
+    try:
+        with open(os.path.join(root, SHARD_RULES_FILE), "r", encoding="utf-8") as f:
+            rules = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {slugify_shard(shard): [word.lower() for word in words] for shard, words in rules.items()}
+
+
+def read_shards(persist_dir: str) -> Optional[Dict[str, Any]]:
+    """Манифест шардов (None — индекс не шардирован)."""
+    try:
+        with open(os.path.join(persist_dir, SHARDS_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_shards(persist_dir: str, manifest: Dict[str, Any]) -> None:
+    """Атомарно переключает набор коллекций шардов."""
+    path = os.path.join(persist_dir, SHARDS_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def centroid(vectors: Iterable[Sequence[float]]) -> List[float]:
+    """Нормализованное среднее векторов раздела."""
+    total: List[float] = []
+    for vector in vectors:
+        if not total:
+            total = [0.0] * len(vector)
+        for i, value in enumerate(vector):
+            total[i] += value
+    norm = math.sqrt(sum(value * value for value in total)) or 1.0
+    return [value / norm for value in total]
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ShardRouter:
+    """
+    Выбор шардов для запроса.
+
+    Args:
+        shards: Имена доступных шардов
+        keywords: Ключевые слова (основы) по шардам
+        centroids: Центроиды эмбеддингов по шардам
+        max_shards: Максимум шардов на запрос
+        margin: Допустимое отставание косинуса от лучшего шарда
+    """
+
+    def __init__(self, shards: Sequence[str], keywords: Optional[Dict[str, List[str]]] = None,
+                 centroids: Optional[Dict[str, List[float]]] = None, max_shards: int = 2, margin: float = 0.05):
+        self.shards = list(shards)
+        self.keywords = {s: words for s, words in (keywords or {}).items() if s in self.shards}
+        self.centroids = {s: vector for s, vector in (centroids or {}).items() if s in self.shards}
+        self.max_shards = max_shards
+        self.margin = margin
+
+    def route(self, query: str, vector: Optional[Sequence[float]] = None) -> List[str]:
+        """
+        Returns:
+            List[str]: Шарды для поиска, самые подходящие первыми
+        """
+        text = query.lower()
+        hits = {shard: sum(1 for word in words if word in text) for shard, words in self.keywords.items()}
+        matched = sorted((s for s, count in hits.items() if count), key=lambda s: -hits[s])
+        if matched:
+            selected, method = matched[:self.max_shards], "keywords"
+        elif vector is not None and self.centroids:
+            scores = {shard: _cosine(vector, c) for shard, c in self.centroids.items()}
+            best = max(scores.values())
+            ranked = sorted(scores, key=lambda s: -scores[s])
+            selected = [s for s in ranked if scores[s] >= best - self.margin][:self.max_shards]
+            method = "embedding"
+        else:
+            selected, method = list(self.shards), "all"
+        for shard in selected:
+            _shard_queries.inc(shard=shard, method=method)
+        _shards_searched.observe(len(selected))
+        return selected
+
+
+class ShardedRetriever(BaseRetriever):
+    """
+    Ретривер по нескольким коллекциям: маршрутизация, параллельный поиск, слияние.
+
+    Как и ретривер одной коллекции (search_type="mmr"), из fetch_k ближайших
+    кандидатов всех выбранных шардов отбирается k разнообразных фрагментов (MMR).
+    """
+
+    stores: Dict[str, Any]
+    router: ShardRouter
+    embeddings: Any
+    k: int = 3
+    fetch_k: int = 10
+    lambda_mult: float = 0.5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _search(self, shard: str, vector: List[float]) -> List[Tuple[Document, float, List[float]]]:
+        """Кандидаты шарда с расстояниями и векторами (векторы нужны для MMR)."""
+        result = self.stores[shard]._collection.query(
+            query_embeddings=[vector], n_results=self.fetch_k,
+            include=["documents", "metadatas", "distances", "embeddings"],
+        )
+        return [
+            (Document(page_content=text, metadata=metadata or {}), distance, embedding)
+            for text, metadata, distance, embedding in zip(
+                result["documents"][0], result["metadatas"][0], result["distances"][0], result["embeddings"][0]
+            )
+        ]
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.search_by_vector(query, self.embeddings.embed_query(query))
+
+    def search_by_vector(self, query: str, vector: List[float]) -> List[Document]:
+        """Поиск по готовому эмбеддингу запроса (текст нужен роутеру для ключевых слов)."""
+        shards = self.router.route(query, vector)
+        if len(shards) == 1:
+            results = [self._search(shards[0], vector)]
+        else:
+            pool = get_executor("shard")
+            futures = [pool.submit(self._search, shard, vector) for shard in shards]
+            results = [future.result() for future in futures]
+        # Шарды построены одной моделью: расстояния сравнимы
+        merged = sorted((item for result in results for item in result), key=lambda item: item[1])[:self.fetch_k]
+        if not merged:
+            return []
+        selected = maximal_marginal_relevance(
+            np.array(vector, dtype=np.float32), [embedding for _, _, embedding in merged],
+            k=self.k, lambda_mult=self.lambda_mult,
+        )
+        return [merged[i][0] for i in selected]
+
+
+def open_sharded_retriever(persist_dir: str, manifest: Dict[str, Any],
+                           allowed: Optional[Iterable[str]] = None) -> ShardedRetriever:
+    """
+    Открывает коллекции шардов из манифеста.
+
+    Args:
+        persist_dir: Директория индекса Chroma
+        manifest: Содержимое shards.json
+        allowed: Шарды, доступные боту (None — все)
+    """
+    from embeddings import get_embedder, open_collection, resolve_embedding_model
+
+    spec = resolve_embedding_model(manifest["model"])
+    allowed = set(allowed) if allowed else None
+    shards = {
+        name: info for name, info in manifest["shards"].items() if allowed is None or name in allowed
+    }
+    if not shards:
+        raise ValueError(f"No shards available (allowed: {sorted(allowed or [])})")
+    stores = {name: open_collection(persist_dir, info["collection"], spec) for name, info in shards.items()}
+    router = ShardRouter(
+        list(shards),
+        keywords=manifest.get("keywords"),
+        centroids={name: info["centroid"] for name, info in shards.items() if info.get("centroid")},
+        max_shards=int(os.getenv("KB_SHARD_MAX", "2")),
+        margin=float(os.getenv("KB_SHARD_MARGIN", "0.05")),
+    )
+    summary = ", ".join(f"{name} ({info['documents']})" for name, info in shards.items())
+    logger.info(f"Sharded knowledge base opened: {summary}")
+    return ShardedRetriever(stores=stores, router=router, embeddings=get_embedder(spec.name))
+
+
+def build_shards(persist_dir: str, root: str, texts: List[str], metadatas: List[dict], spec: Any) -> Dict[str, Any]:
+    """
+    Строит коллекции шардов нового поколения и переключает на них манифест.
+
+    Старые коллекции не удаляются сразу (их может использовать работающий
+    бот) — см. reembed.py cleanup.
+    """
+    from embeddings import open_collection
+
+    generation = int(time.time())
+    groups: Dict[str, List[int]] = {}
+    for index, metadata in enumerate(metadatas):
+        groups.setdefault(metadata["shard"], []).append(index)
+
+    shards: Dict[str, Dict[str, Any]] = {}
+    for shard, indices in sorted(groups.items()):
+        name = shard_collection_name(shard, generation)
+        store = open_collection(persist_dir, name, spec)
+        store.add_texts(
+            texts=[texts[i] for i in indices],
+            metadatas=[metadatas[i] for i in indices],
+            ids=[metadatas[i]["chunk_id"] for i in indices],
+        )
+        store.persist()
+        vectors = store._collection.get(include=["embeddings"])["embeddings"]
+        shards[shard] = {"collection": name, "documents": len(indices), "centroid": centroid(vectors)}
+        logger.info(f"Shard {shard}: {len(indices)} documents in {name}")
+
+    manifest = {"model": spec.name, "generation": generation, "keywords": read_shard_rules(root), "shards": shards}
+    write_shards(persist_dir, manifest)
+    return manifest
@@ -0,0 +1,182 @@
+"""
+Несколько Telegram-ботов (тенантов) в одном процессе.
+
+Каждый тенант — отдельное приложение Telegram со своим токеном, системным
+промптом, индексом или набором разделов базы знаний, администраторами и
+лимитами доставки. LLM, эмбеддер, пулы потоков и запись логов общие:
+модель загружается один раз, а очередь заданий LLM делится между тенантами
+по весам (справедливое планирование, см. llm_jobs.LLMScheduler).
+
+Конфигурация — JSON-файл в TENANTS_CONFIG:
+
+    {"tenants": [
+        {"name": "brand_a", "token_env": "BRAND_A_TOKEN",
+         "system_prompt_path": "knowledge_base/brand_a/system_prompt.txt",
+         "kb_shards": ["brand_a", "delivery"], "admin_ids": [111],
+         "weight": 2, "delivery_chat_rate": 1, "delivery_global_rate": 20},
+        {"name": "brand_b", "token_env": "BRAND_B_TOKEN", "persist_dir": "./chroma_brand_b"}
+    ]}
+
+Токен задается через переменную окружения (token_env), чтобы не хранить
+секреты в файле. Без TENANTS_CONFIG бот работает как один тенант "default"
+с настройками из окружения.
+"""
+
+import os
+import re
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+_NAME_RE = re.compile(r"^[a-zA-Z0-9_-]{1,32}$")
+
+
+def _id_set(values: Any) -> set:
+    """ID пользователей из списка или строки через запятую."""
+    if isinstance(values, str):
+        values = values.split(",")
+    return {int(value) for value in values or [] if str(value).strip().isdigit()}
+
+
+class TenantConfig:
+    """
+    Настройки одного тенанта.
+
+    Args:
+        name: Имя тенанта (метки метрик, логи)
+        token: Токен Telegram-бота
+        system_prompt_path: Файл системного промпта
+        persist_dir: Директория индекса Chroma
+        kb_shards: Разделы базы знаний, доступные тенанту (None — все / нешардированный индекс)
+        admin_ids: Администраторы тенанта
+        priority_user_ids: Платные пользователи тенанта
+        faq_table_path: Таблица предгенерированных ответов (None — без нее)
+        weight: Доля тенанта в очереди LLM относительно остальных
+        delivery_global_rate: Лимит сообщений в секунду для бота (None — DELIVERY_GLOBAL_RATE)
+        delivery_chat_rate: Лимит сообщений в секунду в чат (None — DELIVERY_CHAT_RATE)
+    """
+
+    def __init__(self, name: str, token: str, system_prompt_path: str, persist_dir: str,
+                 kb_shards: Optional[List[str]] = None, admin_ids: Optional[set] = None,
+                 priority_user_ids: Optional[set] = None, faq_table_path: Optional[str] = None,
+                 weight: float = 1.0, delivery_global_rate: Optional[float] = None,
+                 delivery_chat_rate: Optional[float] = None):
+        if not _NAME_RE.match(name):
+            raise ValueError(f"Invalid tenant name '{name}': use 1-32 letters, digits, '_' or '-'")
+        if weight <= 0:
+            raise ValueError(f"Tenant '{name}': weight must be positive")
+        self.name = name
+        self.token = token
+        self.system_prompt_path = system_prompt_path
+        self.persist_dir = persist_dir
+        self.kb_shards = list(kb_shards) if kb_shards else None
+        self.admin_ids = set(admin_ids or ())
+        self.priority_user_ids = set(priority_user_ids or ())
+        self.faq_table_path = faq_table_path
+        self.weight = weight
+        self.delivery_global_rate = delivery_global_rate
+        self.delivery_chat_rate = delivery_chat_rate
+
+    @classmethod
+    def from_env(cls, system_prompt_path: str, persist_dir: str) -> "TenantConfig":
+        """Единственный тенант из переменных окружения (режим по умолчанию)."""
+        shards = [s.strip() for s in os.getenv("KB_SHARDS", "").split(",") if s.strip()]
+        faq_enabled = os.getenv("FAQ_ENABLED", "1") == "1"
+        return cls(
+            name=DEFAULT_TENANT,
+            token=os.getenv("TELEGRAM_TOKEN", ""),
+            system_prompt_path=system_prompt_path,
+            persist_dir=persist_dir,
+            kb_shards=shards or None,
+            admin_ids=_id_set(os.getenv("ADMIN_TELEGRAM_ID", "")),
+            priority_user_ids=_id_set(os.getenv("PRIORITY_USER_IDS", "")),
+            faq_table_path=os.getenv("FAQ_TABLE_PATH", "faq_answers.json") if faq_enabled else None,
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], defaults: "TenantConfig") -> "TenantConfig":
+        """Тенант из записи файла конфигурации; пропущенные поля берутся из defaults."""
+        name = data.get("name", "")
+        token = data.get("token") or os.getenv(data.get("token_env", ""), "")
+        if not token:
+            raise ValueError(f"Tenant '{name}': token is empty (set token_env to a defined variable)")
+        return cls(
+            name=name,
+            token=token,
+            system_prompt_path=data.get("system_prompt_path", defaults.system_prompt_path),
+            persist_dir=data.get("persist_dir", defaults.persist_dir),
+            kb_shards=data.get("kb_shards"),
+            admin_ids=_id_set(data.get("admin_ids")),
+            priority_user_ids=_id_set(data.get("priority_user_ids")),
+            faq_table_path=data.get("faq_table_path"),
+            weight=float(data.get("weight", 1.0)),
+            delivery_global_rate=data.get("delivery_global_rate"),
+            delivery_chat_rate=data.get("delivery_chat_rate"),
+        )
+
+
+def load_tenants(path: str, defaults: TenantConfig) -> List[TenantConfig]:
+    """
+    Читает конфигурацию тенантов.
+
+    Raises:
+        ValueError: Ошибка в конфигурации (пустой список, повтор имени или токена)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    configs = [TenantConfig.from_dict(item, defaults) for item in data.get("tenants", [])]
+    if not configs:
+        raise ValueError(f"No tenants defined in {path}")
+    names = [config.name for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate tenant names in {path}")
+    if len({config.token for config in configs}) != len(configs):
+        raise ValueError(f"Several tenants in {path} share one Telegram token")
+    return configs
+
+
+class Tenant:
+    """
+    Состояние одного тенанта в процессе бота.
+
+    Ресурсы, зависящие от базы знаний и пользователей тенанта, — свои;
+    LLM, эмбеддер и планировщик заданий общие для процесса.
+    """
+
+    def __init__(self, config: TenantConfig, kb_manager: Any, retrieval_cache: Any = None,
+                 faq_table: Any = None, conversations: Any = None):
+        self.config = config
+        self.name = config.name
+        self.kb_manager = kb_manager
+        self.retrieval_cache = retrieval_cache
+        self.faq_table = faq_table
+        self.conversations = conversations
+        self.delivery = None
+        self.update_consumer = None
+        # Обновления из персистентной очереди в обработке: update_id -> исходы
+        # (future отправки ответа и ошибки обработчиков), которых ждет запись очереди
+        self.replaying: Dict[int, List[Any]] = {}
+        self.is_initialized = False
+        self.initialization_error: Optional[str] = None
+        self.warmup_timings: Dict[str, float] = {}
+
+    async def stop_processing(self, consumer_timeout: float = 10.0, delivery_timeout: float = 10.0) -> None:
+        """
+        Дожидается обработки очереди обновлений, затем отправки очереди ответов.
+
+        Вызывается из post_stop, пока клиент бота еще открыт: после
+        Application.shutdown() отправить ответы уже нельзя.
+        """
+        if self.update_consumer is not None:
+            await self.update_consumer.close(consumer_timeout)
+            self.update_consumer = None
+        if self.delivery is not None:
+            await self.delivery.close(delivery_timeout)
+            self.delivery = None
+
+    def is_admin(self, user_id: int, global_admins: set = frozenset()) -> bool:
+        """Администратор тенанта или всего процесса (ADMIN_TELEGRAM_ID)."""
+        return user_id in self.config.admin_ids or user_id in global_admins
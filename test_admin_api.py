@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Тесты health/admin API: пагинация логов сессий, токен, устаревший пульс
+"""
+
+import os
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from flask_app import create_app, db  # noqa: E402
+from flask_app.models import SessionLog  # noqa: E402
+from flask_app.server import HEARTBEAT_FILE, StateExporter  # noqa: E402
+
+TOKEN = "secret"
+AUTH = {"Authorization": f"Bearer {TOKEN}"}
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URI", f"sqlite:///{tmp_path / 'admin.db'}")
+    monkeypatch.setenv("ADMIN_API_TOKEN", TOKEN)
+    apps = []
+
+    def make(state_dir=None):
+        app = create_app(state_dir)
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        with app.app_context():
+            db.engine.dispose()
+
+
+def add_sessions(app, count):
+    base = datetime.utcnow() - timedelta(hours=count)
+    with app.app_context():
+        for i in range(count):
+            db.session.add(SessionLog(user_id=i % 2, username="u", query=f"q{i}", response="r",
+                                      timestamp=base + timedelta(hours=i)))
+        db.session.commit()
+
+
+def test_sessions_keyset_pagination(make_app):
+    app = make_app()
+    client = app.test_client()
+    assert client.get("/admin/sessions", headers=AUTH).json == {"items": [], "next_cursor": None}
+
+    add_sessions(app, 4)
+    first = client.get("/admin/sessions?limit=2", headers=AUTH).json
+    assert [item["query"] for item in first["items"]] == ["q3", "q2"]
+    second = client.get(f"/admin/sessions?limit=2&cursor={first['next_cursor']}", headers=AUTH).json
+    assert [item["query"] for item in second["items"]] == ["q1", "q0"]
+    # Полная последняя страница дает курсор, за ним — пустая страница без курсора
+    last = client.get(f"/admin/sessions?limit=2&cursor={second['next_cursor']}", headers=AUTH).json
+    assert last == {"items": [], "next_cursor": None}
+    only_user = client.get("/admin/sessions?user_id=1", headers=AUTH).json
+    assert [item["query"] for item in only_user["items"]] == ["q3", "q1"]
+    assert client.get(f"/admin/sessions/{first['items'][0]['id']}", headers=AUTH).json["query"] == "q3"
+
+
+def test_admin_token_is_required(make_app, monkeypatch):
+    client = make_app().test_client()
+    assert client.get("/admin/sessions").status_code == 401
+    assert client.get("/admin/sessions", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    monkeypatch.delenv("ADMIN_API_TOKEN")
+    assert client.get("/admin/sessions", headers=AUTH).status_code == 404
+
+
+def test_health_reports_stale_heartbeat(make_app, tmp_path, monkeypatch):
+    monkeypatch.setenv("HEALTH_STALE_AFTER", "60")
+    state_dir = str(tmp_path / "state")
+    client = make_app(state_dir).test_client()
+    assert client.get("/health").json["status"] == "starting"
+
+    StateExporter(state_dir, lambda: {"loop_heartbeat_age": 0.1}).export()
+    assert client.get("/health").status_code == 200
+
+    path = os.path.join(state_dir, HEARTBEAT_FILE)
+    with open(path, encoding="utf-8") as f:
+        heartbeat = json.load(f)
+    heartbeat["ts"] = time.time() - 120
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(heartbeat, f)
+    response = client.get("/health")
+    assert response.status_code == 503 and response.json["status"] == "unhealthy"
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Тесты инкрементальной аналитики по SessionLog (SQLite)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+
+from flask_app import create_app, db  # noqa: E402
+from flask_app.analytics import (  # noqa: E402
+    LATENCY_BUCKETS_MS, compact, hist_percentile, run_rollup, summary,
+)
+from flask_app.models import RollupTotals, SessionLog  # noqa: E402
+
+TOKEN = "secret"
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URI", f"sqlite:///{tmp_path / 'analytics.db'}")
+    monkeypatch.setenv("ADMIN_API_TOKEN", TOKEN)
+    app = create_app()
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+def add_rows(*rows):
+    """rows: (timestamp, latency_ms, query)"""
+    for ts, latency_ms, query in rows:
+        db.session.add(SessionLog(
+            user_id=1, username="u", query=query, response="ответ", timestamp=ts,
+            latency_ms=latency_ms, cache_hit=False,
+        ))
+    db.session.commit()
+
+
+def day_queries() -> int:
+    return sum(row.queries for row in RollupTotals.query.filter(RollupTotals.period == "day"))
+
+
+def test_rollup_rerun_is_idempotent(app):
+    old = datetime.utcnow() - timedelta(hours=2)
+    add_rows((old, 120, "Сколько стоит доставка?"), (old, 900, "Как оплатить картой?"))
+    assert run_rollup() == 2
+    assert run_rollup() == 0
+    assert day_queries() == 2
+    assert summary("day")["queries"] == 2
+
+
+def test_fresh_rows_wait_for_the_settle_cutoff(app):
+    now = datetime.utcnow()
+    # Поздно закоммиченная строка: id меньше, время свежее — за ней ждут и следующие
+    add_rows((now - timedelta(hours=1), 100, "a"), (now, 100, "b"), (now - timedelta(hours=1), 100, "c"))
+    assert run_rollup(settle_seconds=60) == 1
+    assert day_queries() == 1
+    # После окна ожидания учитываются оставшиеся строки, без повторного учета первой
+    assert run_rollup(settle_seconds=0) == 2
+    assert day_queries() == 3
+
+
+def test_compact_keeps_rows_not_rolled_up(app):
+    ancient = datetime.utcnow() - timedelta(days=200)
+    add_rows((ancient, 100, "a"), (ancient, 100, "b"))
+    run_rollup(batch_size=1, max_batches=1)
+    add_rows((ancient, 100, "c"))
+    result = compact(raw_retention_days=90, hourly_retention_days=14)
+    assert result["raw_rows"] == 1
+    assert [row.query for row in db.session.query(SessionLog).order_by(SessionLog.id)] == ["b", "c"]
+    # Старые почасовые агрегаты удалены, посуточные остались
+    assert RollupTotals.query.filter(RollupTotals.period == "hour").count() == 0
+    assert day_queries() == 1
+
+
+def test_hist_percentile_edges():
+    size = len(LATENCY_BUCKETS_MS) + 1
+    assert hist_percentile([0] * size, 50) is None
+    one = [0] * size
+    one[0] = 1
+    assert hist_percentile(one, 0) == LATENCY_BUCKETS_MS[0]
+    assert hist_percentile(one, 100) == LATENCY_BUCKETS_MS[0]
+    tail = [0] * size
+    tail[0], tail[-1] = 99, 1
+    assert hist_percentile(tail, 99) == LATENCY_BUCKETS_MS[0]
+    assert hist_percentile(tail, 100) == float("inf")
+
+
+def test_export_pages_by_keyset(app):
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    base = datetime.utcnow() - timedelta(days=3)
+    add_rows(*((base + timedelta(hours=i), 100, f"q{i}") for i in range(5)))
+
+    seen, after_id = [], 0
+    while after_id is not None:
+        page = client.get(f"/admin/analytics/export/sessions?limit=2&after_id={after_id}", headers=headers).json
+        seen += [item["query"] for item in page["items"]]
+        after_id = page["next_after_id"]
+    assert seen == ["q0", "q1", "q2", "q3", "q4"]
+
+    run_rollup()
+    buckets, after = [], ""
+    while after is not None:
+        page = client.get(f"/admin/analytics/export/rollups?period=hour&limit=5&after={after}", headers=headers).json
+        buckets += [item["bucket_start"] for item in page["items"]]
+        after = page["next_after"]
+    # Ровно полная последняя страница дает курсор, следующая страница пуста
+    assert len(buckets) == 5 and buckets == sorted(buckets)
+    assert page["items"] == []
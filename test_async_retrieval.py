@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Тесты асинхронного поиска и пакетного эмбеддинга запросов
+"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from async_retrieval import EmbeddingBatcher, aretrieve_documents, embed_queries
+from retrieval_cache import RetrievalCache
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeStore:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.searches = []
+
+    def max_marginal_relevance_search_by_vector(self, vector, k=4, fetch_k=20):
+        self.searches.append((vector, k, fetch_k))
+        return [SimpleNamespace(page_content=f"doc {vector[0]}", metadata={"chunk_id": "c1"})]
+
+
+def make_retriever(embeddings):
+    store = FakeStore(embeddings)
+    retriever = SimpleNamespace(vectorstore=store, search_type="mmr", search_kwargs={"k": 3, "fetch_k": 10})
+    retriever.get_relevant_documents = lambda query: pytest.fail("synchronous path must not be used")
+    return retriever
+
+
+def test_concurrent_queries_share_one_model_call():
+    embeddings = CountingEmbeddings()
+    batcher = EmbeddingBatcher(embeddings, window=0.05, max_batch=16)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.embed(text) for text in ("а", "бб", "а", "ввв")))
+
+    assert asyncio.run(scenario()) == [[1.0], [2.0], [1.0], [3.0]]
+    # Одинаковые запросы пачки считаются один раз
+    assert embeddings.calls == [["а", "бб", "ввв"]]
+
+
+def test_full_batch_is_sent_without_waiting_for_window():
+    embeddings = CountingEmbeddings()
+    batcher = EmbeddingBatcher(embeddings, window=10.0, max_batch=2)
+
+    async def scenario():
+        return await asyncio.wait_for(asyncio.gather(batcher.embed("a"), batcher.embed("bb")), timeout=1.0)
+
+    assert asyncio.run(scenario()) == [[1.0], [2.0]]
+
+
+def test_model_error_reaches_every_caller():
+    class BrokenEmbeddings:
+        def embed_documents(self, texts):
+            raise RuntimeError("model failed")
+
+    batcher = EmbeddingBatcher(BrokenEmbeddings(), window=0.01)
+
+    async def scenario():
+        return await asyncio.gather(batcher.embed("a"), batcher.embed("b"), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_query_prefix_is_used_for_batched_queries():
+    base = CountingEmbeddings()
+    prefixed = SimpleNamespace(base=base, query_prefix="query: ", passage_prefix="passage: ")
+    embed_queries(prefixed, ["a"])
+    assert base.calls == [["query: a"]]
+
+
+def test_aretrieve_searches_by_vector_and_fills_cache():
+    embeddings = CountingEmbeddings()
+    retriever = make_retriever(embeddings)
+    cache = RetrievalCache(max_entries=10)
+
+    docs = asyncio.run(aretrieve_documents(retriever, "доставка", cache, "v1"))
+    assert docs[0].page_content == "doc 8.0"
+    assert retriever.vectorstore.searches == [([8.0], 3, 10)]
+    assert cache.get("v1", "Доставка?") == [("c1", "doc 8.0", {"chunk_id": "c1"})]
+
+
+def test_retriever_without_vector_search_runs_synchronously():
+    retriever = SimpleNamespace(get_relevant_documents=lambda query: [SimpleNamespace(page_content=query)])
+    docs = asyncio.run(aretrieve_documents(retriever, "оплата"))
+    assert docs[0].page_content == "оплата"
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Тесты калибровки бэкенда инференса
+"""
+
+import json
+
+from calibration import candidate_configs, config_env, host_fingerprint, load_choice
+
+
+def test_fingerprint_depends_on_model():
+    assert host_fingerprint("a/model") == host_fingerprint("a/model")
+    assert host_fingerprint("a/model") != host_fingerprint("b/model")
+
+
+def test_candidates_include_cpu_fp32():
+    configs = candidate_configs()
+    assert {"backend": "cpu", "precision": "float32"}.items() <= configs[0].items()
+    assert all(config["threads"] >= 1 for config in configs)
+
+
+def test_config_env():
+    assert config_env({"backend": "cpu", "precision": "bfloat16", "threads": 8}) == {
+        "INFERENCE_BACKEND": "cpu", "LLM_NUM_THREADS": "8", "DEVICE": "cpu", "TORCH_DTYPE": "bfloat16",
+    }
+    assert "TORCH_DTYPE" not in config_env({"backend": "openvino", "precision": "default", "threads": 4})
+
+
+def test_load_choice_by_fingerprint(tmp_path):
+    path = tmp_path / "calibration.json"
+    choice = {"backend": "openvino", "precision": "default", "threads": 4}
+    path.write_text(json.dumps({host_fingerprint("m"): {"choice": choice}}), encoding="utf-8")
+    assert load_choice("m", str(path)) == choice
+    assert load_choice("other", str(path)) is None
+    assert load_choice("m", str(tmp_path / "absent.json")) is None
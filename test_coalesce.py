@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Тесты объединения одинаковых одновременных запросов
+"""
+
+import asyncio
+
+import pytest
+
+from coalesce import SingleFlight, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("  Сколько стоит доставка?? ") == normalize_question("сколько стоит  доставка")
+    assert normalize_question("Доставка") != normalize_question("Оплата")
+
+
+def test_identical_requests_share_one_generation():
+    """Запросы с одним ключом, пришедшие во время генерации, получают ее результат"""
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "ответ"
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.run("k", generate) for _ in range(5)))
+        assert len(flight) == 0
+        return results
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [answer for answer, _ in results] == ["ответ"] * 5
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+
+
+def test_error_is_shared_and_key_released():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(flight.run("k", fail), flight.run("k", fail), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        return await flight.run("k", lambda: asyncio.sleep(0, result="ok"))
+
+    assert asyncio.run(main()) == ("ok", False)
+
+
+def test_cancelled_waiter_does_not_cancel_generation():
+    async def generate():
+        await asyncio.sleep(0.05)
+        return "ответ"
+
+    async def main():
+        flight = SingleFlight()
+        first = asyncio.ensure_future(flight.run("k", generate))
+        second = asyncio.ensure_future(flight.run("k", generate))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == ("ответ", True)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Тесты компактного (квантизованного) векторного хранилища
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("langchain")
+
+from compact_store import (  # noqa: E402
+    BlobStore, CompactIndex, CompactVectorStore, ReadOnlyStoreError, build_index, quantize_int8,
+)
+
+
+def clustered_vectors(count=2000, dim=384):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(40, dim))
+    return centers[rng.integers(0, 40, count)] + 0.3 * rng.normal(size=(count, dim))
+
+
+def records(count):
+    return [(f"c{i}", f"Фрагмент {i}", {"source": f"{i % 5}.md"}) for i in range(count)]
+
+
+def test_int8_roundtrip_error_is_small():
+    vectors = clustered_vectors(100)
+    codes, scales = quantize_int8(vectors)
+    assert codes.dtype == np.int8
+    assert scales.dtype == np.float16
+    restored = codes * scales[:, None].astype(np.float32)
+    assert np.abs(restored - vectors).max() <= scales.astype(np.float32).max()
+
+
+def test_blob_store_roundtrip(tmp_path):
+    assert BlobStore.write(str(tmp_path), records(3)) == 3
+    store = BlobStore(str(tmp_path))
+    assert len(store) == 3
+    assert store.get(2) == ("c2", "Фрагмент 2", {"source": "2.md"})
+
+
+@pytest.mark.parametrize("mode", ["int8", "pq"])
+def test_build_reports_compression_and_recall(tmp_path, mode):
+    vectors = clustered_vectors()
+    path = str(tmp_path / "compact")
+    manifest = build_index(path, vectors, records(len(vectors)), "all-MiniLM-L6-v2",
+                           mode=mode, rescore=True, eval_queries=30)
+    ratio = manifest["float32_bytes"] / manifest["vector_bytes"]
+    # int8 ограничен 4x (1 байт вместо 4), масштабы float16 добавляют 2 байта на вектор;
+    # у PQ на маленьком корпусе заметную долю занимают кодовые книги
+    assert ratio > 3.97 if mode == "int8" else ratio >= 4
+    assert manifest["recall_rescored@10"] >= manifest["recall@10"]
+
+    index = CompactIndex(path)
+    query = vectors[7] / np.linalg.norm(vectors[7])
+    best, score = index.search(query, 3)[0]
+    assert best == 7 and score == pytest.approx(1.0, abs=1e-2)
+    assert index.document(best).metadata == {"source": "2.md"}
+
+
+def test_compact_store_is_read_only(tmp_path):
+    vectors = clustered_vectors(50, 16)
+    path = str(tmp_path / "compact")
+    build_index(path, vectors, records(len(vectors)), "all-MiniLM-L6-v2", mode="int8", eval_queries=5)
+    store = CompactVectorStore.load(path, embedding=None)
+    with pytest.raises(ReadOnlyStoreError, match="rebuild"):
+        store.add_texts(["новый фрагмент"])
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Тесты доставки ответов в Telegram
+"""
+
+import time
+import asyncio
+
+import pytest
+
+from delivery import DeliveryQueue, TokenBucket, split_message
+
+
+def test_short_message_is_not_split():
+    assert split_message("Привет!\n\nКак дела?") == ["Привет!\n\nКак дела?"]
+
+
+def test_split_at_paragraph_boundaries():
+    paragraphs = [f"Абзац {i}. " + "слово " * 60 for i in range(10)]
+    text = "\n\n".join(p.strip() for p in paragraphs)
+    chunks = split_message(text, limit=1000)
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    assert all(chunk.startswith("Абзац") for chunk in chunks)
+    assert "\n\n".join(chunks) == text
+
+
+def test_split_without_separators_hard_cuts():
+    chunks = split_message("x" * 2500, limit=1000)
+    assert [len(c) for c in chunks] == [1000, 1000, 500]
+
+
+def test_token_bucket_paces_calls():
+    async def main():
+        bucket = TokenBucket(rate=20, capacity=1)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.18
+
+
+class FakeMessage:
+    def __init__(self, sent):
+        self.sent = sent
+
+    async def edit_text(self, text, parse_mode=None):
+        self.sent.append(("edit", text))
+
+
+class FakeBot:
+    def __init__(self, fail_times=0):
+        self.sent = []
+        self.fail_times = fail_times
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if self.fail_times:
+            from telegram.error import RetryAfter
+            self.fail_times -= 1
+            raise RetryAfter(0)
+        self.sent.append((chat_id, text))
+
+
+def test_queue_edits_placeholder_then_sends_rest_in_order():
+    pytest.importorskip("telegram")
+    bot = FakeBot(fail_times=1)
+    placeholder_sent = []
+
+    async def main():
+        queue = DeliveryQueue(bot, workers=2, global_rate=1000, chat_rate=1000)
+        queue.start()
+        text = "\n\n".join(["а" * 3000, "б" * 3000, "в" * 3000])
+        await queue.submit(1, text, FakeMessage(placeholder_sent))
+        await queue.close()
+
+    asyncio.run(main())
+    assert placeholder_sent == [("edit", "а" * 3000)]
+    assert bot.sent == [(1, "б" * 3000), (1, "в" * 3000)]
+
+
+def test_markup_falls_back_to_plain_text_when_rejected():
+    pytest.importorskip("telegram")
+    from telegram.error import BadRequest
+
+    class StrictBot(FakeBot):
+        async def send_message(self, chat_id, text, parse_mode=None):
+            if parse_mode and "<b>" in text:
+                raise BadRequest("Can't parse entities")
+            self.sent.append((chat_id, text, parse_mode))
+
+    bot = StrictBot()
+
+    async def main():
+        queue = DeliveryQueue(bot, workers=1, global_rate=1000, chat_rate=1000, parse_mode="HTML")
+        queue.start()
+        await queue.submit(1, "Цена 5 < 7 `код`")
+        await queue.submit(1, "**Жирный** текст")
+        await queue.close()
+
+    asyncio.run(main())
+    assert bot.sent == [(1, "Цена 5 &lt; 7 <code>код</code>", "HTML"), (1, "**Жирный** текст", None)]
+
+
+def test_on_done_reports_delivery_outcome():
+    pytest.importorskip("telegram")
+    outcomes = []
+
+    class BrokenBot(FakeBot):
+        async def send_message(self, chat_id, text, parse_mode=None):
+            if chat_id == 2:
+                raise RuntimeError("chat not found")
+            await super().send_message(chat_id, text, parse_mode)
+
+    bot = BrokenBot()
+
+    async def main():
+        queue = DeliveryQueue(bot, workers=1, global_rate=1000, chat_rate=1000)
+        queue.start()
+        await queue.submit(1, "ответ", on_done=lambda error: outcomes.append((1, error)))
+        await queue.submit(2, "ответ", on_done=lambda error: outcomes.append((2, error)))
+        await queue.close()
+
+    asyncio.run(main())
+    assert outcomes[0] == (1, None)
+    assert outcomes[1][0] == 2 and isinstance(outcomes[1][1], RuntimeError)
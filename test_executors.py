@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Тесты пулов потоков, мониторинга event loop и метрик
+"""
+
+import time
+import asyncio
+import threading
+import contextvars
+
+import metrics
+from executors import PENDING_PER_WORKER, BoundedExecutor, ExecutorOverloadedError, get_executor
+from loop_monitor import LoopLagMonitor
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def test_executor_runs_in_named_thread_with_context():
+    """Задача выполняется в потоке пула и видит contextvars вызывающей корутины"""
+    pool = BoundedExecutor("unit", workers=1)
+
+    async def main():
+        request_id.set("req-1")
+        return await pool.run(lambda: (threading.current_thread().name, request_id.get()))
+
+    name, rid = asyncio.run(main())
+    assert name.startswith("unit-pool")
+    assert rid == "req-1"
+    pool.shutdown()
+
+
+def test_executor_rejects_when_full():
+    """При заполненной очереди задача отклоняется"""
+    pool = BoundedExecutor("bounded", workers=1, max_pending=1)
+
+    async def main():
+        first = asyncio.ensure_future(pool.run(time.sleep, 0.2))
+        await asyncio.sleep(0.01)
+        try:
+            await pool.run(time.sleep, 0)
+        except ExecutorOverloadedError:
+            rejected = True
+        else:
+            rejected = False
+        await first
+        return rejected
+
+    assert asyncio.run(main())
+    pool.shutdown()
+
+
+def test_default_pool_queue_is_bounded(monkeypatch):
+    """Без *_EXECUTOR_MAX_PENDING очередь пула ограничена PENDING_PER_WORKER задачами на поток"""
+    monkeypatch.setenv("DEFAULTS_UNIT_EXECUTOR_WORKERS", "1")
+    monkeypatch.delenv("DEFAULTS_UNIT_EXECUTOR_MAX_PENDING", raising=False)
+    pool = get_executor("defaults_unit")
+    assert pool.max_pending == PENDING_PER_WORKER
+
+    async def main():
+        release = threading.Event()
+        jobs = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(PENDING_PER_WORKER + 1)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*jobs, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert sum(isinstance(result, ExecutorOverloadedError) for result in results) == 1
+    pool.shutdown()
+
+
+def test_loop_monitor_records_lag():
+    """Блокирующий вызов в event loop попадает в гистограмму задержки"""
+    lag = metrics.REGISTRY.get("event_loop_lag_seconds")
+    before = lag.count()
+
+    async def main():
+        monitor = LoopLagMonitor(interval=0.02, threshold=0.05, cooldown=0)
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)  # блокируем цикл
+        await asyncio.sleep(0.05)
+        monitor.stop()
+
+    asyncio.run(main())
+    assert lag.count() > before
+    assert lag.percentile(100) >= 0.1
+
+
+def test_metrics_render():
+    """Вывод в формате Prometheus"""
+    hist = metrics.histogram("unit_seconds", "Unit test histogram", buckets=(0.1, 1.0))
+    hist.observe(0.5, pool="a")
+    text = metrics.render()
+    assert '# TYPE unit_seconds histogram' in text
+    assert 'unit_seconds_bucket{pool="a",le="1"} 1' in text
+    assert 'unit_seconds_bucket{pool="a",le="+Inf"} 1' in text
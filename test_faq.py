@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Тесты таблицы предгенерированных ответов
+"""
+
+import os
+
+from faq import FaqTable, read_questions, save_table
+from coalesce import normalize_question
+
+
+def write_entries(path, version="v1"):
+    question = "Сколько стоит доставка по Москве?"
+    save_table(str(path), {
+        normalize_question(question): {"question": question, "answer": "500 рублей", "kb_version": version},
+    })
+
+
+def test_read_questions_skips_comments_and_duplicates(tmp_path):
+    path = tmp_path / "questions.txt"
+    path.write_text("# FAQ\nКак оплатить?\n\nкак оплатить\nЕсть доставка?\n", encoding="utf-8")
+    assert read_questions(str(path)) == ["Как оплатить?", "Есть доставка?"]
+
+
+def test_lookup_exact_and_fuzzy(tmp_path):
+    path = tmp_path / "faq.json"
+    write_entries(path)
+    table = FaqTable(str(path), fuzzy_cutoff=0.9)
+    assert table.lookup("сколько стоит доставка по москве", "v1") == "500 рублей"
+    assert table.lookup("Сколько стоит доставка по Москвe", "v1") == "500 рублей"  # латинская e
+    assert table.lookup("Как оплатить заказ?", "v1") is None
+
+
+def test_fuzzy_match_rejects_different_places_and_numbers(tmp_path):
+    path = tmp_path / "faq.json"
+    save_table(str(path), {
+        normalize_question(q): {"question": q, "answer": a, "kb_version": "v1"}
+        for q, a in [
+            ("Сколько стоит доставка в Москву?", "500 рублей"),
+            ("Можно ли вернуть товар после 14 дней?", "Нет"),
+        ]
+    })
+    table = FaqTable(str(path), fuzzy_cutoff=0.9)
+    assert table.lookup("Сколько стоит доставка в Минск?", "v1") is None
+    assert table.lookup("Можно ли вернуть товар после 30 дней?", "v1") is None
+    assert table.lookup("Скоко стоит доставка в Москву?", "v1") == "500 рублей"
+    # По умолчанию — только точное совпадение
+    assert FaqTable(str(path)).lookup("Скоко стоит доставка в Москву?", "v1") is None
+
+
+def test_lookup_ignores_other_kb_version_and_reloads_file(tmp_path):
+    path = tmp_path / "faq.json"
+    write_entries(path, version="v1")
+    table = FaqTable(str(path))
+    assert table.lookup("Сколько стоит доставка по Москве?", "v2") is None
+
+    write_entries(path, version="v2")
+    os.utime(path, (0, os.path.getmtime(path) + 10))
+    assert table.lookup("Сколько стоит доставка по Москве?", "v2") == "500 рублей"
+
+
+def test_missing_table(tmp_path):
+    assert FaqTable(str(tmp_path / "absent.json")).lookup("вопрос", "v1") is None
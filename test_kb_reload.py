@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Тесты горячей перезагрузки базы знаний (kb_reload.py)
+"""
+
+from kb_reload import KnowledgeBaseManager
+
+
+def make_manager(prompts):
+    retrievers = iter(range(100))
+    return KnowledgeBaseManager(
+        build_retriever=lambda: f"retriever-{next(retrievers)}",
+        build_chain=lambda retriever, prompt: (retriever, prompt),
+        read_prompt=lambda: prompts[0],
+    )
+
+
+def test_reload_swaps_snapshot():
+    """Запрос, взявший старый снимок, не видит перезагрузку"""
+    prompts = ["v1"]
+    manager = make_manager(prompts)
+    manager.swap(manager.load())
+    in_flight = manager.current
+
+    prompts[0] = "v2"
+    assert manager.reload()
+    assert manager.current.version == in_flight.version + 1
+    assert manager.current.system_prompt == "v2"
+    assert in_flight.system_prompt == "v1"
+    assert in_flight.qa_chain == ("retriever-0", "v1")
+
+
+def test_failed_reload_keeps_previous_version():
+    """При ошибке сборки остается предыдущая версия"""
+    manager = make_manager(["v1"])
+    manager.swap(manager.load())
+    previous = manager.current
+
+    def broken():
+        raise RuntimeError("chroma is locked")
+
+    manager.build_retriever = broken
+    assert not manager.reload()
+    assert manager.current is previous
+    assert "chroma is locked" in manager.last_error
+
+
+def test_prompt_read_error_keeps_old_prompt():
+    """Ошибка чтения промпта не сбрасывает его на значение по умолчанию"""
+    manager = make_manager(["v1"])
+    manager.swap(manager.load())
+
+    def missing():
+        raise FileNotFoundError("system_prompt.txt")
+
+    manager.read_prompt = missing
+    assert manager.reload()
+    assert manager.current.system_prompt == "v1"
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Тесты приоритетной очереди заданий LLM
+"""
+
+import time
+import asyncio
+
+import pytest
+
+from llm_jobs import LLMScheduler, JobDeadlineExceeded, classify_priority, should_stop_current_job
+
+
+def test_classify_priority():
+    assert classify_priority(1, "x" * 200, admin_ids={1}) == "admin"
+    assert classify_priority(2, "x" * 200, paid_ids={2}) == "paid"
+    assert classify_priority(3, "цена?") == "short"
+    assert classify_priority(3, "x" * 200) == "normal"
+
+
+def test_jobs_run_in_priority_order():
+    order = []
+
+    def job(name):
+        time.sleep(0.02)
+        order.append(name)
+        return name
+
+    async def main():
+        scheduler = LLMScheduler(concurrency=1)
+        blocker = asyncio.ensure_future(scheduler.submit(job, "first"))
+        await asyncio.sleep(0.005)
+        pending = [
+            scheduler.submit(job, "normal", priority="normal"),
+            scheduler.submit(job, "short", priority="short"),
+            scheduler.submit(job, "admin", priority="admin"),
+        ]
+        await asyncio.gather(blocker, *pending)
+        await scheduler.close()
+
+    asyncio.run(main())
+    assert order == ["first", "admin", "short", "normal"]
+
+
+def test_expired_job_is_dropped_before_running():
+    ran = []
+
+    async def main():
+        scheduler = LLMScheduler(concurrency=1)
+        blocker = asyncio.ensure_future(scheduler.submit(time.sleep, 0.1))
+        await asyncio.sleep(0.005)
+        with pytest.raises(JobDeadlineExceeded):
+            await scheduler.submit(ran.append, 1, timeout=0.05)
+        await blocker
+        await scheduler.close()
+
+    asyncio.run(main())
+    assert ran == []
+
+
+def test_running_job_sees_deadline():
+    """Критерий остановки видит просроченное задание в потоке пула"""
+    def decode():
+        started = time.monotonic()
+        while not should_stop_current_job():
+            if time.monotonic() - started > 2:
+                return "finished"
+            time.sleep(0.01)
+        return "partial"
+
+    async def main():
+        scheduler = LLMScheduler(concurrency=1)
+        try:
+            with pytest.raises(JobDeadlineExceeded):
+                await scheduler.submit(decode, timeout=0.1)
+        finally:
+            await scheduler.close()
+
+    started = time.monotonic()
+    asyncio.run(main())
+    assert time.monotonic() - started < 1
+
+
+def test_max_new_tokens_stops_without_deadline_error():
+    from llm_jobs import step_current_job
+
+    def decode():
+        steps = 0
+        while not step_current_job():
+            steps += 1
+        return steps
+
+    async def main():
+        scheduler = LLMScheduler(concurrency=1)
+        try:
+            return await scheduler.submit(decode, max_new_tokens=5)
+        finally:
+            await scheduler.close()
+
+    assert asyncio.run(main()) == 4
+
+
+def test_tenants_share_queue_by_weight():
+    order = []
+
+    def job(name):
+        order.append(name)
+
+    async def main():
+        scheduler = LLMScheduler(concurrency=1, weights={"b": 2})
+        try:
+            await asyncio.gather(
+                *(scheduler.submit(job, f"a{i}", tenant="a") for i in range(4)),
+                *(scheduler.submit(job, f"b{i}", tenant="b") for i in range(4)),
+            )
+        finally:
+            await scheduler.close()
+
+    asyncio.run(main())
+    # Тенант b с весом 2 получает две очереди на каждое задание a, но a не голодает
+    assert order == ["b0", "a0", "b1", "b2", "a1", "b3", "a2", "a3"]
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Тесты заглушки Telegram Bot API и статистики нагрузочного теста (loadtest/)
+"""
+
+import json
+import urllib.request
+from urllib.parse import urlencode
+
+from loadtest.fake_bot_api import FakeBotAPI
+from loadtest.run import Histogram, memory_slope
+
+
+def call(api, method, params):
+    data = urlencode({k: v if isinstance(v, str) else json.dumps(v) for k, v in params.items()}).encode()
+    with urllib.request.urlopen(f"{api.base_url}TOKEN/{method}", data=data, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def test_fake_api_roundtrip():
+    """getUpdates отдает поставленные обновления, sendMessage вызывает колбэк"""
+    received = []
+    api = FakeBotAPI(on_message=lambda chat_id, text: received.append((chat_id, text)))
+    api.start()
+    try:
+        assert call(api, "getMe", {})["result"]["is_bot"]
+        update = api.make_update(42, "Какая гарантия?")
+        api.push_update(update)
+        updates = call(api, "getUpdates", {"offset": 0, "timeout": 1})["result"]
+        assert [u["message"]["text"] for u in updates] == ["Какая гарантия?"]
+        # offset подтверждает обработанные обновления
+        assert call(api, "getUpdates", {"offset": update["update_id"] + 1, "timeout": 0})["result"] == []
+        message = call(api, "sendMessage", {"chat_id": 42, "text": "Ответ"})["result"]
+        assert message["chat"]["id"] == 42
+        assert received == [(42, "Ответ")]
+    finally:
+        api.stop()
+
+
+def test_histogram_percentiles():
+    """Перцентили гистограммы в пределах шага корзины"""
+    hist = Histogram()
+    for i in range(1, 1001):
+        hist.add(i / 1000.0)
+    assert abs(hist.percentile(50) - 0.5) / 0.5 < 0.06
+    assert abs(hist.percentile(99) - 0.99) / 0.99 < 0.06
+    assert hist.summary()["max"] == 1.0
+
+
+def test_memory_slope():
+    """Линейный рост 1 МБ за 60 с дает 60 МБ/час"""
+    samples = [(t, 100 * 1024 * 1024 + t * 1024 * 1024 // 60) for t in range(0, 600, 5)]
+    assert abs(memory_slope(samples) - 60) < 0.5
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Тесты неблокирующего структурированного логирования
+"""
+
+import json
+import queue
+import asyncio
+import logging
+
+from executors import run_in
+from logging_setup import (
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    RequestContextFilter,
+    SamplingFilter,
+    bind_request,
+    parse_sampling,
+)
+
+
+def make_record(name="bot.requests", level=logging.INFO, msg="hello %s", args=("world",)):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_parse_sampling():
+    assert parse_sampling("bot.requests=0.1, chains=2,bad") == {"bot.requests": 0.1, "chains": 1.0}
+    assert parse_sampling("") == {}
+
+
+def test_sampling_keeps_whole_requests_and_warnings():
+    sampler = SamplingFilter({"bot": 0.5, "bot.requests": 0.0})
+    record = make_record()
+    record.request_id = "abc"
+    assert not sampler.filter(record)
+    assert sampler.filter(make_record(level=logging.WARNING))
+    assert sampler.filter(make_record(name="chains"))
+
+    sampler = SamplingFilter({"bot": 0.5})
+    kept = []
+    for i in range(200):
+        decisions = set()
+        for _ in range(3):
+            record = make_record(name="bot.requests")
+            record.request_id = f"req{i}"
+            decisions.add(sampler.filter(record))
+        # Все записи одного запроса получают одно решение
+        assert len(decisions) == 1
+        kept.append(decisions.pop())
+    assert 50 < sum(kept) < 150
+
+
+def test_context_reaches_executor_threads():
+    captured = []
+
+    def work():
+        record = make_record()
+        RequestContextFilter().filter(record)
+        captured.append((record.request_id, record.tenant, record.user_id))
+
+    async def handler():
+        request_id = bind_request("brand_a", 42)
+        await run_in("db", work)
+        return request_id
+
+    request_id = asyncio.run(handler())
+    assert captured == [(request_id, "brand_a", 42)]
+
+
+def test_json_formatter():
+    record = make_record()
+    RequestContextFilter().filter(record)
+    data = json.loads(JsonFormatter().format(record))
+    assert data["msg"] == "hello world"
+    assert data["logger"] == "bot.requests"
+    assert data["level"] == "INFO"
+    assert "request_id" in data and "ts" in data
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    handler.handle(make_record())
+    handler.handle(make_record(level=logging.ERROR))
+    record = handler.queue.get_nowait()
+    # Запись передается без форматирования: сообщение собирается в потоке слушателя
+    assert record.args == ("world",)
+    assert handler.queue.empty()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Тесты хранилища истории диалогов (memory.py)
+"""
+
+from datetime import datetime, timedelta
+
+from memory import ConversationStore, format_history, rewrite_query, is_follow_up
+
+
+def test_lru_eviction():
+    """Хранилище не превышает max_users"""
+    store = ConversationStore(max_users=2)
+    for user_id in range(3):
+        store.add_turn(user_id, f"вопрос {user_id}", "ответ")
+    assert len(store) == 2
+    assert store.get_history(0) == ("", [])
+    assert store.get_history(2)[1] == [("вопрос 2", "ответ")]
+
+
+def test_token_budget_truncation():
+    """Старые реплики вытесняются в резюме при превышении бюджета"""
+    store = ConversationStore(token_budget=40, count_tokens=len)
+    store.add_turn(1, "про кресла", "x" * 20)
+    store.add_turn(1, "про доставку", "y" * 20)
+    summary, turns = store.get_history(1)
+    assert turns == [("про доставку", "y" * 20)]
+    assert summary == "про кресла"
+    assert "Ранее обсуждали: про кресла" in format_history(summary, turns)
+
+
+def test_loader_hydration():
+    """При промахе история восстанавливается через loader"""
+    calls = []
+
+    def loader(user_id, limit, since):
+        calls.append(user_id)
+        return [("Есть ли кресло Comfort?", "Да, есть.")]
+
+    store = ConversationStore(loader=loader)
+    _, turns = store.get_history(7)
+    assert turns == [("Есть ли кресло Comfort?", "Да, есть.")]
+    store.get_history(7)
+    assert calls == [7]
+
+
+def test_reset_is_not_undone_by_reload():
+    """После /reset и промаха кэша старые реплики из SessionLog не возвращаются"""
+    log = [(datetime.utcnow() - timedelta(hours=2), "Старый вопрос", "ответ"),
+           (datetime.utcnow(), "Есть ли кресло Comfort?", "Да, есть.")]
+
+    def loader(user_id, limit, since):
+        return [(q, a) for ts, q, a in log if ts > since][-limit:]
+
+    store = ConversationStore(idle_ttl=3600, loader=loader)
+    # Реплики старше idle_ttl не загружаются
+    assert store.get_history(7)[1] == [("Есть ли кресло Comfort?", "Да, есть.")]
+    store.clear(7)
+    assert store.get_history(7) == ("", [])
+    log.append((datetime.utcnow() + timedelta(seconds=1), "Новый вопрос", "ответ"))
+    assert store.get_history(7)[1] == [("Новый вопрос", "ответ")]
+
+
+def test_query_rewriting():
+    """Уточняющие вопросы дополняются предыдущим вопросом"""
+    turns = [("Есть ли у вас кресло Comfort?", "Да.")]
+    assert is_follow_up("а сколько стоит доставка?")
+    assert rewrite_query("а сколько стоит доставка?", turns) == (
+        "Есть ли у вас кресло Comfort? а сколько стоит доставка?"
+    )
+    standalone = "Какие условия гарантии на офисную мебель?"
+    assert rewrite_query(standalone, turns) == standalone
+    assert rewrite_query("а цена?", []) == "а цена?"
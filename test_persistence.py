@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Тесты асинхронной записи логов сессий
+"""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from persistence import BatchWriter, SessionRecord, SessionStore, create_store
+
+
+class MemoryStore(SessionStore):
+    def __init__(self):
+        self.batches = []
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def insert_many(self, records):
+        self.batches.append(list(records))
+
+    async def fetch_recent(self, user_id, limit, since=None):
+        return []
+
+
+def make_record(i):
+    return SessionRecord(user_id=i, username=None, query=f"q{i}", response=f"a{i}", timestamp=datetime.utcnow())
+
+
+def test_batch_writer_groups_records():
+    """Записи, поставленные подряд, сбрасываются одной пачкой"""
+    store = MemoryStore()
+
+    async def main():
+        writer = BatchWriter(store, batch_size=10, flush_interval=0.05)
+        writer.start()
+        for i in range(5):
+            writer.log(make_record(i))
+        await asyncio.sleep(0.2)
+        await writer.close()
+
+    asyncio.run(main())
+    assert [len(b) for b in store.batches] == [5]
+
+
+def test_batch_writer_flushes_rest_on_close_and_drops_overflow():
+    """close() дописывает очередь; сверх max_queue записи отбрасываются"""
+    store = MemoryStore()
+
+    async def main():
+        writer = BatchWriter(store, batch_size=2, max_queue=3)
+        for i in range(5):
+            writer.log(make_record(i))
+        await writer.close()
+
+    asyncio.run(main())
+    assert [len(b) for b in store.batches] == [2, 1]
+
+
+def test_create_store_by_uri():
+    assert type(create_store("postgresql+psycopg2://u:p@db/bot")).__name__ == "PostgresSessionStore"
+    assert create_store("postgresql+psycopg2://u:p@db/bot").dsn == "postgresql://u:p@db/bot"
+    assert create_store("sqlite:///data/app.db").path == "data/app.db"
+    assert create_store("sqlite:////var/app.db").path == "/var/app.db"
+
+
+def test_incomplete_store_fails_on_instantiation():
+    class WriteOnlyStore(SessionStore):
+        async def insert_many(self, records):
+            pass
+
+    with pytest.raises(TypeError, match="fetch_recent"):
+        WriteOnlyStore()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Тесты постобработки ответов и разметки Telegram
+"""
+
+import time
+
+import pytest
+
+from postprocess import TRUNCATION_NOTE, clean_answer, end_of_turn_token_ids, format_for_telegram
+
+
+def test_strips_chat_tags_and_cuts_hallucinated_turns():
+    text = "<|im_start|>assistant\nДоставка стоит 300 ₽.<|im_end|>\n<|im_start|>user\nА еще?"
+    assert clean_answer(text) == "Доставка стоит 300 ₽."
+
+
+def test_keeps_markdown_structure():
+    text = (
+        "Условия:  \r\n\n\n\n"
+        "- курьер:\t1-2 дня   \n"
+        "  - по Москве  бесплатно\n"
+        "\n \n\n"
+        "```\ndef f():\n    return  1\n```"
+    )
+    assert clean_answer(text) == (
+        "Условия:\n\n"
+        "- курьер: 1-2 дня\n"
+        "  - по Москве бесплатно\n\n"
+        "```\ndef f():\n    return  1\n```"
+    )
+
+
+def test_truncation():
+    assert clean_answer("а" * 50, max_chars=10) == "а" * 10 + TRUNCATION_NOTE
+
+
+def test_end_of_turn_token_ids():
+    class Tokenizer:
+        eos_token_id = 2
+        unk_token_id = 0
+        all_special_ids = [0, 2, 7]
+        vocab = {"<|im_end|>": 7, "</s>": 2}
+
+        def convert_tokens_to_ids(self, token):
+            return self.vocab.get(token, self.unk_token_id)
+
+    assert end_of_turn_token_ids(Tokenizer()) == [2, 7]
+
+
+def test_html():
+    text = "**Цена:** 5 < 7 & `a<b`\n## Итог\n*важно* и 2 * 3 [сайт](https://example.com/?a=1&b=2)"
+    assert format_for_telegram(text, "HTML") == (
+        "<b>Цена:</b> 5 &lt; 7 &amp; <code>a&lt;b</code>\n<b>Итог</b>\n"
+        '<i>важно</i> и 2 * 3 <a href="https://example.com/?a=1&amp;b=2">сайт</a>'
+    )
+
+
+def test_markdown_v2():
+    text = "**Итого:** 1.5 кг (см. `x_y`) - *быстро*!\n```py\na = b[0]\n```"
+    assert format_for_telegram(text, "MarkdownV2") == (
+        "*Итого:* 1\\.5 кг \\(см\\. `x_y`\\) \\- _быстро_\\!\n```\na = b[0]\n```"
+    )
+
+
+def test_plain_text_is_unchanged_and_unknown_mode_rejected():
+    assert format_for_telegram("**x** <b>", None) == "**x** <b>"
+    with pytest.raises(ValueError):
+        format_for_telegram("x", "Markdown")
+
+
+def test_throughput():
+    # Типичный ответ ~1.5 КБ: постобработка не должна быть заметна рядом с генерацией
+    paragraph = ("Стоимость **доставки** по Москве  составляет 300 ₽, при заказе от 3000 ₽ — бесплатно.  \n"
+                 "- курьер: 1-2 дня\n- самовывоз: `сегодня`\n\n\n")
+    text = "<|im_start|>assistant\n" + paragraph * 12 + "<|im_end|>"
+    count = 500
+    started = time.perf_counter()
+    for _ in range(count):
+        format_for_telegram(clean_answer(text, 12000), "MarkdownV2")
+    rate = count / (time.perf_counter() - started)
+    assert rate > 1000, f"{rate:.0f} answers/s"
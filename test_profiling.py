@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Тесты профилирования по запросу
+"""
+
+import time
+import threading
+
+import pytest
+
+from profiling import (
+    Profiler,
+    ProfilerBusyError,
+    ProfileRequestWatcher,
+    is_pending,
+    read_result,
+    submit_request,
+)
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_loop, args=(stop,), name="busy-worker", daemon=True)
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+def test_cpu_profile_finds_hot_function(tmp_path, busy_thread):
+    profiler = Profiler(str(tmp_path), sample_interval=0.005)
+    result = profiler.profile_cpu(0.3)
+    assert result["samples"] > 10
+    assert "busy-worker" in result["summary"]
+    assert "busy_loop" in result["summary"]
+    with open(result["collapsed"], encoding="utf-8") as f:
+        first = f.readline()
+    assert first.startswith("busy-worker;") and first.rstrip().split(" ")[-1].isdigit()
+
+
+def test_only_one_cpu_profile_at_a_time(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    sampler = profiler.start_cpu(5)
+    with pytest.raises(ProfilerBusyError):
+        profiler.start_cpu(1)
+    assert profiler.stop_cpu()
+    profiler.finish_cpu(sampler)
+    assert not profiler.stop_cpu()
+
+
+def test_heap_snapshot_diff(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    assert profiler.heap("start")["status"] == "started"
+    try:
+        first = profiler.heap("snapshot")
+        assert "No previous snapshot" in first["summary"]
+        retained = [bytearray(1024) for _ in range(2000)]
+        second = profiler.heap("snapshot")
+        assert "changes since previous snapshot" in second["summary"]
+        assert "test_profiling.py" in second["summary"]
+        del retained
+    finally:
+        assert profiler.heap("stop")["status"] == "stopped"
+
+
+def test_stacks_include_threads(tmp_path, busy_thread):
+    result = Profiler(str(tmp_path)).stacks()
+    assert "Thread busy-worker" in result["summary"]
+    assert "Thread MainThread" in result["summary"]
+
+
+def test_request_round_trip(tmp_path):
+    state_dir = str(tmp_path / "state")
+    watcher = ProfileRequestWatcher(state_dir, Profiler(str(tmp_path / "profiles")))
+    request_id = submit_request(state_dir, "stacks")
+    assert is_pending(state_dir, request_id)
+    assert read_result(state_dir, request_id) is None
+
+    watcher.poll()
+    deadline = time.time() + 5
+    while read_result(state_dir, request_id) is None and time.time() < deadline:
+        time.sleep(0.05)
+    result = read_result(state_dir, request_id)
+    assert result["status"] == "done" and result["kind"] == "stacks"
+    assert not is_pending(state_dir, request_id)
+
+    with pytest.raises(ValueError):
+        submit_request(state_dir, "rm -rf")
+    assert read_result(state_dir, "../secrets") is None
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Тесты каталога моделей эмбеддингов и смены модели
+"""
+
+import pytest
+
+pytest.importorskip("langchain_community")
+
+from embeddings import (  # noqa: E402
+    DEFAULT_EMBEDDING_MODEL,
+    EmbeddingModelMismatchError,
+    LEGACY_COLLECTION,
+    PrefixedEmbeddings,
+    check_collection_model,
+    claim_collection,
+    read_active_collection,
+    resolve_embedding_model,
+    write_active_collection,
+)
+from reembed import collection_name_for, recall_at_k  # noqa: E402
+
+
+def test_resolve_by_short_and_full_name():
+    assert resolve_embedding_model("sentence-transformers/all-MiniLM-L6-v2").name == "all-MiniLM-L6-v2"
+    assert resolve_embedding_model("multilingual-e5-small").dim == 384
+    assert resolve_embedding_model(None).name == DEFAULT_EMBEDDING_MODEL
+    with pytest.raises(ValueError):
+        resolve_embedding_model("unknown/model")
+
+
+def test_active_collection_pointer(tmp_path):
+    legacy = read_active_collection(str(tmp_path))
+    assert legacy["collection"] == LEGACY_COLLECTION and legacy["model"] == DEFAULT_EMBEDDING_MODEL
+    spec = resolve_embedding_model("multilingual-e5-base")
+    write_active_collection(str(tmp_path), "kb_e5_1", spec)
+    assert read_active_collection(str(tmp_path)) == {"collection": "kb_e5_1", "model": spec.name, "dim": 768}
+
+
+class FakeCollection:
+    name = "langchain"
+
+    def __init__(self, metadata=None, dim=None):
+        self.metadata = metadata
+        self.dim = dim
+
+    def count(self):
+        return 1 if self.dim else 0
+
+    def get(self, limit, include):
+        return {"embeddings": [[0.0] * self.dim]}
+
+    def modify(self, metadata):
+        self.metadata = metadata
+
+
+def test_mismatch_by_metadata_and_dimension():
+    spec = resolve_embedding_model("multilingual-e5-base")
+    check_collection_model(FakeCollection({"embedding_model": spec.name, "embedding_dim": 768}), spec)
+    check_collection_model(FakeCollection(), spec)
+    with pytest.raises(EmbeddingModelMismatchError):
+        check_collection_model(FakeCollection({"embedding_model": "all-MiniLM-L6-v2"}), spec)
+    # Старая коллекция без метаданных: сверяем размерность сохраненных векторов
+    with pytest.raises(EmbeddingModelMismatchError):
+        check_collection_model(FakeCollection(dim=384), spec)
+
+
+def test_claim_stamps_only_new_collections():
+    spec = resolve_embedding_model("multilingual-e5-base")
+    new = FakeCollection()
+    claim_collection(new, spec)
+    assert new.metadata == {"embedding_model": spec.name, "embedding_dim": 768}
+    # Повторное открытие другой моделью отклоняется по сохраненным метаданным
+    with pytest.raises(EmbeddingModelMismatchError):
+        claim_collection(new, resolve_embedding_model("all-MiniLM-L6-v2"))
+    legacy = FakeCollection(dim=768)
+    claim_collection(legacy, spec)
+    assert legacy.metadata is None
+
+
+def test_prefixes_are_added():
+    class Echo:
+        def embed_documents(self, texts):
+            return texts
+
+        def embed_query(self, text):
+            return text
+
+    embedder = PrefixedEmbeddings(Echo(), "query: ", "passage: ")
+    assert embedder.embed_query("доставка") == "query: доставка"
+    assert embedder.embed_documents(["a"]) == ["passage: a"]
+
+
+def test_recall_at_k_and_collection_name():
+    retrieved = [("c1", "a.md"), ("c2", "b.md"), ("c3", "c.md")]
+    assert recall_at_k(retrieved, ["a.md", "c.md"], k=2) == 0.5
+    assert recall_at_k(retrieved, ["c3"], k=3) == 1.0
+    name = collection_name_for(resolve_embedding_model("multilingual-e5-small"))
+    assert name.startswith("kb_multilingual-e5-small_") and len(name) <= 63
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Тесты кэша результатов поиска и версии базы знаний
+"""
+
+import metrics
+from kb_reload import compute_kb_version, read_kb_version, write_kb_version
+from retrieval_cache import RetrievalCache
+
+
+def test_cache_hit_by_normalized_query():
+    cache = RetrievalCache(max_entries=10)
+    cache.put("v1", "Сколько стоит доставка?", [("c1", "текст", {})], cost=0.2)
+    assert cache.get("v1", "сколько стоит  доставка") == [("c1", "текст", {})]
+    assert cache.get("v1", "оплата") is None
+
+
+def test_version_change_drops_entries():
+    cache = RetrievalCache(max_entries=10)
+    cache.put("v1", "доставка", [("c1", "старый", {})], cost=0.1)
+    assert cache.get("v2", "доставка") is None
+    assert len(cache) == 0
+    # Поздний результат со старой версией не попадает в кэш новой
+    cache.put("v1", "доставка", [("c1", "старый", {})], cost=0.1)
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = RetrievalCache(max_entries=2)
+    for query in ("a", "b"):
+        cache.put("v1", query, [], cost=0.0)
+    cache.get("v1", "a")
+    cache.put("v1", "c", [], cost=0.0)
+    assert cache.get("v1", "b") is None
+    assert cache.get("v1", "a") == []
+
+
+def test_kb_version_file_roundtrip(tmp_path):
+    version = compute_kb_version(["b", "a"], [{"source": "2.md"}, {"source": "1.md"}])
+    assert version == compute_kb_version(["a", "b"], [{"source": "1.md"}, {"source": "2.md"}])
+    assert version != compute_kb_version(["a", "c"], [{"source": "1.md"}, {"source": "2.md"}])
+    assert read_kb_version(str(tmp_path)) is None
+    write_kb_version(str(tmp_path), version, documents=2)
+    assert read_kb_version(str(tmp_path)) == version
+
+
+def test_entries_gauge_is_labelled_per_tenant():
+    first = RetrievalCache(max_entries=10, tenant="shop")
+    second = RetrievalCache(max_entries=10, tenant="support")
+    first.put("v1", "доставка", [("c1", "текст", {})], cost=0.1)
+    gauge = metrics.REGISTRY.get("retrieval_cache_entries")
+    assert gauge.value(tenant="shop") == 1
+    assert gauge.value(tenant="support") == len(second) == 0
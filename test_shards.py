@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Тесты шардирования базы знаний и маршрутизации запросов
+"""
+
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain")
+
+from shards import ShardRouter, ShardedRetriever, centroid, read_shard_rules, shard_for_path  # noqa: E402
+
+
+def test_shard_for_path():
+    root = os.path.join("knowledge_base")
+    assert shard_for_path(root, os.path.join(root, "Delivery Terms", "a.md")) == "delivery_terms"
+    assert shard_for_path(root, os.path.join(root, "about.md")) == "general"
+
+
+def test_centroid_is_normalized_mean():
+    assert centroid([[1.0, 0.0], [1.0, 0.0]]) == [1.0, 0.0]
+    assert centroid([[3.0, 0.0], [0.0, 4.0]]) == pytest.approx([0.6, 0.8])
+
+
+def test_keyword_rules_win_over_embeddings(tmp_path):
+    (tmp_path / "shard_rules.json").write_text('{"Delivery": ["ДОСТАВК", "курьер"]}', encoding="utf-8")
+    router = ShardRouter(
+        ["delivery", "catalog", "policies"],
+        keywords=read_shard_rules(str(tmp_path)),
+        centroids={"delivery": [1.0, 0.0], "catalog": [0.0, 1.0], "policies": [0.7, 0.7]},
+        max_shards=2, margin=0.1,
+    )
+    assert router.route("Сколько стоит доставка курьером?", [0.0, 1.0]) == ["delivery"]
+    # Без ключевых слов — ближайшие центроиды в пределах margin
+    assert router.route("Какие модели есть?", [0.5, 1.0]) == ["policies", "catalog"]
+    assert router.route("Какие модели есть?", [0.0, 1.0]) == ["catalog"]
+
+
+def test_route_without_signals_searches_all_allowed():
+    router = ShardRouter(["a", "b"], keywords={"c": ["x"]})
+    assert router.route("вопрос") == ["a", "b"]
+
+
+class FakeCollection:
+    def __init__(self, items):
+        self.items = items  # (текст, вектор)
+
+    def query(self, query_embeddings, n_results, include):
+        query = np.array(query_embeddings[0])
+        ranked = sorted(self.items, key=lambda item: float(np.linalg.norm(np.array(item[1]) - query)))[:n_results]
+        return {
+            "documents": [[text for text, _ in ranked]],
+            "metadatas": [[{"text": text} for text, _ in ranked]],
+            "distances": [[float(np.linalg.norm(np.array(vector) - query)) for _, vector in ranked]],
+            "embeddings": [[vector for _, vector in ranked]],
+        }
+
+
+def test_sharded_retriever_merges_shards_with_mmr():
+    stores = {
+        "a": SimpleNamespace(_collection=FakeCollection([("a1", [1.0, 0.0]), ("a2", [0.99, 0.01])])),
+        "b": SimpleNamespace(_collection=FakeCollection([("b1", [0.8, 0.6])])),
+    }
+    retriever = ShardedRetriever(stores=stores, router=ShardRouter(["a", "b"]), embeddings=None,
+                                 k=2, lambda_mult=0.3)
+    docs = retriever.search_by_vector("вопрос", [1.0, 0.0])
+    # Почти дубликат a2 уступает более разнообразному фрагменту другого шарда
+    assert [doc.page_content for doc in docs] == ["a1", "b1"]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Тесты конфигурации тенантов (несколько ботов в одном процессе)
+"""
+
+import json
+import asyncio
+
+import pytest
+
+from tenants import Tenant, TenantConfig, load_tenants
+
+
+@pytest.fixture
+def defaults():
+    return TenantConfig("default", "", "system_prompt.txt", "./chroma_db", admin_ids={1})
+
+
+def write_config(tmp_path, tenants):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps({"tenants": tenants}), encoding="utf-8")
+    return str(path)
+
+
+def test_tenant_inherits_defaults(tmp_path, monkeypatch, defaults):
+    monkeypatch.setenv("BRAND_A_TOKEN", "token-a")
+    path = write_config(tmp_path, [
+        {"name": "brand_a", "token_env": "BRAND_A_TOKEN", "kb_shards": ["delivery"],
+         "admin_ids": [111, "222"], "weight": 2, "delivery_chat_rate": 0.5},
+    ])
+    [config] = load_tenants(path, defaults)
+    assert config.token == "token-a"
+    assert config.system_prompt_path == "system_prompt.txt"
+    assert config.persist_dir == "./chroma_db"
+    assert config.kb_shards == ["delivery"]
+    assert config.admin_ids == {111, 222}
+    assert config.weight == 2.0
+    assert config.delivery_chat_rate == 0.5
+    assert config.delivery_global_rate is None
+
+
+def test_missing_token_is_rejected(tmp_path, monkeypatch, defaults):
+    monkeypatch.delenv("MISSING_TOKEN", raising=False)
+    path = write_config(tmp_path, [{"name": "brand_a", "token_env": "MISSING_TOKEN"}])
+    with pytest.raises(ValueError, match="token"):
+        load_tenants(path, defaults)
+
+
+@pytest.mark.parametrize("tenants, message", [
+    ([], "No tenants"),
+    ([{"name": "a", "token": "t1"}, {"name": "a", "token": "t2"}], "Duplicate"),
+    ([{"name": "a", "token": "t1"}, {"name": "b", "token": "t1"}], "share"),
+    ([{"name": "bad name", "token": "t1"}], "Invalid tenant name"),
+    ([{"name": "a", "token": "t1", "weight": 0}], "weight"),
+])
+def test_invalid_configs(tmp_path, defaults, tenants, message):
+    with pytest.raises(ValueError, match=message):
+        load_tenants(write_config(tmp_path, tenants), defaults)
+
+
+def test_tenant_admins_include_process_admins():
+    tenant = Tenant(TenantConfig("brand_a", "t", "p.txt", "./db", admin_ids={5}), kb_manager=None)
+    assert tenant.is_admin(5)
+    assert tenant.is_admin(7, global_admins={7})
+    assert not tenant.is_admin(8, global_admins={7})
+
+
+def test_stop_processing_drains_delivery_while_bot_can_send(defaults):
+    events = []
+    bot = {"open": True}
+
+    class FakeConsumer:
+        async def close(self, timeout):
+            events.append(("consumer", bot["open"]))
+
+    class FakeDelivery:
+        async def close(self, timeout):
+            events.append(("delivery", bot["open"]))
+
+    tenant = Tenant(defaults, kb_manager=None)
+    tenant.update_consumer = FakeConsumer()
+    tenant.delivery = FakeDelivery()
+
+    async def stop_application():
+        # Порядок PTB: stop() -> post_stop -> shutdown() (закрывает клиент бота) -> post_shutdown
+        await tenant.stop_processing()
+        bot["open"] = False
+
+    asyncio.run(stop_application())
+    assert events == [("consumer", True), ("delivery", True)]
+    assert tenant.update_consumer is None and tenant.delivery is None
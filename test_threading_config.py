@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Тесты настроек потоков инференса
+"""
+
+import os
+
+import pytest
+
+import metrics
+from executors import BoundedExecutor
+from threading_config import ThreadingConfig, parse_cpu_list, pin_current_thread
+
+
+def test_parse_cpu_list():
+    assert parse_cpu_list("0-3,8, 10-11") == {0, 1, 2, 3, 8, 10, 11}
+    assert parse_cpu_list("") == set()
+
+
+def test_openvino_config_and_metrics():
+    config = ThreadingConfig(llm_threads=6, openvino_hint="latency", openvino_streams="1")
+    assert config.openvino_config() == {
+        "PERFORMANCE_HINT": "LATENCY", "NUM_STREAMS": "1", "INFERENCE_NUM_THREADS": "6",
+    }
+    text = metrics.render()
+    assert 'openvino_config_info{hint="LATENCY",streams="1"} 1' in text
+    assert 'inference_threads{component="llm",kind="openvino"} 6' in text
+
+
+def test_pool_thread_is_pinned():
+    if not hasattr(os, "sched_getaffinity"):
+        pytest.skip("sched_setaffinity недоступен")
+    cpu = min(os.sched_getaffinity(0))
+    pool = BoundedExecutor("pinned", workers=1, initializer=lambda: pin_current_thread({cpu}))
+    try:
+        assert pool.executor.submit(os.sched_getaffinity, 0).result() == {cpu}
+        # Привязка потока пула не влияет на остальные потоки процесса
+        assert len(os.sched_getaffinity(0)) >= 1
+    finally:
+        pool.shutdown()
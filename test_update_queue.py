@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Тесты персистентной очереди обновлений Telegram
+"""
+
+import asyncio
+
+import pytest
+
+import update_queue
+from executors import ExecutorOverloadedError
+from update_queue import DONE, FAILED, DurableUpdateQueue, UpdateQueueConsumer, UpdateQueueFullError
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = DurableUpdateQueue(str(tmp_path / "updates.db"), max_pending=3, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def status(queue, update_id, tenant="a"):
+    return queue._conn.execute(
+        "SELECT status FROM updates WHERE tenant = ? AND update_id = ?", (tenant, update_id)
+    ).fetchone()[0]
+
+
+def test_enqueue_is_idempotent_per_tenant(queue):
+    assert queue.enqueue("a", 1, {"update_id": 1})
+    assert not queue.enqueue("a", 1, {"update_id": 1})
+    assert queue.enqueue("b", 1, {"update_id": 1})
+    queue.claim("a", 10)
+    queue.complete("a", 1)
+    # Выполненное обновление тоже не принимается повторно
+    assert not queue.enqueue("a", 1, {"update_id": 1})
+    assert queue.pending("a") == 0 and queue.pending("b") == 1
+
+
+def test_bounded_pending(queue):
+    for update_id in range(3):
+        queue.enqueue("a", update_id, {})
+    with pytest.raises(UpdateQueueFullError):
+        queue.enqueue("a", 99, {})
+    # Забранные, но не выполненные записи по-прежнему занимают место
+    queue.claim("a", 2)
+    with pytest.raises(UpdateQueueFullError):
+        queue.enqueue("a", 99, {})
+    queue.complete("a", 0)
+    assert queue.enqueue("a", 99, {})
+
+
+def test_recover_after_crash(tmp_path):
+    path = str(tmp_path / "updates.db")
+    queue = DurableUpdateQueue(path, max_attempts=2)
+    queue.enqueue("a", 1, {"text": "первый"})
+    queue.enqueue("a", 2, {"text": "второй"})
+    assert [item[:2] for item in queue.claim("a", 1)] == [(1, {"text": "первый"})]
+    queue.close()  # «падение» во время обработки
+
+    queue = DurableUpdateQueue(path, max_attempts=2)
+    assert queue.recover("a") == (1, 0)
+    assert [item[0] for item in queue.claim("a", 10)] == [1, 2]
+    # Вторая прерванная попытка: обновление считается «ядовитым»
+    assert queue.recover("a") == (1, 1)
+    assert status(queue, 1) == FAILED
+    queue.close()
+
+
+def test_consumer_processes_in_order_with_bounded_concurrency(queue):
+    queue.max_pending = 0
+    processed = []
+    active = 0
+    peak = 0
+
+    async def handler(update_id, payload):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        processed.append(update_id)
+        active -= 1
+
+    async def main():
+        consumer = UpdateQueueConsumer(queue, "a", handler, workers=2, poll_interval=0.05)
+        await consumer.start()
+        for update_id in range(1, 7):
+            queue.enqueue("a", update_id, {})
+            consumer.notify()
+        for _ in range(100):
+            if len(processed) == 6:
+                break
+            await asyncio.sleep(0.02)
+        await consumer.close()
+
+    asyncio.run(main())
+    assert sorted(processed) == [1, 2, 3, 4, 5, 6]
+    assert peak <= 2
+    assert all(status(queue, update_id) == DONE for update_id in range(1, 7))
+
+
+def test_interrupted_update_is_resumed(queue):
+    async def slow(update_id, payload):
+        await asyncio.sleep(10)
+
+    async def main():
+        consumer = UpdateQueueConsumer(queue, "a", slow, workers=1, poll_interval=0.05)
+        await consumer.start()
+        queue.enqueue("a", 1, {})
+        consumer.notify()
+        await asyncio.sleep(0.2)
+        await consumer.close(timeout=0.05)
+
+    asyncio.run(main())
+    assert queue.recover("a") == (1, 0)
+    assert queue.pending("a") == 1
+
+
+def test_completion_is_retried_when_db_pool_is_overloaded(queue, monkeypatch):
+    real_run_in = update_queue.run_in
+    rejected = []
+
+    async def flaky_run_in(pool, fn, *args):
+        if fn == queue.complete and len(rejected) < 2:
+            rejected.append(args)
+            raise ExecutorOverloadedError("db pool is full")
+        return await real_run_in(pool, fn, *args)
+
+    monkeypatch.setattr(update_queue, "run_in", flaky_run_in)
+
+    async def handler(update_id, payload):
+        pass
+
+    async def main():
+        consumer = UpdateQueueConsumer(queue, "a", handler, workers=1, poll_interval=0.05)
+        await consumer.start()
+        queue.enqueue("a", 1, {})
+        consumer.notify()
+        for _ in range(100):
+            if status(queue, 1) == DONE:
+                break
+            await asyncio.sleep(0.02)
+        await consumer.close()
+
+    asyncio.run(main())
+    assert len(rejected) == 2
+    # Отмеченное обновление не обрабатывается повторно после перезапуска
+    assert status(queue, 1) == DONE
+    assert queue.recover("a") == (0, 0)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Тесты прогрева моделей при старте
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from llm_jobs import LLMScheduler
+from warmup import DEFAULT_WARMUP_QUERIES, format_warmup_report, read_warmup_queries, run_warmup
+
+
+class FakeRetriever:
+    def __init__(self):
+        self.vectorstore = SimpleNamespace(embeddings=SimpleNamespace(embed_query=lambda text: [0.0]))
+        self.queries = []
+
+    def get_relevant_documents(self, query):
+        self.queries.append(query)
+        return [SimpleNamespace(page_content=query, metadata={})] * (len(query) % 3 + 1)
+
+
+def test_warmup_runs_every_stage_and_worker():
+    retriever = FakeRetriever()
+    snapshot = SimpleNamespace(qa_chain=SimpleNamespace(retriever=retriever))
+    calls = []
+
+    def answer(qa_chain, docs, question, history):
+        calls.append(len(docs))
+        return {"result": "ok"}
+
+    async def main():
+        scheduler = LLMScheduler(concurrency=2)
+        try:
+            return await run_warmup(snapshot, scheduler, answer, ["а", "бб"], max_new_tokens=4)
+        finally:
+            await scheduler.close()
+
+    timings = asyncio.run(main())
+    assert set(timings) == {
+        "embedding_first", "embedding", "retrieval", "generation_short", "generation_full", "total",
+    }
+    assert sorted(retriever.queries) == ["а", "бб"]
+    # Короткий и полный контекст, по заданию на каждый поток планировщика
+    assert sorted(calls) == [1, 1, 3, 3]
+    assert format_warmup_report({"total": 1.234}) == "Прогрев: total 1.2s"
+
+
+def test_queries_file_fallback(tmp_path):
+    assert read_warmup_queries(str(tmp_path / "absent.txt")) == DEFAULT_WARMUP_QUERIES
+    path = tmp_path / "q.txt"
+    path.write_text("вопрос 1\n\nвопрос 2\n", encoding="utf-8")
+    assert read_warmup_queries(str(path)) == ["вопрос 1", "вопрос 2"]
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Тесты memory-mapped загрузки весов
+"""
+
+import json
+import struct
+
+import pytest
+
+from weights_mmap import memory_report, mmap_safetensors
+
+
+def write_safetensors(path, tensors):
+    """Минимальная запись safetensors: float32 тензоры из списков."""
+    header, data = {}, b""
+    for name, (shape, values) in tensors.items():
+        raw = struct.pack(f"<{len(values)}f", *values)
+        header[name] = {"dtype": "F32", "shape": shape, "data_offsets": [len(data), len(data) + len(raw)]}
+        data += raw
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)) + header_bytes + data)
+
+
+def test_memory_report_has_rss():
+    report = memory_report()
+    if not report:
+        pytest.skip("/proc/self/smaps_rollup недоступен")
+    assert report["rss"] > 0
+    assert report["rss"] >= report["private"]
+
+
+def test_mmap_safetensors_reads_tensors(tmp_path):
+    torch = pytest.importorskip("torch")
+    path = tmp_path / "model.safetensors"
+    write_safetensors(path, {"a.weight": ([2, 2], [1, 2, 3, 4]), "b.bias": ([3], [5, 6, 7])})
+    tensors = mmap_safetensors(str(path))
+    assert tensors["a.weight"].tolist() == [[1, 2], [3, 4]]
+    assert tensors["b.bias"].dtype == torch.float32
+    # Запись в тензор не меняет файл (MAP_PRIVATE)
+    tensors["b.bias"][0] = 42
+    assert mmap_safetensors(str(path))["b.bias"].tolist() == [5, 6, 7]
@@ -0,0 +1,122 @@
+"""
+Настройки потоков для CPU-инференса.
+
+LLM и эмбеддер получают раздельные настройки:
+    LLM_NUM_THREADS        — intra-op потоки torch / INFERENCE_NUM_THREADS OpenVINO
+    LLM_INTER_OP_THREADS   — inter-op потоки torch
+    LLM_CPU_AFFINITY       — ядра для потоков пула llm ("0-7", "0,2,4")
+    EMBED_CPU_AFFINITY     — ядра для потоков пула embed (поиск по базе знаний)
+    OPENVINO_PERFORMANCE_HINT — LATENCY | THROUGHPUT
+    OPENVINO_NUM_STREAMS   — число потоков исполнения (streams) OpenVINO
+
+Intra-op пул torch общий для процесса, поэтому число его потоков задается
+один раз (для LLM); эмбеддер отделяется собственным пулом потоков и
+привязкой к ядрам. Активные значения публикуются в /metrics.
+"""
+
+import os
+import logging
+from typing import Dict, Optional, Set
+
+import metrics
+from executors import add_initializer
+
+logger = logging.getLogger(__name__)
+
+_threads = metrics.gauge("inference_threads", "Configured inference threads by component and kind")
+_affinity = metrics.gauge("inference_cpu_affinity_cores", "CPU cores the component's executor threads are pinned to")
+_openvino = metrics.gauge("openvino_config_info", "Active OpenVINO performance settings (value is always 1)")
+
+
+def parse_cpu_list(spec: str) -> Set[int]:
+    """
+    Разбирает список ядер в формате taskset: "0-3,8,10-11".
+
+    Returns:
+        Set[int]: Номера ядер (пустое множество для пустой строки)
+    """
+    cpus: Set[int] = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def pin_current_thread(cpus: Set[int]) -> None:
+    """Привязывает вызывающий поток к ядрам (Linux; на других ОС — no-op)."""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+class ThreadingConfig:
+    """Настройки потоков LLM и эмбеддера (см. описание модуля)."""
+
+    def __init__(self, llm_threads: int = 0, llm_inter_op_threads: int = 0,
+                 llm_affinity: Optional[Set[int]] = None, embed_affinity: Optional[Set[int]] = None,
+                 openvino_hint: Optional[str] = None, openvino_streams: Optional[str] = None):
+        self.llm_threads = llm_threads
+        self.llm_inter_op_threads = llm_inter_op_threads
+        self.llm_affinity = llm_affinity or set()
+        self.embed_affinity = embed_affinity or set()
+        self.openvino_hint = openvino_hint
+        self.openvino_streams = openvino_streams
+
+    @classmethod
+    def from_env(cls) -> "ThreadingConfig":
+        return cls(
+            llm_threads=int(os.getenv("LLM_NUM_THREADS", "0")),
+            llm_inter_op_threads=int(os.getenv("LLM_INTER_OP_THREADS", "0")),
+            llm_affinity=parse_cpu_list(os.getenv("LLM_CPU_AFFINITY", "")),
+            embed_affinity=parse_cpu_list(os.getenv("EMBED_CPU_AFFINITY", "")),
+            openvino_hint=os.getenv("OPENVINO_PERFORMANCE_HINT") or None,
+            openvino_streams=os.getenv("OPENVINO_NUM_STREAMS") or None,
+        )
+
+    def register_affinity(self) -> None:
+        """Регистрирует привязку к ядрам для потоков пулов llm и embed (до их создания)."""
+        for pool, cpus in (("llm", self.llm_affinity), ("embed", self.embed_affinity)):
+            if cpus:
+                add_initializer(pool, lambda cpus=cpus: pin_current_thread(cpus))
+                _affinity.set(len(cpus), component=pool)
+                logger.info(f"Executor '{pool}' threads pinned to CPUs {sorted(cpus)}")
+
+    def apply_torch(self) -> None:
+        """Применяет настройки потоков torch (вызывать до первого инференса)."""
+        import torch
+        if self.llm_threads > 0:
+            torch.set_num_threads(self.llm_threads)
+        if self.llm_inter_op_threads > 0:
+            try:
+                torch.set_num_interop_threads(self.llm_inter_op_threads)
+            except RuntimeError as e:
+                # Inter-op пул уже запущен: значение можно задать только до первого использования
+                logger.warning(f"Cannot set torch inter-op threads: {e}")
+        _threads.set(torch.get_num_threads(), component="llm", kind="intra_op")
+        _threads.set(torch.get_num_interop_threads(), component="llm", kind="inter_op")
+        logger.info(
+            f"Torch threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}"
+        )
+
+    def openvino_config(self) -> Dict[str, str]:
+        """ov_config для OVModelForCausalLM."""
+        config: Dict[str, str] = {}
+        if self.openvino_hint:
+            config["PERFORMANCE_HINT"] = self.openvino_hint.upper()
+        if self.openvino_streams:
+            config["NUM_STREAMS"] = self.openvino_streams
+        if self.llm_threads > 0:
+            config["INFERENCE_NUM_THREADS"] = str(self.llm_threads)
+            _threads.set(self.llm_threads, component="llm", kind="openvino")
+        _openvino.set(
+            1,
+            hint=config.get("PERFORMANCE_HINT", "default"),
+            streams=config.get("NUM_STREAMS", "default"),
+        )
+        return config
+
@@ -0,0 +1,323 @@
+"""
+Персистентная очередь обновлений Telegram между приемом и обработкой.
+
+Без очереди вопрос пользователя живет только в памяти обработчика: падение
+или перезапуск процесса во время генерации теряет его. С UPDATE_QUEUE=1
+текстовые сообщения сначала записываются в локальную SQLite (WAL), и только
+затем обрабатываются фиксированным числом воркеров:
+    - at-least-once: запись помечается выполненной после обработчика, который
+      в боте ждет и отправки ответа очередью доставки; после перезапуска
+      незавершенные записи возвращаются в очередь (recover);
+    - идемпотентность по (тенант, update_id): повторная доставка того же
+      обновления Telegram игнорируется, выполненные записи хранятся
+      UPDATE_QUEUE_RETENTION секунд;
+    - ограниченная память и потоки: всплеск нагрузки ждет на диске, воркеры
+      забирают записи пачками по числу свободных мест;
+    - «ядовитые» обновления, которые роняли процесс UPDATE_QUEUE_MAX_ATTEMPTS
+      раз, помечаются failed и больше не выполняются.
+
+Вызовы sqlite3 блокирующие и выполняются в пуле db.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+import metrics
+from executors import run_in
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+# Попыток отметить обработанное обновление через пул db (затем синхронно)
+COMPLETE_ATTEMPTS = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS updates (
+    tenant TEXT NOT NULL,
+    update_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    finished_at REAL,
+    PRIMARY KEY (tenant, update_id)
+);
+CREATE INDEX IF NOT EXISTS updates_status ON updates (tenant, status, update_id);
+"""
+
+_enqueued = metrics.counter("update_queue_enqueued_total", "Telegram updates persisted to the update queue by outcome")
+_processed = metrics.counter("update_queue_processed_total", "Queued Telegram updates processed by outcome")
+_pending_gauge = metrics.gauge("update_queue_pending", "Queued Telegram updates waiting for processing")
+_queue_wait = metrics.histogram("update_queue_wait_seconds", "Time from persisting an update to starting its processing")
+
+
+class UpdateQueueFullError(RuntimeError):
+    """В очереди слишком много необработанных обновлений."""
+    pass
+
+
+class DurableUpdateQueue:
+    """
+    Очередь обновлений в SQLite.
+
+    Args:
+        path: Файл базы очереди
+        max_pending: Максимум ожидающих и обрабатываемых записей на тенанта (0 — без ограничения)
+        max_attempts: Попыток обработки, после которых запись помечается failed
+        retention: Сколько хранить выполненные записи для защиты от повторов, сек
+    """
+
+    def __init__(self, path: str, max_pending: int = 10000, max_attempts: int = 3, retention: float = 86400.0):
+        self.path = path
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retention = retention
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL в WAL не теряет зафиксированные транзакции при падении процесса (только ОС)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "DurableUpdateQueue":
+        return cls(
+            path=os.getenv("UPDATE_QUEUE_PATH", os.path.join("logs", "update_queue.db")),
+            max_pending=int(os.getenv("UPDATE_QUEUE_MAX_PENDING", "10000")),
+            max_attempts=int(os.getenv("UPDATE_QUEUE_MAX_ATTEMPTS", "3")),
+            retention=float(os.getenv("UPDATE_QUEUE_RETENTION", "86400")),
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def enqueue(self, tenant: str, update_id: int, payload: dict) -> bool:
+        """
+        Сохраняет обновление.
+
+        Returns:
+            bool: False — обновление уже было в очереди (повторная доставка)
+
+        Raises:
+            UpdateQueueFullError: Ожидающих и обрабатываемых записей больше max_pending
+        """
+        with self._lock:
+            # Забранные воркерами записи тоже занимают место, пока не выполнены
+            if self.max_pending and self._count(tenant, PENDING, PROCESSING) >= self.max_pending:
+                _enqueued.inc(outcome="rejected")
+                raise UpdateQueueFullError(f"Update queue for {tenant} is full ({self.max_pending} pending)")
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO updates (tenant, update_id, payload, status, enqueued_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (tenant, update_id, json.dumps(payload, ensure_ascii=False), PENDING, time.time()),
+            )
+        inserted = cursor.rowcount == 1
+        _enqueued.inc(outcome="stored" if inserted else "duplicate")
+        return inserted
+
+    def claim(self, tenant: str, limit: int) -> List[Tuple[int, dict, float]]:
+        """Забирает до limit старейших ожидающих записей: [(update_id, payload, enqueued_at)]."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT update_id, payload, enqueued_at FROM updates "
+                    "WHERE tenant = ? AND status = ? ORDER BY update_id LIMIT ?",
+                    (tenant, PENDING, limit),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE updates SET status = ?, attempts = attempts + 1 WHERE tenant = ? AND update_id = ?",
+                    [(PROCESSING, tenant, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(update_id, json.loads(payload), enqueued_at) for update_id, payload, enqueued_at in rows]
+
+    def complete(self, tenant: str, update_id: int, status: str = DONE) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE updates SET status = ?, finished_at = ? WHERE tenant = ? AND update_id = ?",
+                (status, time.time(), tenant, update_id),
+            )
+
+    def recover(self, tenant: str) -> Tuple[int, int]:
+        """
+        Возвращает в очередь записи, обработка которых прервалась падением процесса.
+
+        Returns:
+            Tuple[int, int]: (возвращено в очередь, помечено failed)
+        """
+        with self._lock:
+            failed = self._conn.execute(
+                "UPDATE updates SET status = ?, finished_at = ? WHERE tenant = ? AND status = ? AND attempts >= ?",
+                (FAILED, time.time(), tenant, PROCESSING, self.max_attempts),
+            ).rowcount
+            requeued = self._conn.execute(
+                "UPDATE updates SET status = ? WHERE tenant = ? AND status = ?",
+                (PENDING, tenant, PROCESSING),
+            ).rowcount
+        return requeued, failed
+
+    def prune(self) -> int:
+        """Удаляет выполненные и failed записи старше retention."""
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM updates WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, time.time() - self.retention),
+            ).rowcount
+
+    def _count(self, tenant: str, *statuses: str) -> int:
+        placeholders = ", ".join("?" for _ in statuses)
+        return self._conn.execute(
+            f"SELECT COUNT(*) FROM updates WHERE tenant = ? AND status IN ({placeholders})", (tenant, *statuses)
+        ).fetchone()[0]
+
+    def pending(self, tenant: str) -> int:
+        with self._lock:
+            return self._count(tenant, PENDING)
+
+
+class UpdateQueueConsumer:
+    """
+    Воркеры тенанта: забирают записи из очереди и передают их обработчику.
+
+    Args:
+        queue: Очередь обновлений
+        tenant: Имя тенанта
+        handler: Корутина обработки (update_id, payload)
+        workers: Число одновременно обрабатываемых обновлений
+        poll_interval: Период опроса пустой очереди, сек
+    """
+
+    def __init__(self, queue: DurableUpdateQueue, tenant: str,
+                 handler: Callable[[int, dict], Awaitable[Any]], workers: int = 8, poll_interval: float = 0.5):
+        self.queue = queue
+        self.tenant = tenant
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(workers)
+        self._tasks: set = set()
+        self._runner: Optional[asyncio.Task] = None
+
+    def notify(self) -> None:
+        """Новая запись в очереди: не ждать следующего опроса."""
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        requeued, failed = await run_in("db", self.queue.recover, self.tenant)
+        if requeued or failed:
+            logger.warning(f"Update queue {self.tenant}: resuming {requeued} interrupted updates, "
+                           f"{failed} marked failed after {self.queue.max_attempts} attempts")
+        _pending_gauge.set_function(lambda: self.queue.pending(self.tenant), tenant=self.tenant)
+        self._runner = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        last_prune = 0.0
+        while True:
+            # Ждем свободное место, затем забираем столько записей, сколько мест свободно
+            await self._slots.acquire()
+            free = 1
+            while free < self.workers and not self._slots.locked():
+                await self._slots.acquire()
+                free += 1
+            try:
+                batch = await run_in("db", self.queue.claim, self.tenant, free)
+            except Exception as e:
+                logger.error(f"Update queue {self.tenant}: claim failed: {e}")
+                batch = []
+            for _ in range(free - len(batch)):
+                self._slots.release()
+            for update_id, payload, enqueued_at in batch:
+                _queue_wait.observe(max(time.time() - enqueued_at, 0.0), tenant=self.tenant)
+                task = asyncio.get_running_loop().create_task(self._process(update_id, payload))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            if not batch:
+                if time.monotonic() - last_prune > 3600:
+                    last_prune = time.monotonic()
+                    try:
+                        await run_in("db", self.queue.prune)
+                    except Exception as e:
+                        logger.error(f"Update queue {self.tenant}: prune failed: {e}")
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _process(self, update_id: int, payload: dict) -> None:
+        try:
+            await self.handler(update_id, payload)
+            outcome = "done"
+        except asyncio.CancelledError:
+            # Остановка процесса: запись остается processing и вернется в очередь при запуске
+            _processed.inc(tenant=self.tenant, outcome="interrupted")
+            raise
+        except Exception as e:
+            logger.error(f"Update queue {self.tenant}: update {update_id} failed: {e}")
+            outcome = "error"
+        finally:
+            self._slots.release()
+        # Ошибка обработчика не повторяется: он сам сообщает пользователю об ошибке
+        await self._complete(update_id)
+        _processed.inc(tenant=self.tenant, outcome=outcome)
+
+    async def _complete(self, update_id: int) -> None:
+        """
+        Отмечает обновление завершенным.
+
+        Неотмеченная запись после перезапуска обработалась бы повторно, поэтому
+        при перегрузке пула db или ошибке SQLite отметка повторяется с паузой,
+        а последняя попытка (и отмена во время паузы) выполняется синхронно.
+        """
+        for attempt in range(COMPLETE_ATTEMPTS):
+            try:
+                await run_in("db", self.queue.complete, self.tenant, update_id)
+                return
+            except Exception as e:
+                logger.warning(f"Update queue {self.tenant}: marking update {update_id} done failed "
+                               f"(attempt {attempt + 1}): {e}")
+            try:
+                await asyncio.sleep(0.1 * 2 ** attempt)
+            except asyncio.CancelledError:
+                self._complete_sync(update_id)
+                raise
+        self._complete_sync(update_id)
+
+    def _complete_sync(self, update_id: int) -> None:
+        try:
+            self.queue.complete(self.tenant, update_id)
+        except Exception as e:
+            logger.error(f"Update queue {self.tenant}: update {update_id} left processing, "
+                         f"it will be repeated on restart: {e}")
+
+    async def close(self, timeout: float = 30.0) -> None:
+        """Дожидается обрабатываемых обновлений (не дольше timeout) и останавливает воркеров."""
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"Update queue {self.tenant}: {len(pending)} updates interrupted, "
+                               f"they will be resumed on restart")
+            await asyncio.gather(*pending, return_exceptions=True)
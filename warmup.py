@@ -0,0 +1,138 @@
+"""
+Прогрев моделей при старте бота.
+
+Первый пользователь после перезапуска иначе платит за ленивую инициализацию:
+загрузку весов эмбеддера и первые прогоны его графа, подгрузку индекса
+Chroma в память, первый forward LLM в каждом потоке пула llm (кэши
+oneDNN/OpenVINO, привязка к ядрам). Прогрев прогоняет синтетические вопросы
+через те же этапы, что и обработчик сообщений:
+    - embedding — запрос через эмбеддер, параллельно во всех потоках пула embed;
+    - retrieval — полный поиск по индексу (без кэша поиска);
+    - generation — короткая генерация (WARMUP_MAX_NEW_TOKENS) с коротким и
+      полным контекстом, по одному заданию на каждый поток планировщика LLM.
+
+Время этапов публикуется в метрике warmup_seconds и отправляется
+администратору вместе с уведомлением о запуске.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+import metrics
+from executors import get_executor, run_in
+from async_retrieval import aretrieve_documents, retriever_embeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WARMUP_QUERIES = [
+    "Сколько стоит доставка?",
+    "Как оформить возврат товара?",
+    "Какие способы оплаты вы принимаете?",
+    "Какой у вас график работы и как связаться с поддержкой, если заказ задерживается?",
+]
+
+_warmup_seconds = metrics.gauge("warmup_seconds", "Duration of startup warmup stages")
+
+
+def read_warmup_queries(path: Optional[str] = None) -> List[str]:
+    """Вопросы для прогрева из файла (по одному на строку) или встроенный набор."""
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                queries = [line.strip() for line in f if line.strip()]
+            if queries:
+                return queries
+        except OSError as e:
+            logger.warning(f"Cannot read warmup queries from {path}: {e}")
+    return list(DEFAULT_WARMUP_QUERIES)
+
+
+async def _timed(timings: Dict[str, float], stage: str, coro) -> Any:
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        timings[stage] = time.perf_counter() - started
+        _warmup_seconds.set(timings[stage], stage=stage)
+        logger.info(f"Warmup {stage}: {timings[stage]:.2f}s")
+
+
+async def run_warmup(snapshot: Any, scheduler: Any, answer_fn: Any, queries: List[str],
+                     max_new_tokens: int = 8, tenant: str = "default") -> Dict[str, float]:
+    """
+    Прогревает эмбеддер, индекс и LLM.
+
+    Args:
+        snapshot: Снимок базы знаний (ретривер и QA цепь)
+        scheduler: llm_jobs.LLMScheduler, через который идет генерация
+        answer_fn: Функция генерации по документам (chains.answer_from_documents)
+        queries: Синтетические вопросы
+        max_new_tokens: Длина прогревочной генерации
+        tenant: Тенант, в чью долю очереди LLM идут задания прогрева
+
+    Returns:
+        Dict[str, float]: Длительность этапов в секундах (и total)
+    """
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    retriever = snapshot.qa_chain.retriever
+    embeddings = retriever_embeddings(retriever)
+    embed_workers = get_executor("embed").workers
+
+    if embeddings is not None:
+        # Первый вызов отдельно: загрузка модели и первый прогон графа
+        await _timed(timings, "embedding_first", run_in("embed", embeddings.embed_query, queries[0]))
+        batch = [queries[i % len(queries)] for i in range(embed_workers)]
+        await _timed(timings, "embedding", asyncio.gather(
+            *(run_in("embed", embeddings.embed_query, query) for query in batch)
+        ))
+
+    docs_by_query = await _timed(timings, "retrieval", asyncio.gather(
+        # Тот же путь, что у запросов: пакетный эмбеддинг и поиск по вектору
+        *(aretrieve_documents(retriever, query) for query in queries)
+    ))
+
+    # Короткий контекст (один документ) и полный — как у реальных запросов;
+    # каждое задание занимает свой поток пула llm
+    longest = max(range(len(queries)), key=lambda i: len(docs_by_query[i]))
+    docs = docs_by_query[longest]
+    for stage, context in (("generation_short", docs[:1]), ("generation_full", docs)):
+        await _timed(timings, stage, asyncio.gather(*(
+            scheduler.submit(
+                answer_fn, snapshot.qa_chain, context, queries[(longest + i) % len(queries)], "",
+                priority="admin", max_new_tokens=max_new_tokens, tenant=tenant
+            )
+            for i in range(scheduler.concurrency)
+        )))
+
+    timings["total"] = time.perf_counter() - started
+    _warmup_seconds.set(timings["total"], stage="total")
+    return timings
+
+
+def format_warmup_report(timings: Dict[str, float]) -> str:
+    """Отчет для уведомления администратора."""
+    if not timings:
+        return ""
+    return "Прогрев: " + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in timings.items())
+
+
+async def warmup_from_env(snapshot: Any, scheduler: Any, answer_fn: Any, tenant: str = "default") -> Dict[str, float]:
+    """
+    Прогрев по настройкам окружения (WARMUP, WARMUP_QUERIES_PATH,
+    WARMUP_MAX_NEW_TOKENS, WARMUP_TIMEOUT). Ошибки прогрева не мешают запуску.
+    """
+    if os.getenv("WARMUP", "1") != "1":
+        return {}
+    queries = read_warmup_queries(os.getenv("WARMUP_QUERIES_PATH"))
+    try:
+        return await asyncio.wait_for(
+            run_warmup(snapshot, scheduler, answer_fn, queries, int(os.getenv("WARMUP_MAX_NEW_TOKENS", "8")), tenant),
+            float(os.getenv("WARMUP_TIMEOUT", "300")),
+        )
+    except Exception as e:
+        logger.warning(f"Warmup failed or timed out, continuing without it: {e!r}")
+        return {}
@@ -0,0 +1,192 @@
+"""
+Загрузка весов модели через memory-mapping.
+
+Веса один раз конвертируются в safetensors нужного dtype, после чего каждый
+процесс отображает файлы в память (MAP_PRIVATE) и собирает модель из
+тензоров, ссылающихся прямо на страницы файла. Несколько процессов на одном
+хосте делят одну физическую копию весов через page cache, а холодный старт
+сводится к page faults вместо полной десериализации.
+
+Память процесса (RSS / shared / PSS) доступна через memory_report() и
+метрики process_memory_bytes.
+"""
+
+import os
+import json
+import mmap
+import time
+import shutil
+import struct
+import logging
+from typing import Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_SAFETENSORS_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+# Открытые отображения должны жить, пока живут тензоры модели
+_mappings: List[mmap.mmap] = []
+
+
+def memory_report() -> Dict[str, int]:
+    """
+    Память текущего процесса из /proc/self/smaps_rollup (Linux).
+
+    Returns:
+        Dict[str, int]: rss, shared, private, pss в байтах (пустой словарь вне Linux)
+    """
+    values: Dict[str, int] = {}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return {}
+    return {
+        "rss": values.get("Rss", 0),
+        "shared": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+        "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+        "pss": values.get("Pss", 0),
+    }
+
+
+def _memory_gauge(kind: str):
+    return lambda: memory_report().get(kind, 0)
+
+
+_memory = metrics.gauge("process_memory_bytes", "Process memory by kind (rss, shared, private, pss)")
+for _kind in ("rss", "shared", "private", "pss"):
+    _memory.set_function(_memory_gauge(_kind), kind=_kind)
+
+
+def format_memory_report(report: Dict[str, int]) -> str:
+    return ", ".join(f"{kind}={value / 2 ** 20:.0f}MiB" for kind, value in report.items())
+
+
+def default_mmap_dir(model_id: str, dtype: str) -> str:
+    base = os.getenv("MODEL_MMAP_DIR", "models")
+    return os.path.join(base, f"{model_id.replace('/', '__')}-{dtype}")
+
+
+def convert_to_safetensors(model_id: str, out_dir: str, dtype: str = "float32", cache_dir: Optional[str] = None) -> str:
+    """
+    Сохраняет модель в safetensors заданного dtype (однократно на хост).
+
+    Конвертация идет во временную директорию с последующим rename, поэтому
+    одновременно стартующие процессы не увидят недописанные файлы.
+
+    Returns:
+        str: Директория с конвертированной моделью
+    """
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    if os.path.exists(os.path.join(out_dir, "config.json")):
+        return out_dir
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    started = time.perf_counter()
+    logger.info(f"Converting {model_id} to {dtype} safetensors in {out_dir}...")
+    model = AutoModelForCausalLM.from_pretrained(
+        model_id,
+        torch_dtype=getattr(torch, dtype),
+        low_cpu_mem_usage=True,
+        cache_dir=cache_dir,
+        trust_remote_code=True
+    )
+    model.save_pretrained(tmp_dir, safe_serialization=True, max_shard_size="2GB")
+    AutoTokenizer.from_pretrained(model_id, cache_dir=cache_dir, trust_remote_code=True).save_pretrained(tmp_dir)
+    del model
+    try:
+        os.rename(tmp_dir, out_dir)
+    except OSError:
+        # Другой процесс успел конвертировать раньше
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    logger.info(f"Model converted in {time.perf_counter() - started:.1f}s")
+    return out_dir
+
+
+def mmap_safetensors(path: str) -> Dict[str, "torch.Tensor"]:
+    """
+    Отображает файл safetensors в память и возвращает тензоры поверх него.
+
+    Тензоры не копируются: страницы читаются из page cache при первом
+    обращении и остаются общими между процессами, пока их не изменят
+    (MAP_PRIVATE — запись создает приватную копию страницы, файл не меняется).
+    """
+    import torch
+
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    _mappings.append(mapping)
+
+    data_start = 8 + header_len
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, _SAFETENSORS_DTYPES[info["dtype"]])
+        begin, end = info["data_offsets"]
+        shape = info["shape"]
+        numel = 1
+        for dim in shape:
+            numel *= dim
+        if numel == 0:
+            tensors[name] = torch.empty(shape, dtype=dtype)
+            continue
+        tensors[name] = torch.frombuffer(mapping, dtype=dtype, count=numel, offset=data_start + begin).view(shape)
+    return tensors
+
+
+def _weight_files(model_dir: str) -> List[str]:
+    index_path = os.path.join(model_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            files = sorted(set(json.load(f)["weight_map"].values()))
+        return [os.path.join(model_dir, name) for name in files]
+    return [os.path.join(model_dir, "model.safetensors")]
+
+
+def load_mmap_model(model_dir: str):
+    """
+    Собирает модель из memory-mapped весов без копирования.
+
+    Args:
+        model_dir: Директория, подготовленная convert_to_safetensors
+
+    Returns:
+        PreTrainedModel: Модель в режиме eval на CPU
+    """
+    from accelerate import init_empty_weights
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    started = time.perf_counter()
+    config = AutoConfig.from_pretrained(model_dir, trust_remote_code=True)
+    # Параметры создаются на meta-устройстве (без выделения памяти), буферы — на CPU
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=config.torch_dtype, trust_remote_code=True)
+
+    state_dict = {}
+    for path in _weight_files(model_dir):
+        state_dict.update(mmap_safetensors(path))
+    # assign=True подставляет сами тензоры вместо копирования в параметры
+    missing, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+
+    still_meta = [name for name, param in model.named_parameters() if param.is_meta]
+    if still_meta or unexpected:
+        raise RuntimeError(f"Memory-mapped load incomplete: missing {still_meta[:5]}, unexpected {unexpected[:5]}")
+    model.eval()
+    logger.info(
+        f"Model memory-mapped from {model_dir} in {time.perf_counter() - started:.1f}s "
+        f"({format_memory_report(memory_report())})"
+    )
+    return model